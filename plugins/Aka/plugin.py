@@ -121,6 +121,13 @@ if sqlite3:
             list_ = cursor.fetchall()
             return list_
 
+        def get_akas(self, channel):
+            cursor = self.get_db(channel).cursor()
+            cursor.execute("""SELECT name, alias, locked, locked_by, locked_at
+                              FROM aliases;""")
+            return [(r[0], r[1], bool(r[2]), r[3], r[4])
+                    for r in cursor.fetchall()]
+
         def get_alias(self, channel, name):
             name = callbacks.canonicalName(name, preserve_spaces=True)
             if minisix.PY2 and isinstance(name, str):
@@ -248,6 +255,11 @@ elif sqlalchemy:
             list_ = list(self.get_db(channel).query(SQLAlchemyAlias.name))
             return list_
 
+        def get_akas(self, channel):
+            return list(self.get_db(channel).query(SQLAlchemyAlias.name,
+                    SQLAlchemyAlias.alias, SQLAlchemyAlias.locked,
+                    SQLAlchemyAlias.locked_by, SQLAlchemyAlias.locked_at))
+
         def get_alias(self, channel, name):
             name = callbacks.canonicalName(name, preserve_spaces=True)
             if minisix.PY2 and isinstance(name, str):
@@ -376,6 +388,81 @@ elif 'sqlalchemy' in conf.supybot.databases() and 'sqlalchemy' in available_db:
 else:
     raise plugins.NoSuitableDatabase(['sqlite3', 'sqlalchemy'])
 
+class CachedAkaDB(AkaDB):
+    """Keeps the akas of each channel (their commands and lock state) in
+    memory, so resolving and running them does not query the database.  A
+    channel's akas are read from the database the first time it is looked
+    up; global akas are always kept, and the akas of the 1000 channels
+    used most recently."""
+    def __init__(self, filename):
+        super(CachedAkaDB, self).__init__(filename)
+        self.global_akas = None
+        # Normalized channel -> its akas
+        self.akas = utils.structures.LRUCacheDict(1000)
+
+    def _normalize(self, name):
+        name = callbacks.canonicalName(name, preserve_spaces=True)
+        if minisix.PY2 and isinstance(name, str):
+            name = name.decode('utf8')
+        return name
+
+    def get_cached_akas(self, channel):
+        """Returns a dict from the names of the akas of the channel to their
+        (alias, (locked, locked_by, locked_at))."""
+        if channel == 'global':
+            if self.global_akas is None:
+                self.global_akas = self._read_akas(channel)
+            return self.global_akas
+        key = ircutils.toLower(channel)
+        akas = self.akas.get(key)
+        if akas is None:
+            akas = self._read_akas(channel)
+            self.akas[key] = akas
+        return akas
+
+    def _read_akas(self, channel):
+        return dict((r[0], (r[1], tuple(r[2:])))
+                    for r in self.get_akas(channel))
+
+    def has_aka(self, channel, name):
+        return self._normalize(name) in self.get_cached_akas(channel)
+
+    def get_alias(self, channel, name):
+        aka = self.get_cached_akas(channel).get(self._normalize(name))
+        if aka:
+            return aka[0]
+        else:
+            return None
+
+    def get_aka_lock(self, channel, name):
+        aka = self.get_cached_akas(channel).get(self._normalize(name))
+        if aka:
+            return aka[1]
+        else:
+            raise AkaError(_('This Aka does not exist.'))
+
+    def _reload_aka(self, channel, name):
+        name = self._normalize(name)
+        akas = self.get_cached_akas(channel)
+        akas[name] = (super(CachedAkaDB, self).get_alias(channel, name),
+                      super(CachedAkaDB, self).get_aka_lock(channel, name))
+
+    def add_aka(self, channel, name, alias):
+        super(CachedAkaDB, self).add_aka(channel, name, alias)
+        self._reload_aka(channel, name)
+
+    def lock_aka(self, channel, name, by):
+        super(CachedAkaDB, self).lock_aka(channel, name, by)
+        self._reload_aka(channel, name)
+
+    def unlock_aka(self, channel, name, by):
+        super(CachedAkaDB, self).unlock_aka(channel, name, by)
+        self._reload_aka(channel, name)
+
+    def remove_aka(self, channel, name):
+        super(CachedAkaDB, self).remove_aka(channel, name)
+        self.get_cached_akas(channel).pop(self._normalize(name), None)
+
 class Aka(callbacks.Plugin):
     """Aka is the improved version of the Alias plugin. It stores akas outside
     of the bot.conf, which doesn't have risk of corrupting the bot.conf file
@@ -387,7 +474,9 @@ class Aka(callbacks.Plugin):
         self.__parent.__init__(irc)
         # "sqlalchemy" is only for backward compatibility
         filename = conf.supybot.directories.data.dirize('Aka.sqlalchemy.db')
-        self._db = AkaDB(filename)
+        self._db = CachedAkaDB(filename)
+        # Most lookups are for global akas.
+        self._db.get_cached_akas('global')
 
     def isCommandMethod(self, name):
         args = name.split(' ')
@@ -119,6 +119,40 @@ class AkaChannelTestCase(ChannelPluginTestCase):
         self.assertNotRegexp('aka list', 'foobar')
         self.assertError('foobar')
 
+    def testResolutionDoesNotQueryDatabase(self):
+        cb = self.irc.getCallback('Aka')
+        self.assertNotError('aka add cachedaka echo foo')
+        self.assertNotError('aka add --channel %s cachedaka echo bar' %
+                            self.channel)
+        def get_db(self, channel):
+            raise AssertionError('Database queried for %s.' % channel)
+        Aka.CachedAkaDB.get_db = get_db
+        try:
+            self.assertResponse('cachedaka', 'bar')
+            self.assertResponse('cachedaka', 'foo', to='test')
+        finally:
+            del Aka.CachedAkaDB.get_db
+        self.assertNotError('aka remove --channel %s cachedaka' %
+                            self.channel)
+        self.assertResponse('cachedaka', 'foo')
+
+    def testCachedChannels(self):
+        cb = self.irc.getCallback('Aka')
+        for i in range(1100):
+            self.failIf(cb._db.has_aka('#chan%i' % i, 'cachedaka'))
+        self.failUnless(len(cb._db.akas) <= 1000)
+        self.assertNotError('aka add --channel #Chan1 cachedaka echo bar')
+        self.failUnless(cb._db.has_aka('#chan1', 'cachedaka'))
+
+    def testGlobalAkasAreNotEvicted(self):
+        cb = self.irc.getCallback('Aka')
+        self.assertNotError('aka add globalaka echo foo')
+        global_akas = cb._db.global_akas
+        for i in range(1100):
+            cb._db.has_aka('#chan%i' % i, 'globalaka')
+        self.failUnless(cb._db.global_akas is global_akas)
+        self.assertResponse('globalaka', 'foo')
+
     def testOptionalArgs(self):
         self.assertNotError('aka add myrepr "repr @1"')
         self.assertResponse('myrepr foo', '"foo"')
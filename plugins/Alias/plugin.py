@@ -237,6 +237,8 @@ def makeNewAlias(name, alias):
 class Alias(callbacks.Plugin):
     """This plugin allows users to define aliases to commands and combinations
     of commands (via nesting)."""
+    # Aliases are indexed as they are added and removed.
+    dynamicCommands = False
     def __init__(self, irc):
         self.__parent = super(Alias, self)
         self.__parent.__init__(irc)
@@ -387,6 +389,7 @@ class Alias(callbacks.Plugin):
         conf.registerGlobalValue(aliasGroup.get(confname), 'locked',
                                  registry.Boolean(lock, ''))
         self.aliases[name] = [alias, lock, f]
+        callbacks.commandIndex.add(self)
 
     def removeAlias(self, name, evenIfLocked=False):
         name = callbacks.canonicalName(name)
@@ -394,6 +397,7 @@ class Alias(callbacks.Plugin):
             if evenIfLocked or not self.aliases[name][1]:
                 del self.aliases[name]
                 self.aliasRegistryRemove(name)
+                callbacks.commandIndex.add(self)
             else:
                 raise AliasError('That alias is locked.')
         else:
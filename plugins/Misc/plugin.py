@@ -422,9 +422,9 @@ class Misc(callbacks.Plugin):
         predicates = {}
         nolimit = False
         skipfirst = True
+        channel = None
         if ircutils.isChannel(msg.args[0]):
-            predicates['in'] = lambda m: ircutils.strEqual(m.args[0],
-                                                           msg.args[0])
+            channel = msg.args[0]
         else:
             skipfirst = False
         for (option, arg) in optlist:
@@ -433,9 +433,7 @@ class Misc(callbacks.Plugin):
                     return ircutils.hostmaskPatternEqual(arg, m.nick)
                 predicates['from'] = f
             elif option == 'in':
-                def f(m, arg=arg):
-                    return ircutils.strEqual(m.args[0], arg)
-                predicates['in'] = f
+                channel = arg
                 if arg != msg.args[0]:
                     skipfirst = False
             elif option == 'on':
@@ -469,7 +467,8 @@ class Misc(callbacks.Plugin):
                 predicates.setdefault('regexp', []).append(f)
             elif option == 'nolimit':
                 nolimit = True
-        iterable = filter(self._validLastMsg, reversed(irc.state.history))
+        iterable = filter(self._validLastMsg,
+                          irc.state.messages.search(channel=channel))
         if skipfirst:
             # Drop the first message only if our current channel is the same as
             # the channel we've been instructed to look at.
@@ -518,7 +517,7 @@ class Misc(callbacks.Plugin):
                     return
         if not resp:
             irc.error(_('I couldn\'t find a message matching that criteria in '
-                      'my history of %s messages.') % len(irc.state.history))
+                      'my history of %s messages.') % len(irc.state.messages))
         else:
             irc.reply(format('%L', resp))
     last = wrap(last, [getopts({'nolimit': '',
@@ -183,6 +183,16 @@ class MiscTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.Misc.timestampFormat.setValue(orig)
 
+    def testLastFromOtherNick(self):
+        with conf.supybot.plugins.Misc.timestampFormat.context(''):
+            self.feedMsg('foo bar baz', frm='someone!bar@baz')
+            self.feedMsg('qux', frm='someoneelse!bar@baz')
+            self.assertResponse('last --from someone', '<someone> foo bar baz')
+            self.assertResponse('last --from someone --in %s' % self.channel,
+                                '<someone> foo bar baz')
+            self.assertResponse('last --from someone* --nolimit',
+                                '<someoneelse> qux and <someone> foo bar baz')
+
     def testNestedLastTimestampConfig(self):
         tsConfig = conf.supybot.plugins.Misc.last.nested.includeTimestamp
         orig = tsConfig()
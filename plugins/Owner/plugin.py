@@ -44,6 +44,7 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.ircdb as ircdb
 from supybot.commands import *
+from supybot.commands import processPool
 import supybot.irclib as irclib
 import supybot.plugin as plugin
 import supybot.plugins as plugins
@@ -161,7 +162,7 @@ class Owner(callbacks.Plugin):
         newIrc = irclib.Irc(network)
         for irc in world.ircs:
             if irc != newIrc:
-                newIrc.state.history = irc.state.history
+                newIrc.state.messages = irc.state.messages
         driver = drivers.newDriver(newIrc)
         self._loadPlugins(newIrc)
         return newIrc
@@ -469,6 +470,8 @@ class Owner(callbacks.Plugin):
                 if hasattr(module, 'config'):
                     from imp import reload
                     reload(module.config)
+                # Their processes still have the code of the old module.
+                processPool.restart()
                 for callback in callbacks:
                     callback.die()
                     del callback
@@ -39,6 +39,7 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.commands as commands
 import supybot.callbacks as callbacks
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
 _ = PluginInternationalization('Status')
@@ -90,13 +91,23 @@ class Status(callbacks.Plugin):
     def threads(self, irc, msg, args):
         """takes no arguments
 
-        Returns the current threads that are active.
+        Returns the current threads that are active, and how busy the
+        threads running threaded commands are.
         """
         threads = [t.getName() for t in threading.enumerate()]
         threads.sort()
         s = format(_('I have spawned %n; %n %b still currently active: %L.'),
                    (world.threadsSpawned, 'thread'),
                    (len(threads), 'thread'), len(threads), threads)
+        pool = callbacks.commandThreadPool
+        with pool.lock:
+            s += format(_('  %i of %i threads for threaded commands are busy '
+                          '(at most %i); %n waiting, %n run, and %n rejected.'),
+                        pool.busy, pool.threads,
+                        conf.supybot.commands.threads.maximum(),
+                        (len(pool.queue), 'command'),
+                        (pool.completed, 'command'),
+                        (pool.rejected, 'command'))
         irc.reply(s)
     threads = wrap(threads)
 
@@ -104,7 +115,8 @@ class Status(callbacks.Plugin):
         """takes no arguments
 
         Returns the number of processes that have been spawned, and list of
-        ones that are still active.
+        ones that are still active, and how the things run in other processes
+        were run.
         """
         ps = [multiprocessing.current_process().name]
         ps = ps + [p.name for p in multiprocessing.active_children()]
@@ -112,6 +124,19 @@ class Status(callbacks.Plugin):
                    (world.processesSpawned, 'process'),
                    (len(ps), 'process'),
                    len(ps), ps)
+        pool = commands.processPool
+        with pool.lock:
+            L = []
+            for (n, total) in ((pool.pooled, pool.pooledTime),
+                               (pool.forked, pool.forkedTime)):
+                if n:
+                    L.append(format(_('%n (%.3f seconds on average)'),
+                                    (n, 'call'), total / n))
+                else:
+                    L.append(format(_('%n'), (n, 'call')))
+            s += format(_('  %s run by the processes I keep, %s by new '
+                          'processes; %n killed after timing out.'),
+                        L[0], L[1], (pool.killed, 'process'))
         irc.reply(s)
     processes = wrap(processes)
 
@@ -130,6 +155,34 @@ class Status(callbacks.Plugin):
                   'I have been connected to %s for %s.'),
                   self.recvdMsgs, self.recvdBytes,
                   self.sentMsgs, self.sentBytes, irc.server, timeElapsed))
+        queue = irc.getRealIrc().queue
+        if queue:
+            (depth, target) = max((depth, target) for (target, depth)
+                                  in queue.depths.items())
+            irc.reply(format(_('%n are queued, %i of them for %s.'),
+                             (len(queue), 'message'), depth,
+                             target or _('the server')))
+        hostmasks = irc.getRealIrc().state.nicksToHostmasks
+        irc.reply(format(_('I know %n (%i lookups found them, %i did not, '
+                           'and %i were forgotten).'),
+                         (len(hostmasks), 'hostmask'), hostmasks.hits,
+                         hostmasks.misses, hostmasks.evictions))
+        driver = irc.getRealIrc().driver
+        if hasattr(driver, 'outbufferSize'):
+            s = format(_('%S are waiting to be sent.'), driver.outbufferSize)
+            if driver.flushLatency is not None:
+                s += format(_('  The last message I sent was written %.3f '
+                              'seconds after being queued.'),
+                            driver.flushLatency)
+            irc.reply(s)
+        stageTimes = irc.getRealIrc().stageTimes
+        if stageTimes:
+            times = []
+            for stage in stageTimes.stages:
+                average = stageTimes.average(stage)
+                if average is not None:
+                    times.append('%s %.3f ms' % (stage, average * 1000))
+            irc.reply(format(_('On average, each message spent %L.'), times))
     net = wrap(net)
 
     @internationalizeDocstring
@@ -38,6 +38,17 @@ class StatusTestCase(PluginTestCase):
     def testNet(self):
         self.assertNotError('net')
 
+    def testNetStageTimes(self):
+        with conf.supybot.debug.instrument.context(True):
+            self.assertNotError('net')
+            self.assertNotError('net')
+        replies = []
+        m = self.irc.takeMsg()
+        while m is not None:
+            replies.append(m.args[1])
+            m = self.irc.takeMsg()
+        self.failUnless([r for r in replies if 'callbacks' in r], replies)
+
     def testCpu(self):
         m = self.assertNotError('status cpu')
         self.failIf('kB kB' in m.args[1])
@@ -71,6 +82,7 @@ class StatusTestCase(PluginTestCase):
 
     def testThreads(self):
         self.assertNotError('threads')
+        self.assertRegexp('threads', r'threaded commands are busy')
 
     def testProcesses(self):
         self.assertNotError('processes')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+Adds a number of global akas, and times
+NestedCommandsIrcProxy.findCallbacksForArgs for an aka, a command of another
+plugin and a nonexistent command, with the Aka plugin reading its akas from
+the database (like it used to) and then from Aka.CachedAkaDB.
+
+Usage: aka.py [akas [lookups]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.callbacks as callbacks
+
+
+def lookup(proxy, argss, count):
+    for i in range(count):
+        for args in argss:
+            proxy.findCallbacksForArgs(args)
+
+
+def main():
+    akas = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    irc = irclib.Irc('bench')
+    common.loadPlugins(irc, ['Aka', 'Utilities'])
+    cb = irc.getCallback('Aka')
+    module = sys.modules[cb.__class__.__module__]
+    for i in range(akas):
+        cb._db.add_aka('global', 'aka%i' % i, 'echo %i' % i)
+    argss = [['aka%i' % (akas // 2)], ['echo', 'foo'], ['nonexistent']]
+    proxy = callbacks.NestedCommandsIrcProxy.__new__(
+        callbacks.NestedCommandsIrcProxy)
+    proxy.irc = irc
+    filename = conf.supybot.directories.data.dirize('Aka.sqlalchemy.db')
+    times = []
+    for cls in (module.AkaDB, module.CachedAkaDB):
+        cb._db = cls(filename)
+        elapsed = common.best(lookup, 3, proxy, argss, count)
+        times.append('%s %8.1f us' %
+                     (cls.__name__, elapsed * 1e6 / count / len(argss)))
+    print('%i akas: %s' % (akas, '  '.join(times)))
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
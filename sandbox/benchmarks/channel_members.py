@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Measures the memory used by the ChannelState of a very large channel (a
+synthetic channel with 50k members by default, some of them opped, halfopped
+or voiced), with tracemalloc, and the time it takes to fill it and look up
+its members.
+
+Compares the way members used to be stored (one IrcSet for each of users,
+ops, halfops and voices) with the way they are now (a single normalized nick
+-> flags table).
+
+Usage: channel_members.py [members [channels]]
+
+When several channels are created, they all have the same members (like
+channels of the same project), so nicks can be shared between them.
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import random
+import tracemalloc
+
+import supybot.irclib as irclib
+import supybot.ircutils as ircutils
+
+
+class OldChannelState(object):
+    def __init__(self):
+        self.ops = ircutils.IrcSet()
+        self.bans = ircutils.IrcSet()
+        self.users = ircutils.IrcSet()
+        self.voices = ircutils.IrcSet()
+        self.halfops = ircutils.IrcSet()
+
+    def isOp(self, nick):
+        return nick in self.ops
+
+    def addUser(self, user):
+        nick = user.lstrip('@%+&~!')
+        while user and user[0] in '@%+&~!':
+            (marker, user) = (user[0], user[1:])
+            if marker in '@&~!':
+                self.ops.add(nick)
+            elif marker == '%':
+                self.halfops.add(nick)
+            elif marker == '+':
+                self.voices.add(nick)
+        self.users.add(nick)
+
+
+def makeNames(count, seed=42):
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        nick = '%s%i' % (rng.choice(['nick', 'Nick', 'user', 'Guest']), i)
+        kind = rng.random()
+        if kind < 0.01:
+            nick = '@' + nick
+        elif kind < 0.02:
+            nick = '%' + nick
+        elif kind < 0.1:
+            nick = '+' + nick
+        names.append(nick)
+    return names
+
+
+def fill(cls, names, channels):
+    chans = []
+    for i in range(channels):
+        chan = cls()
+        for name in names:
+            chan.addUser(name)
+        chans.append(chan)
+    return chans
+
+
+def lookup(chans, nicks):
+    for chan in chans:
+        for nick in nicks:
+            nick in chan.users
+            chan.isOp(nick)
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    names = makeNames(members)
+    # The nicks in NAMES replies are new strings, and so are the nicks we
+    # look up.
+    nicks = [ircutils.toLower(name.lstrip('@%+')) for name in names]
+    print('%i channels of %i members' % (channels, members))
+    for cls in (OldChannelState, irclib.ChannelState):
+        tracemalloc.start()
+        (fillTime, chans) = common.timeit(fill, cls, [n.encode().decode()
+                                                      for n in names],
+                                          channels)
+        (size, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        (lookupTime, _) = common.timeit(lookup, chans, nicks)
+        print('%-16s %8.1f MB %8.1f bytes/member   fill %6.3f s   '
+              'lookup %6.3f s' %
+              (cls.__name__, size/2.**20, size/float(members*channels),
+               fillTime, lookupTime))
+        del chans
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
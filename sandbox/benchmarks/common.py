@@ -0,0 +1,158 @@
+"""
+Common setup for the benchmarks in this directory: writes a throwaway
+registry (like supybot-test does) so that benchmarks can create Irc objects
+and load plugins, and provides a few helpers.
+
+Import this module before anything from supybot.
+"""
+
+from __future__ import print_function
+
+import os
+import gc
+import sys
+import time
+import atexit
+import shutil
+import random
+import tempfile
+
+directory = tempfile.mkdtemp(prefix='supybot-bench-')
+atexit.register(shutil.rmtree, directory, True)
+
+registryFilename = os.path.join(directory, 'bench.conf')
+with open(registryFilename, 'w') as fd:
+    fd.write("""
+supybot.directories.data: %(dir)s/data
+supybot.directories.conf: %(dir)s/conf
+supybot.directories.log: %(dir)s/logs
+supybot.log.stdout: False
+supybot.log.level: ERROR
+supybot.protocols.irc.throttleTime: 0
+supybot.protocols.irc.ping: False
+supybot.networks.bench.servers: 127.0.0.1:6667
+supybot.networks.bench.ssl: False
+supybot.networks.bench.requireStarttls: False
+supybot.nick: bench
+""" % {'dir': directory})
+
+import supybot.registry as registry
+registry.open_registry(registryFilename)
+
+import supybot.log as log
+import supybot.conf as conf
+import supybot.world as world
+conf.supybot.flush.setValue(False)
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+
+class NullCallback(irclib.IrcCallback):
+    """Irc objects complain when they have no callback at all."""
+    pass
+
+
+def newIrc(network='bench', nick='bench'):
+    irc = irclib.Irc(network)
+    if not irc.getCallback('NullCallback'):
+        irc.addCallback(NullCallback())
+    while irc.takeMsg():
+        pass
+    irc.feedMsg(ircmsgs.IrcMsg(':irc.server 001 %s :Welcome' % nick))
+    irc.feedMsg(ircmsgs.IrcMsg(':irc.server 376 %s :End of MOTD' % nick))
+    while irc.takeMsg():
+        pass
+    return irc
+
+
+def loadPlugins(irc, names=None):
+    """Loads the given plugins (all those shipped with the bot, if names is
+    None) in the Irc object, and returns the names of those which loaded;
+    some need dependencies which may not be installed."""
+    import supybot.plugin as plugin
+    if names is None:
+        names = sorted(name for name in os.listdir(plugin._pluginsDir)
+                       if os.path.exists(os.path.join(plugin._pluginsDir,
+                                                      name, 'plugin.py')))
+    # Owner has to be first, and Misc last.
+    names = ['Owner'] + [name for name in names
+                         if name not in ('Owner', 'Misc')] + ['Misc']
+    loaded = []
+    for name in names:
+        if irc.getCallback(name):
+            loaded.append(name)
+            continue
+        try:
+            module = plugin.loadPluginModule(name)
+            plugin.loadPluginClass(irc, module)
+        except Exception:
+            continue
+        loaded.append(name)
+    while irc.takeMsg():
+        pass
+    return loaded
+
+
+def timeit(f, *args, **kwargs):
+    """Returns (seconds, result) of calling f once, with the garbage
+    collector disabled."""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        return (time.perf_counter() - start, result)
+    finally:
+        gc.enable()
+
+
+def best(f, repeat=3, *args, **kwargs):
+    """Returns the best time of several calls to f."""
+    return min(timeit(f, *args, **kwargs)[0] for i in range(repeat))
+
+
+_words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+          'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+def randomNick(rng=random):
+    return 'nick%s%i' % (rng.choice('abcdefghij'), rng.randrange(100000))
+
+def randomHostmask(rng=random, nick=None):
+    nick = nick or randomNick(rng)
+    return '%s!~%s@host-%i.example.net' % (nick, nick[:8],
+                                           rng.randrange(100000))
+
+def randomText(rng=random, words=12):
+    return ' '.join(rng.choice(_words) for i in range(words))
+
+def trafficLines(count, tags=False, channels=100, seed=42):
+    """Generates lines (str, without line terminator) looking like what a
+    bot in many busy channels receives."""
+    rng = random.Random(seed)
+    channels = ['#chan%i' % i for i in range(channels)]
+    for i in range(count):
+        prefix = ''
+        if tags:
+            prefix = ('@time=2026-10-18T12:%02i:%02i.%03iZ;account=acc%i '
+                      % (rng.randrange(60), rng.randrange(60),
+                         rng.randrange(1000), rng.randrange(1000)))
+        kind = rng.random()
+        channel = rng.choice(channels)
+        if kind < 0.75:
+            line = ':%s PRIVMSG %s :%s' % (randomHostmask(rng), channel,
+                                           randomText(rng))
+        elif kind < 0.85:
+            line = ':irc.server 353 bench = %s :%s' % (channel,
+                    ' '.join(rng.choice(['', '@', '+']) + randomNick(rng)
+                             for j in range(40)))
+        elif kind < 0.92:
+            line = ':%s JOIN %s' % (randomHostmask(rng), channel)
+        elif kind < 0.97:
+            line = ':%s PART %s :%s' % (randomHostmask(rng), channel,
+                                        randomText(rng, 3))
+        else:
+            line = ':%s QUIT :%s' % (randomHostmask(rng), randomText(rng, 2))
+        yield prefix + line
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Replays what the bot receives when it joins many channels on connect: for
+each channel, the JOIN, the NAMES reply (353 lines, then 366), the WHOX
+reply the bot asks for (354 lines, then 315) and the MODE replies, through
+Irc.feedMsg, and only through IrcState.addMsg.  Messages are parsed
+beforehand.
+
+Usage: connect.py [channels [members [userhost-in-names]]]
+
+Channel sizes vary around the given number of members.  Pass 1 as third
+argument to send NAMES replies with full hostmasks (userhost-in-names) and
+multiple prefixes (multi-prefix).
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import random
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+
+def makeBurst(channels, members, userhosts, seed=42):
+    rng = random.Random(seed)
+    # Users are in several of the bot's channels.
+    population = [common.randomHostmask(rng) for i in range(members * 10)]
+    lines = []
+    for i in range(channels):
+        channel = '#chan%i' % i
+        size = int(rng.expovariate(1. / members)) + 1
+        hostmasks = rng.sample(population, min(size, len(population)))
+        lines.append(':bench!~bench@bench.example.net JOIN %s' % channel)
+        names = []
+        for hostmask in hostmasks:
+            prefix = rng.choice(['', '', '', '', '+', '@', '@+'])
+            if not userhosts:
+                prefix = prefix[:1]
+                hostmask = hostmask.split('!')[0]
+            names.append(prefix + hostmask)
+        names.append('@bench')
+        for j in range(0, len(names), 20 if userhosts else 50):
+            lines.append(':irc.server 353 bench = %s :%s' %
+                         (channel, ' '.join(names[j:j+50])))
+        lines.append(':irc.server 366 bench %s :End of /NAMES list.' %
+                     channel)
+        for hostmask in hostmasks:
+            (nick, rest) = hostmask.split('!')
+            (user, host) = rest.split('@')
+            lines.append(':irc.server 354 bench 1 %s %s %s 0' %
+                         (user, host, nick))
+        lines.append(':irc.server 315 bench %s :End of /WHO list.' % channel)
+        lines.append(':irc.server 324 bench %s +nt' % channel)
+        lines.append(':irc.server 329 bench %s 1500000000' % channel)
+        lines.append(':irc.server 368 bench %s :End of Channel Ban List' %
+                     channel)
+    return lines
+
+
+def replay(msgs):
+    irc = common.newIrc()
+    for msg in msgs:
+        irc.feedMsg(msg)
+        while irc.takeMsg():
+            pass
+    return irc
+
+
+def replayState(msgs):
+    irc = common.newIrc()
+    state = irclib.IrcState()
+    for msg in msgs:
+        state.addMsg(irc, msg)
+    irc._reallyDie()
+    return state
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    members = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    userhosts = len(sys.argv) > 3 and sys.argv[3] == '1'
+    lines = makeBurst(channels, members, userhosts)
+    (elapsed, irc) = common.timeit(replay,
+                                   [ircmsgs.IrcMsg(line) for line in lines])
+    users = sum(len(c.users) for c in irc.state.channels.values())
+    print('%i channels, %i memberships, %i lines' %
+          (len(irc.state.channels), users, len(lines)))
+    print('Irc.feedMsg:     %6.2f s (%i lines/s)' %
+          (elapsed, len(lines)/elapsed))
+    irc._reallyDie()
+    (elapsed, state) = common.timeit(replayState,
+                                     [ircmsgs.IrcMsg(line) for line in lines])
+    assert state.channels == irc.state.channels
+    print('IrcState.addMsg: %6.2f s (%i lines/s)' %
+          (elapsed, len(lines)/elapsed))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Loads all the plugins that can be loaded, and feeds messages of a few
+commands (PING, 005, JOIN, PRIVMSG) through Irc.feedMsg, with the callbacks
+to call for each message taken from the Irc object's dispatch tables, or
+(like it used to be) with every callback being called for every message.
+
+Usage: dispatch.py [messages]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+
+class AllCallbacksIrc(irclib.Irc):
+    def _getSubscribers(self, command):
+        return self.callbacks
+
+    def _getInFilters(self):
+        return self.callbacks
+
+    def _getOutFilters(self):
+        return list(reversed(self.callbacks))
+
+
+def feed(irc, msgs):
+    for msg in msgs:
+        irc.feedMsg(msg)
+        while irc.takeMsg():
+            pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    kinds = [
+        ('PING', ircmsgs.IrcMsg('PING :irc.server')),
+        ('005', ircmsgs.IrcMsg(':irc.server 005 bench CHANTYPES=# '
+                               'PREFIX=(ov)@+ NETWORK=bench :are supported')),
+        ('JOIN', ircmsgs.IrcMsg(':foo!bar@baz JOIN #chan')),
+        ('PRIVMSG', ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #chan :hello')),
+    ]
+    results = []
+    for cls in (AllCallbacksIrc, irclib.Irc):
+        irc = cls('bench')
+        common.loadPlugins(irc)
+        while irc.takeMsg():
+            pass
+        irc.feedMsg(ircmsgs.IrcMsg(':irc.server 001 bench :Welcome'))
+        irc.feedMsg(ircmsgs.IrcMsg(':bench!bench@bench JOIN #chan'))
+        times = []
+        for (kind, msg) in kinds:
+            elapsed = common.best(feed, 3, irc, [msg] * count)
+            times.append('%s %6.1f us' % (kind, elapsed * 1e6 / count))
+        results.append('%-15s %s' % (cls.__name__, '  '.join(times)))
+        if cls is irclib.Irc:
+            print('%i callbacks; called for PING: %i, 005: %i, JOIN: %i, '
+                  'PRIVMSG: %i; %i inFilters, %i outFilters' %
+                  ((len(irc.callbacks),) +
+                   tuple(len(irc._getSubscribers(kind))
+                         for (kind, msg) in kinds) +
+                   (len(irc._getInFilters()), len(irc._getOutFilters()))))
+        irc._reallyDie()
+    for line in results:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
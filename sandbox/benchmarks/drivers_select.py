@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+Compares the way the Socket driver waits for input: rebuilding a list of
+sockets for select.select() on every loop (the old way), versus keeping them
+registered in a selectors.DefaultSelector (epoll on Linux).
+
+For each number of connections, reports:
+* the CPU time spent per loop iteration when nothing is readable,
+* the CPU time used while idle for a few seconds,
+* the latency between a line being written by the "server" and the loop
+  waking up to read it.
+
+Usage: drivers_select.py [connections ...]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import errno
+import random
+import select
+import socket
+import threading
+
+import selectors
+
+
+class Connection(object):
+    def __init__(self):
+        (self.conn, self.server) = socket.socketpair()
+        self.conn.setblocking(False)
+        self.connected = True
+
+
+class SelectLoop(object):
+    """What SocketDriver._select used to do."""
+    name = 'select.select'
+
+    def __init__(self, connections):
+        self.instances = list(connections)
+
+    def wait(self, timeout):
+        for inst in self.instances:
+            if not inst.connected or inst.conn._closed:
+                self.instances.remove(inst)
+        rlist, _, _ = select.select([x.conn for x in self.instances],
+                                    [], [], timeout)
+        return [x for x in self.instances if x.conn in rlist]
+
+    def close(self):
+        pass
+
+
+class SelectorLoop(object):
+    """What SocketDriver._select does now."""
+    name = 'selectors'
+
+    def __init__(self, connections):
+        self.selector = selectors.DefaultSelector()
+        for inst in connections:
+            self.selector.register(inst.conn, selectors.EVENT_READ, inst)
+
+    def wait(self, timeout):
+        return [key.data for (key, _) in self.selector.select(timeout)]
+
+    def close(self):
+        self.selector.close()
+
+
+def cpu():
+    return time.process_time()
+
+
+def benchIterations(loop, iterations=2000):
+    start = cpu()
+    for i in range(iterations):
+        loop.wait(0)
+    return (cpu() - start) / iterations
+
+
+def benchIdle(loop, duration=3., poll=0.1):
+    start = cpu()
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        loop.wait(poll)
+    return cpu() - start
+
+
+def benchLatency(loop, connections, samples=50, poll=1.0):
+    latencies = []
+    for i in range(samples):
+        inst = random.choice(connections)
+        sentAt = []
+        def write():
+            time.sleep(random.uniform(0.001, 0.01))
+            sentAt.append(time.time())
+            inst.server.send(b'PING :x\r\n')
+        writer = threading.Thread(target=write)
+        writer.start()
+        readable = []
+        while not readable:
+            readable = loop.wait(poll)
+        now = time.time()
+        writer.join()
+        latencies.append(now - sentAt[0])
+        for x in readable:
+            try:
+                x.conn.recv(4096)
+            except socket.error as e:
+                if e.args[0] != errno.EAGAIN:
+                    raise
+    latencies.sort()
+    return (latencies[len(latencies)//2], latencies[-1])
+
+
+def main():
+    counts = [int(x) for x in sys.argv[1:]] or [1, 40, 200, 1000]
+    print('%6s  %-14s %14s %12s %12s %12s' % ('conns', 'loop',
+          'us/iteration', 'idle cpu s', 'p50 wake ms', 'max wake ms'))
+    for count in counts:
+        connections = [Connection() for i in range(count)]
+        for cls in (SelectLoop, SelectorLoop):
+            loop = cls(connections)
+            try:
+                perIteration = benchIterations(loop)
+                idle = benchIdle(loop)
+                (p50, worst) = benchLatency(loop, connections)
+            except ValueError as e:
+                # select.select() cannot handle fds >= FD_SETSIZE.
+                print('%6i  %-14s %s' % (count, cls.name, e))
+                continue
+            finally:
+                loop.close()
+            print('%6i  %-14s %14.2f %12.4f %12.3f %12.3f' %
+                  (count, cls.name, perIteration*1e6, idle,
+                   p50*1e3, worst*1e3))
+        for inst in connections:
+            inst.conn.close()
+            inst.server.close()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+Feeds lines of IRC traffic through drivers.parseMsg and Irc.feedMsg, and
+takes the replies with Irc.takeMsg, with the log level (of the logfile) set
+to ERROR and then to DEBUG.  Then does it again with supybot.debug.instrument
+on, and prints the average time each message spent in each stage.
+
+Usage: feed.py [lines]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+
+
+def feed(irc, lines):
+    parseMsg = drivers.parseMsg
+    for line in lines:
+        irc.feedMsg(parseMsg(line))
+        while irc.takeMsg():
+            pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    lines = [line for line in common.trafficLines(count)
+             if ' 353 ' not in line] # Not sent without a JOIN.
+    irc = common.newIrc()
+    for level in ('ERROR', 'DEBUG'):
+        conf.supybot.log.level.set(level)
+        elapsed = common.best(feed, 3, irc, lines)
+        print('log level %-6s %8i lines %7.3f s %9i lines/s' %
+              (level, len(lines), elapsed, len(lines)/elapsed))
+    conf.supybot.log.level.set('ERROR')
+    conf.supybot.debug.instrument.setValue(True)
+    irc.stageTimes.reset()
+    feed(irc, lines)
+    for stage in irc.stageTimes.stages:
+        average = irc.stageTimes.average(stage)
+        if average is not None:
+            print('%-10s %7.2f us/message' % (stage, average * 1e6))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Loads all the plugins that can be loaded, plus generated ones (with ten
+commands each) up to the given number of plugins, and times
+NestedCommandsIrcProxy.findCallbacksForArgs for a few commands, with
+callbacks.commandIndex and with every plugin being asked (like it used to
+be).  Then does it again without the Aka plugin, whose commands are
+dynamic, so it is asked for every command anyway.
+
+Usage: find_commands.py [plugins [lookups]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.irclib as irclib
+import supybot.callbacks as callbacks
+
+
+class AllCallbacksIndex(callbacks.CommandIndex):
+    def getCandidates(self, callbacks, args):
+        return [cb for cb in callbacks if hasattr(cb, 'getCommand')]
+
+
+def makePlugin(i):
+    def command(self, irc, msg, args):
+        irc.reply('ok')
+    attrs = dict(('command%i%i' % (i, j), command) for j in range(10))
+    return type('Generated%i' % i, (callbacks.Plugin,), attrs)
+
+
+def lookup(proxy, argss, count):
+    for i in range(count):
+        for args in argss:
+            proxy.findCallbacksForArgs(args)
+
+
+def main():
+    plugins = int(sys.argv[1]) if len(sys.argv) > 1 else 80
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    irc = irclib.Irc('bench')
+    common.loadPlugins(irc)
+    i = 0
+    while len(irc.callbacks) < plugins:
+        irc.addCallback(makePlugin(i)(irc))
+        i += 1
+    argss = [['echo', 'foo'], ['channel', 'capability', 'add', 'foo'],
+             ['config', 'list'], ['command55', 'foo'], ['nonexistent']]
+    proxy = callbacks.NestedCommandsIrcProxy.__new__(
+        callbacks.NestedCommandsIrcProxy)
+    proxy.irc = irc
+    index = callbacks.commandIndex
+    for withAka in (True, False):
+        if not withAka:
+            irc.removeCallback('Aka')
+        times = []
+        for name in ('AllCallbacksIndex', 'CommandIndex'):
+            if name == 'AllCallbacksIndex':
+                callbacks.commandIndex = AllCallbacksIndex()
+            else:
+                callbacks.commandIndex = index
+            elapsed = common.best(lookup, 3, proxy, argss, count)
+            times.append('%s %7.1f us' %
+                         (name, elapsed * 1e6 / count / len(argss)))
+        print('%i plugins: %s' % (len(irc.callbacks), '  '.join(times)))
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Compares keeping a long history of messages as a RingBuffer of IrcMsg
+objects, scanned linearly to find the last messages of a nick or channel
+(like Misc.last used to do), with keeping it in an irclib.MessageHistory.
+
+Reports the memory used by each (with tracemalloc), and the time taken by
+queries for the last message of a nick, of a channel, and of a nick in a
+channel (half of them for nicks that never talked).
+
+Usage: history.py [lines [queries]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import random
+import tracemalloc
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+from supybot.utils.structures import RingBuffer
+
+
+class ScannedHistory(object):
+    def __init__(self, maxSize):
+        self.msgs = RingBuffer(maxSize)
+
+    def append(self, msg):
+        self.msgs.append(msg)
+
+    def last(self, n=1, channel=None, nick=None):
+        ret = []
+        for msg in reversed(self.msgs):
+            if msg.command != 'PRIVMSG':
+                continue
+            if channel is not None and \
+                    not ircutils.strEqual(msg.args[0], channel):
+                continue
+            if nick is not None and not ircutils.strEqual(msg.nick, nick):
+                continue
+            ret.append(msg)
+            if len(ret) >= n:
+                break
+        return ret
+
+
+def makeMsgs(count):
+    msgs = []
+    for line in common.trafficLines(count * 2):
+        msg = ircmsgs.IrcMsg(line)
+        if msg.command == 'PRIVMSG':
+            msg.tag('receivedAt', msg.time)
+            msgs.append(msg)
+            if len(msgs) >= count:
+                break
+    return msgs
+
+
+def fill(cls, msgs):
+    history = cls(len(msgs))
+    for msg in msgs:
+        history.append(msg)
+    return history
+
+
+def query(history, queries):
+    for (channel, nick) in queries:
+        history.last(1, channel=channel, nick=nick)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queryCount = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rng = random.Random(42)
+    msgs = makeMsgs(count)
+    nicks = [m.nick for m in rng.sample(msgs, queryCount // 2)]
+    nicks += [common.randomNick(rng) + '_' for i in range(queryCount // 2)]
+    channels = [m.args[0] for m in rng.sample(msgs, queryCount)]
+    kinds = [('nick', [(None, nick) for nick in nicks]),
+             ('channel', [(channel, None) for channel in channels]),
+             ('both', list(zip(channels, nicks)))]
+    print('%i messages, %i queries of each kind' % (len(msgs), queryCount))
+    for cls in (ScannedHistory, irclib.MessageHistory):
+        # The messages are kept alive by the list anyway, so only their
+        # parsed form (not kept by MessageHistory) is counted.
+        histories = []
+        tracemalloc.start()
+        source = [ircmsgs.IrcMsg(str(m).rstrip('\r\n')) for m in msgs]
+        for m in source:
+            m.tag('receivedAt', m.time)
+        (fillTime, history) = common.timeit(fill, cls, source)
+        del source
+        (size, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        times = []
+        for (kind, queries) in kinds:
+            (elapsed, _) = common.timeit(query, history, queries)
+            times.append('%s %7.2f ms/query' %
+                         (kind, elapsed * 1000 / len(queries)))
+        print('%-15s %7.1f MB  fill %5.2f s  %s' %
+              (cls.__name__, size / 2.**20, fillTime, '  '.join(times)))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
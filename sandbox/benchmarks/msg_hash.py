@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+Builds many IrcMsg objects from lines of IRC traffic, stores them in a set
+and in a dict, and looks each of them (and an equal copy of each of them) up,
+reporting the time taken by each step and the memory used by the messages.
+
+Usage: msg_hash.py [messages]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import tracemalloc
+
+import supybot.ircmsgs as ircmsgs
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = list(common.trafficLines(count))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    (elapsed, msgs) = common.timeit(lambda: [ircmsgs.IrcMsg(line)
+                                             for line in lines])
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('build %i messages:    %7.3f s  %7.1f MB' %
+          (count, elapsed, memory / 2.**20))
+    copies = [ircmsgs.IrcMsg(line) for line in lines]
+    (elapsed, s) = common.timeit(set, msgs)
+    print('set of messages:       %7.3f s' % elapsed)
+    (elapsed, d) = common.timeit(dict, ((msg, None) for msg in msgs))
+    print('dict of messages:      %7.3f s' % elapsed)
+    def lookup(container, keys):
+        for key in keys:
+            key in container
+    print('lookup of the same:    %7.3f s' %
+          common.timeit(lookup, s, msgs)[0])
+    print('lookup of equal ones:  %7.3f s' %
+          common.timeit(lookup, d, copies)[0])
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Runs a command with a few nested commands of threaded plugins (each taking
+some time, like fetching a page would), like 'echo [slow0] [slow1] [slow2]',
+with the nested commands evaluated one after the other and then with
+supybot.commands.nested.concurrent.  Prints the time until each reply.
+
+Usage: nested.py [commands [nested commands [seconds per nested command]]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.ircmsgs as ircmsgs
+import supybot.callbacks as callbacks
+
+
+def makePlugin(i, duration):
+    def command(self, irc, msg, args):
+        time.sleep(duration)
+        irc.reply('done')
+    return type('Slow%i' % i, (callbacks.Plugin,),
+                {'threaded': True, 'slow%i' % i: command})
+
+
+def run(irc, count, plugins):
+    s = 'echo %s' % ' '.join(['[slow%i]' % i for i in range(plugins)])
+    msg = ircmsgs.privmsg('bench', s, prefix='foo!bar@baz')
+    start = time.time()
+    for i in range(count):
+        irc.feedMsg(msg)
+        m = None
+        while m is None or m.command not in ('PRIVMSG', 'NOTICE'):
+            m = irc.takeMsg()
+            if m is None:
+                time.sleep(0.001)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    plugins = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    conf.supybot.abuse.flood.command.setValue(False)
+    irc = common.newIrc()
+    common.loadPlugins(irc, ['Utilities'])
+    for i in range(plugins):
+        irc.addCallback(makePlugin(i, duration)(irc))
+    for concurrent in (False, True):
+        conf.supybot.commands.nested.concurrent.setValue(concurrent)
+        elapsed = run(irc, count, plugins)
+        print('%-10s %4i commands %6.2f s %7.1f ms/command'
+              % (concurrent and 'concurrent' or 'sequential', count,
+                 elapsed, elapsed * 1e3 / count))
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
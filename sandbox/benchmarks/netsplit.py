@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Replays a netsplit (thousands of QUITs, then the matching NICKs of the users
+who come back under another nick) through IrcState, the way it used to be
+handled (looking for the nick in every channel) and the way it is now
+(looking up the channels of the nick in IrcState's index).
+
+Usage: netsplit.py [channels [users [channels-per-user]]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import random
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+
+
+class OldIrcState(irclib.IrcState):
+    def doQuit(self, irc, msg):
+        channel_names = ircutils.IrcSet()
+        for (name, channel) in self.channels.items():
+            if msg.nick in channel.users:
+                channel_names.add(name)
+                channel.removeUser(msg.nick)
+        msg.tag('channels', channel_names)
+        if msg.nick in self.nicksToHostmasks:
+            del self.nicksToHostmasks[msg.nick]
+
+    def doNick(self, irc, msg):
+        newNick = msg.args[0]
+        oldNick = msg.nick
+        try:
+            if msg.user and msg.host:
+                newHostmask = ircutils.joinHostmask(newNick, msg.user,
+                                                    msg.host)
+                self.nicksToHostmasks[newNick] = newHostmask
+            del self.nicksToHostmasks[oldNick]
+        except KeyError:
+            pass
+        channel_names = ircutils.IrcSet()
+        for (name, channel) in self.channels.items():
+            if msg.nick in channel.users:
+                channel_names.add(name)
+            channel.replaceUser(oldNick, newNick)
+        msg.tag('channels', channel_names)
+
+
+def populate(cls, irc, channels, users, perUser, seed=42):
+    rng = random.Random(seed)
+    state = cls()
+    names = ['#chan%i' % i for i in range(channels)]
+    for name in names:
+        state.addMsg(irc, ircmsgs.join(name, prefix=irc.prefix))
+    hostmasks = []
+    for i in range(users):
+        hostmask = '%s%i!~user@host-%i.example.net' % ('nick', i, i)
+        hostmasks.append(hostmask)
+        for name in rng.sample(names, perUser):
+            state.addMsg(irc, ircmsgs.join(name, prefix=hostmask))
+    return (state, hostmasks)
+
+
+def replay(state, irc, msgs):
+    for msg in msgs:
+        state.addMsg(irc, msg)
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    perUser = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    irc = common.newIrc()
+    print('%i channels, %i users in %i channels each' %
+          (channels, users, perUser))
+    for cls in (OldIrcState, irclib.IrcState):
+        (state, hostmasks) = populate(cls, irc, channels, users, perUser)
+        nicks = [ircutils.nickFromHostmask(h) for h in hostmasks]
+        nickMsgs = [ircmsgs.IrcMsg(prefix=h, command='NICK',
+                                   args=(n + '_',))
+                    for (h, n) in zip(hostmasks, nicks)]
+        quitMsgs = [ircmsgs.IrcMsg(prefix=h.replace('!', '_!', 1),
+                                   command='QUIT', args=('*.net *.split',))
+                    for h in hostmasks]
+        (nickTime, _) = common.timeit(replay, state, irc, nickMsgs)
+        (quitTime, _) = common.timeit(replay, state, irc, quitMsgs)
+        assert all(len(c.users) == 1 for c in state.channels.values())
+        print('%-12s %6i NICKs %8.3f s %9i/s   %6i QUITs %8.3f s %9i/s' %
+              (cls.__name__, len(nickMsgs), nickTime, len(nickMsgs)/nickTime,
+               len(quitMsgs), quitTime, len(quitMsgs)/quitTime))
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
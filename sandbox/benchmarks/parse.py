@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+Parses lines of IRC traffic with drivers.parseMsg, and then parses them
+again and reads the attributes plugins usually look at (nick, time,
+server_tags), which are computed lazily.
+
+Usage: parse.py [lines [recorded-file]]
+
+Without a recorded file, traffic is generated (with and without IRCv3
+tags).  A recorded file is a raw log of lines received from a server.
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.drivers as drivers
+
+
+def parse(lines):
+    parseMsg = drivers.parseMsg
+    for line in lines:
+        parseMsg(line)
+
+def parseAndRead(lines):
+    parseMsg = drivers.parseMsg
+    for line in lines:
+        msg = parseMsg(line)
+        (msg.nick, msg.time, msg.server_tags)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'rb') as fd:
+            lines = [line.decode('utf8', 'replace')
+                     for line in fd.read().split(b'\n') if line.strip()]
+        traffic = [('recorded', lines[:count])]
+    else:
+        traffic = [('no tags', list(common.trafficLines(count))),
+                   ('with tags', list(common.trafficLines(count, tags=True)))]
+    for (name, lines) in traffic:
+        for f in (parse, parseAndRead):
+            elapsed = common.best(f, 3, lines)
+            print('%-10s %-14s %8i lines %7.3f s %9i lines/s' %
+                  (name, f.__name__, len(lines), elapsed,
+                   len(lines)/elapsed))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
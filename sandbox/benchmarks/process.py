@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+Runs a regexp search through commands.regexp_wrapper (as MessageParser and
+the regexpMatcher converter do) many times, with a new process forked for
+each call (like it used to be) and then with commands.processPool.  Prints
+the time each call takes.
+
+Usage: process.py [calls]
+"""
+
+from __future__ import print_function
+
+import common
+
+import re
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.world as world
+import supybot.commands as commands
+
+
+def search(count, reobj):
+    start = time.time()
+    for i in range(count):
+        commands.regexp_wrapper('foo bar baz', reobj, timeout=5,
+                                plugin_name='Bench', fcn_name='search')
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    world.disableMultiprocessing = False # Set by scripts/supybot.
+    reobj = re.compile(r'b[a-z]+z')
+    workers = conf.supybot.commands.processes.workers()
+    for (name, n) in (('forked', 0), ('pooled', workers)):
+        conf.supybot.commands.processes.workers.setValue(n)
+        elapsed = search(count, reobj)
+        print('%-7s %6i calls %7.3f s %8.1f us/call' %
+              (name, count, elapsed, elapsed * 1e6 / count))
+    conf.supybot.commands.processes.workers.setValue(workers)
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
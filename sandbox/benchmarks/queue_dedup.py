@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Enqueues many messages in an IrcMsgQueue with
+supybot.protocols.irc.queuing.duplicates on, checking for duplicates by
+scanning the queue (the old way) or with the queue's index (the new way).
+
+Usage: queue_dedup.py [messages ...]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+
+class ScanningIrcMsgQueue(irclib.IrcMsgQueue):
+    __slots__ = ()
+    def __contains__(self, msg):
+        return any(msg == x[-1] for x in self.msgs)
+
+
+def fill(cls, msgs):
+    q = cls()
+    for msg in msgs:
+        q.enqueue(msg)
+    return q
+
+
+def main():
+    counts = [int(x) for x in sys.argv[1:]] or [1000, 10000]
+    conf.supybot.protocols.irc.queuing.duplicates.setValue(True)
+    print('%8s  %-20s %10s %14s' % ('messages', 'queue', 'seconds',
+                                    'us/enqueue'))
+    for count in counts:
+        # One message in ten is a duplicate.
+        msgs = [ircmsgs.privmsg('#chan%i' % (i % 10), 'line %i' % (i % (count
+                                * 9 // 10)))
+                for i in range(count)]
+        for cls in (ScanningIrcMsgQueue, irclib.IrcMsgQueue):
+            elapsed = common.best(fill, 3, cls, msgs)
+            print('%8i  %-20s %10.3f %14.2f' % (count, cls.__name__, elapsed,
+                                                elapsed/count*1e6))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
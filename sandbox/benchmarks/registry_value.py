@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+Loads ChannelLogger, Seen, ChannelStats and MessageParser, and feeds lines of
+IRC traffic through Irc.feedMsg, with PluginMixin.registryValue walking the
+registry for every call (like it used to) and then with the registry nodes it
+finds being kept by the plugins.  Also prints how many times registryValue
+is called for each message.
+
+Usage: registry_value.py [lines]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.drivers as drivers
+import supybot.callbacks as callbacks
+
+registryValue = callbacks.PluginMixin.registryValue
+calls = [0]
+
+
+def walkingRegistryValue(self, name, channel=None, value=True):
+    group = self._getRegistryNode(name, channel)
+    if value:
+        return group()
+    else:
+        return group
+
+
+def countingRegistryValue(self, name, channel=None, value=True):
+    calls[0] += 1
+    return registryValue(self, name, channel, value)
+
+
+def feed(irc, msgs):
+    for msg in msgs:
+        irc.feedMsg(msg)
+        while irc.takeMsg():
+            pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    msgs = [drivers.parseMsg(line) for line in common.trafficLines(count)
+            if ' 353 ' not in line] # Not sent without a JOIN.
+    irc = common.newIrc()
+    loaded = common.loadPlugins(irc, ['ChannelLogger', 'Seen',
+                                      'ChannelStats', 'MessageParser'])
+    print('Plugins: %s' % ', '.join(loaded))
+    callbacks.PluginMixin.registryValue = countingRegistryValue
+    feed(irc, msgs)
+    print('%.2f registryValue calls per message' %
+          (calls[0] / float(len(msgs))))
+    for (name, f) in (('walking', walkingRegistryValue),
+                      ('cached', registryValue)):
+        callbacks.PluginMixin.registryValue = f
+        elapsed = common.best(feed, 3, irc, msgs)
+        print('%-8s %8i lines %7.3f s %7.1f us/message' %
+              (name, len(msgs), elapsed, elapsed * 1e6 / len(msgs)))
+    callbacks.PluginMixin.registryValue = registryValue
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+Runs the driver loop with an idle Socket driver and many scheduled events,
+and measures how late the events run and how much CPU the loop uses,
+with the loop blocking for supybot.drivers.poll seconds (the old way) or
+until the next deadline of a driver (the new way).
+
+Usage: schedule_wakeup.py [events [seconds [poll]]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import time
+import random
+import socket
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+from supybot.drivers.Socket import SocketDriver
+
+
+class BenchDriver(SocketDriver):
+    """An idle SocketDriver on one end of a socketpair."""
+    def __init__(self, irc, conn):
+        self._conn = conn
+        SocketDriver.__init__(self, irc)
+
+    def connect(self, **kwargs):
+        self.conn = self._conn
+        self.conn.setblocking(False)
+        self.connected = True
+        self._addInstance()
+
+
+def bench(getTimeout, count, duration):
+    originalGetTimeout = drivers.getTimeout
+    drivers.getTimeout = getTimeout
+    irc = common.newIrc()
+    (ours, theirs) = socket.socketpair()
+    driver = BenchDriver(irc, ours)
+    drivers.run() # Adds the driver to the loop
+    lateness = []
+    def event(t):
+        lateness.append(time.time() - t)
+    rng = random.Random(42)
+    start = time.time()
+    for i in range(count):
+        t = start + rng.uniform(0, duration)
+        schedule.addEvent(event, t, args=[t])
+    cpuStart = time.process_time()
+    while time.time() < start + duration + 0.1:
+        drivers.run()
+    cpu = time.process_time() - cpuStart
+    drivers.getTimeout = originalGetTimeout
+    driver.die()
+    irc._reallyDie()
+    drivers.run()
+    ours.close()
+    theirs.close()
+    lateness.sort()
+    return (lateness[len(lateness)//2], lateness[int(len(lateness)*.99)],
+            lateness[-1], cpu)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if len(sys.argv) > 3:
+        conf.supybot.drivers.poll.setValue(float(sys.argv[3]))
+    poll = conf.supybot.drivers.poll()
+    print('%-10s %12s %12s %12s %10s' % ('wait', 'p50 late ms',
+          'p99 late ms', 'max late ms', 'cpu s'))
+    for (name, getTimeout) in (('poll', lambda: poll),
+                               ('deadline', drivers.getTimeout)):
+        (p50, p99, worst, cpu) = bench(getTimeout, count, duration)
+        print('%-10s %12.3f %12.3f %12.3f %10.3f' %
+              (name, p50*1e3, p99*1e3, worst*1e3, cpu))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
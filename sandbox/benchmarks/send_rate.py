@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""
+Simulates a server doing RFC 1459 flood control (each message pushes a
+per-client timer forward by a number of seconds; messages are only
+processed while the timer is less than a window ahead of the current time,
+the others wait in the receive queue, and the client is disconnected for
+"Excess Flood" if it grows too long), and measures how fast the bot's
+messages are processed, with several throttleTime/burst settings.
+
+Time is simulated, so this runs instantly.
+
+Workloads:
+* backlog: a few hundred messages are queued at once,
+* interactive: a handful of replies are queued every now and then,
+* mixed: both, the backlog being sent to a different channel than the
+  replies (only the latency of the replies is reported).
+
+Usage: send_rate.py [server-seconds-per-message [server-window [recvq]]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+
+class Clock(object):
+    """Replaces the time module in irclib."""
+    def __init__(self):
+        self.now = 1e9
+
+    def time(self):
+        return self.now
+
+
+class Server(object):
+    def __init__(self, clock, seconds, window, recvq):
+        self.clock = clock
+        self.seconds = seconds
+        self.window = window
+        self.recvq = recvq
+        self.timer = 0
+        self.queue = []
+        self.maxQueue = 0
+        self.flooded = False
+        self.processed = [] # (msg, time processed)
+
+    def receive(self, msg):
+        self.queue.append(msg)
+        self.maxQueue = max(self.maxQueue, len(self.queue))
+        if len(self.queue) > self.recvq:
+            self.flooded = True
+
+    def tick(self):
+        now = self.clock.now
+        while self.queue and self.timer < now + self.window:
+            msg = self.queue.pop(0)
+            self.timer = max(self.timer, now) + \
+                self.seconds * irclib.penalty(msg)
+            self.processed.append((msg, now))
+
+
+def simulate(workload, throttleTime, burst, seconds, window, recvq,
+             duration=600, step=0.01):
+    clock = Clock()
+    originalTime = irclib.time
+    irclib.time = clock
+    conf.supybot.protocols.irc.throttleTime.setValue(throttleTime)
+    conf.supybot.protocols.irc.queuing.burst.setValue(burst)
+    try:
+        irc = common.newIrc()
+        irc.penaltyTime = 0
+        server = Server(clock, seconds, window, recvq)
+        queuedAt = {}
+        start = clock.now
+        counter = 0
+        while clock.now < start + duration and not server.flooded:
+            elapsed = clock.now - start
+            for (channel, text) in workload(elapsed, step):
+                msg = ircmsgs.privmsg(channel, '%s %i' % (text, counter))
+                counter += 1
+                if text == 'reply' or workload is not mixed:
+                    queuedAt[msg] = clock.now
+                irc.queueMsg(msg)
+            msg = irc.takeMsg()
+            while msg is not None:
+                server.receive(msg)
+                msg = irc.takeMsg()
+            server.tick()
+            clock.now += step
+        latencies = sorted(t - queuedAt[msg] for (msg, t) in server.processed
+                           if msg in queuedAt)
+        if server.processed:
+            span = server.processed[-1][1] - start
+        else:
+            span = 0
+        return (len(server.processed), span, latencies, server)
+    finally:
+        irclib.time = originalTime
+
+
+def backlog(elapsed, step):
+    if elapsed == 0:
+        return [('#dump', 'backlog')] * 300
+    return []
+
+def interactive(elapsed, step):
+    # 4 replies every 15 seconds, to different channels.
+    if int(elapsed / 15) != int((elapsed + step) / 15):
+        return [('#chan%i' % (int(elapsed) % 7), 'reply')] * 4
+    return []
+
+def mixed(elapsed, step):
+    return backlog(elapsed, step) + interactive(elapsed, step)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    window = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    recvq = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print('Server: %gs per message, %gs window, %i lines of receive queue.'
+          % (seconds, window, recvq))
+    print('%-12s %-22s %9s %10s %12s %12s %9s' % ('workload', 'settings',
+          'messages', 'msgs/s', 'mean lat s', 'max lat s', 'result'))
+    settings = [(1, 1), (1, 5), (seconds, 1), (seconds, window/seconds)]
+    for (name, workload) in (('backlog', backlog),
+                             ('interactive', interactive),
+                             ('mixed', mixed)):
+        for (throttleTime, burst) in settings:
+            (count, span, latencies, server) = simulate(workload,
+                    throttleTime, burst, seconds, window, recvq)
+            if latencies:
+                mean = '%.2f' % (sum(latencies)/len(latencies))
+                worst = '%.2f' % latencies[-1]
+            else:
+                mean = worst = 'never'
+            print('%-12s %-22s %9i %10.3f %12s %12s %9s' %
+                  (name, 'throttle=%g burst=%g' % (throttleTime, burst),
+                   count, count/span if span else 0, mean, worst,
+                   'FLOODED' if server.flooded else 'ok'))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
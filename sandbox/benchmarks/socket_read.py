@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Replays a burst of IRC traffic through SocketDriver._read, the way it used
+to be (recv(1024) appended to a bytes buffer, which is split on every read)
+and the way it is now (recv_into a reusable buffer, only scanning new
+bytes), up to drivers.parseMsg, and all the way through Irc.feedMsg.
+
+Usage: socket_read.py [megabytes [recorded-file]]
+
+Without a recorded file, traffic is generated (with and without IRCv3
+tags).  A recorded file is a raw log of lines received from a server.
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import socket
+import threading
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+from supybot.drivers.Socket import SocketDriver
+from supybot.utils.str import decode_raw_line
+
+
+class BenchDriver(SocketDriver):
+    """A SocketDriver reading from one end of a socketpair."""
+    def __init__(self, irc, conn):
+        self._conn = conn
+        SocketDriver.__init__(self, irc)
+
+    def connect(self, **kwargs):
+        self.conn = self._conn
+        self.connected = True
+
+    def _sendIfMsgs(self):
+        while self.irc.takeMsg():
+            pass
+
+
+class OldBenchDriver(BenchDriver):
+    def connect(self, **kwargs):
+        BenchDriver.connect(self)
+        self.inbuffer = b''
+
+    def _read(self):
+        self.inbuffer += self.conn.recv(1024)
+        lines = self.inbuffer.split(b'\n')
+        self.inbuffer = lines.pop()
+        for line in lines:
+            line = decode_raw_line(line)
+
+            msg = drivers.parseMsg(line)
+            if msg is not None and self.irc is not None:
+                self.irc.feedMsg(msg)
+        self._sendIfMsgs()
+
+
+def replay(cls, data, feed=True):
+    irc = common.newIrc()
+    if not feed:
+        # Only measure reading and parsing.
+        irc.feedMsg = lambda msg: None
+    (ours, theirs) = socket.socketpair()
+    driver = cls(irc, ours)
+    def write():
+        theirs.sendall(data)
+        theirs.shutdown(socket.SHUT_WR)
+    writer = threading.Thread(target=write)
+    def run():
+        writer.start()
+        while driver.conn.recv(1, socket.MSG_PEEK):
+            driver._read()
+    (elapsed, _) = common.timeit(run)
+    writer.join()
+    ours.close()
+    theirs.close()
+    irc._reallyDie()
+    drivers.run() # Removes the driver from the loop
+    return elapsed
+
+
+def makeBurst(megabytes, tags):
+    lines = []
+    size = 0
+    for line in common.trafficLines(10**9, tags=tags):
+        line = (line + '\r\n').encode()
+        lines.append(line)
+        size += len(line)
+        if size >= megabytes * 2**20:
+            break
+    return b''.join(lines)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'rb') as fd:
+            bursts = [('recorded', fd.read())]
+    else:
+        bursts = [('no tags', makeBurst(megabytes, False)),
+                  ('with tags', makeBurst(megabytes, True))]
+    print('readSize: %i' % conf.supybot.drivers.readSize())
+    for (name, data) in bursts:
+        lines = data.count(b'\n')
+        for feed in (False, True):
+            for cls in (OldBenchDriver, BenchDriver):
+                elapsed = replay(cls, data, feed)
+                print('%-10s %-10s %-15s %7.1f MB %8i lines %7.2f s '
+                      '%9i lines/s %6.1f MB/s' %
+                      (name, 'feedMsg' if feed else 'parseMsg', cls.__name__,
+                       len(data)/2.**20, lines, elapsed, lines/elapsed,
+                       len(data)/2.**20/elapsed))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Sends a backlog of queued messages through SocketDriver._sendIfMsgs, the
+way it used to be (a str buffer, re-encoded and sliced on every send) and
+the way it is now (a queue of messages encoded once, written with
+sendmsg), to a reader that is slower than the bot.
+
+Usage: socket_write.py [messages [message-length]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import time
+import socket
+import threading
+
+import supybot.drivers as drivers
+import supybot.ircmsgs as ircmsgs
+from supybot.drivers.Socket import SocketDriver
+
+
+class BenchDriver(SocketDriver):
+    """A SocketDriver writing to one end of a socketpair."""
+    def __init__(self, irc, conn):
+        self._conn = conn
+        SocketDriver.__init__(self, irc)
+
+    def connect(self, **kwargs):
+        self.conn = self._conn
+        self.conn.setblocking(False)
+        self.connected = True
+
+    def pending(self):
+        return len(self.outbuffer)
+
+
+class OldBenchDriver(BenchDriver):
+    def connect(self, **kwargs):
+        BenchDriver.connect(self)
+        self.outbuffer = ''
+
+    def _sendIfMsgs(self):
+        msgs = [self.irc.takeMsg()]
+        while msgs[-1] is not None:
+            msgs.append(self.irc.takeMsg())
+        del msgs[-1]
+        self.outbuffer += ''.join(map(str, msgs))
+        if self.outbuffer:
+            try:
+                sent = self.conn.send(self.outbuffer.encode())
+                self.outbuffer = self.outbuffer[sent:]
+            except socket.error:
+                pass
+
+
+def flush(cls, count, length):
+    irc = common.newIrc()
+    (ours, theirs) = socket.socketpair()
+    ours.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    driver = cls(irc, ours)
+    for i in range(count):
+        irc.queueMsg(ircmsgs.privmsg('#chan%i' % (i % 10), 'x' * length))
+    done = threading.Event()
+    def read():
+        while not done.is_set():
+            theirs.recv(4096)
+            time.sleep(0)
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    def run():
+        driver._sendIfMsgs()
+        while driver.pending():
+            driver._sendIfMsgs()
+    (elapsed, _) = common.timeit(run)
+    done.set()
+    ours.close()
+    theirs.close()
+    irc._reallyDie()
+    drivers.run() # Removes the driver from the loop
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    for cls in (OldBenchDriver, BenchDriver):
+        elapsed = flush(cls, count, length)
+        print('%-15s %8i messages %7.2f s %9i messages/s' %
+              (cls.__name__, count, elapsed, count/elapsed))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+Feeds a burst of commands of a few threaded plugins (each taking some time,
+like fetching a page would) and waits for all the replies, with a new
+callbacks.CommandThread for each command (like it used to be) and then with
+callbacks.commandThreadPool.  Prints the time until the last reply, the
+largest number of threads alive at once, and how many commands were
+rejected.
+
+Usage: threads.py [commands [plugins [seconds per command]]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import time
+import threading
+
+import supybot.conf as conf
+import supybot.ircmsgs as ircmsgs
+import supybot.callbacks as callbacks
+
+
+def makePlugin(i, duration):
+    def command(self, irc, msg, args):
+        time.sleep(duration)
+        irc.reply('done')
+    return type('Slow%i' % i, (callbacks.Plugin,),
+                {'threaded': True, 'slow%i' % i: command})
+
+
+class ThreadPerCommand(object):
+    rejected = 0
+    def submit(self, cb, f, args=(), kwargs={}):
+        callbacks.CommandThread(target=f, args=args, kwargs=kwargs).start()
+        return True
+
+
+def burst(irc, count, plugins):
+    msgs = [ircmsgs.privmsg('bench', 'slow%i' % i, prefix='foo!bar@baz')
+            for i in range(plugins)]
+    start = time.time()
+    peak = 0
+    replies = 0
+    for i in range(count):
+        irc.feedMsg(msgs[i % plugins])
+        peak = max(peak, threading.active_count())
+    while replies < count:
+        m = irc.takeMsg()
+        if m is None:
+            peak = max(peak, threading.active_count())
+            time.sleep(0.001)
+        elif m.command in ('PRIVMSG', 'NOTICE'):
+            replies += 1
+    return (time.time() - start, peak)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    plugins = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    conf.supybot.abuse.flood.command.setValue(False)
+    conf.supybot.commands.threads.queueSize.setValue(count)
+    irc = common.newIrc()
+    common.loadPlugins(irc, [])
+    for i in range(plugins):
+        irc.addCallback(makePlugin(i, duration)(irc))
+    pool = callbacks.commandThreadPool
+    for name in ('ThreadPerCommand', 'CommandThreadPool'):
+        if name == 'ThreadPerCommand':
+            callbacks.commandThreadPool = ThreadPerCommand()
+        else:
+            callbacks.commandThreadPool = pool
+        (elapsed, peak) = burst(irc, count, plugins)
+        print('%-17s %5i commands %6.2f s  %4i threads at most  %i rejected'
+              % (name, count, elapsed, peak,
+                 callbacks.commandThreadPool.rejected))
+    irc._reallyDie()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Tokenizes commands like the ones users, aliases and Scheduler give the bot
+(some with quotes and nested commands), with callbacks.Tokenizer (which reads
+them with shlex) and callbacks.FastTokenizer, and then with callbacks.tokenize
+as it used to be (reading the configuration and using a new Tokenizer) and
+as it is now (using a FastTokenizer and caching the tokens of the last
+commands it was given).  Prints the time for each command.
+
+Usage: tokenizer.py [commands [distinct commands]]
+"""
+
+from __future__ import print_function
+
+import common
+
+import sys
+import random
+
+import supybot.conf as conf
+import supybot.callbacks as callbacks
+
+
+def makeCommands(count, distinct, seed=42):
+    rng = random.Random(seed)
+    templates = ['echo %s', 'echo "%s"', 'echo [reverse %s] "%s"',
+                 'success [echo %s] [echo [echo "%s"]]',
+                 'seen %s', 'google "%s" [echo %s]']
+    commands = []
+    for i in range(distinct):
+        template = rng.choice(templates)
+        words = tuple(common.randomText(rng, rng.randint(2, 10))
+                      for j in range(template.count('%s')))
+        commands.append(template % words)
+    return [rng.choice(commands) for i in range(count)]
+
+
+def shlexTokenize(s, channel=None):
+    pipe = False
+    brackets = ''
+    nested = conf.supybot.commands.nested
+    if nested():
+        brackets = conf.get(nested.brackets, channel)
+        if conf.get(nested.pipeSyntax, channel):
+            pipe = True
+    quotes = conf.get(conf.supybot.commands.quotes, channel)
+    try:
+        return callbacks.Tokenizer(brackets=brackets, pipe=pipe,
+                                   quotes=quotes).tokenize(s)
+    except ValueError as e:
+        raise SyntaxError(str(e))
+
+
+def run(f, commands):
+    for s in commands:
+        f(s)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    commands = makeCommands(count, distinct)
+    tokenizers = [
+        ('Tokenizer', callbacks.Tokenizer(brackets='[]').tokenize),
+        ('FastTokenizer', callbacks.FastTokenizer(brackets='[]').tokenize),
+        ('tokenize (old)', shlexTokenize),
+        ('tokenize', callbacks.tokenize),
+    ]
+    for (name, f) in tokenizers:
+        elapsed = common.best(run, 3, f, commands)
+        print('%-14s %6i commands %7.3f s %7.2f us/command' %
+              (name, count, elapsed, elapsed * 1e6 / count))
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -40,6 +40,7 @@ from . import shlex
 import codecs
 import getopt
 import inspect
+import threading
 
 from . import (conf, ircdb, irclib, ircmsgs, ircutils, log, registry,
         utils, world)
@@ -363,6 +364,90 @@ class Tokenizer(object):
                 args[-1].append(ends.pop())
         return args
 
+class FastTokenizer(Tokenizer):
+    """Gives the same tokens as Tokenizer, but finds them with a single
+    regexp instead of reading the string a character at a time with
+    shlex."""
+    whitespace = ' \t\r\n'
+    def __init__(self, brackets='', pipe=False, quotes='"'):
+        super(FastTokenizer, self).__init__(brackets=brackets, pipe=pipe,
+                                            quotes=quotes)
+        def chars(s):
+            return ''.join(map(re.escape, s))
+        # A token is either a quoted string, a word (which can contain quotes,
+        # but doesn't start with one), or one of the separators that aren't
+        # whitespace (brackets, pipes, and null characters).
+        wordSeparators = [c for c in self.separators if c not in quotes]
+        punctuation = [c for c in wordSeparators if c not in self.whitespace]
+        quoted = ['%(q)s(?:[^%(q)s\\\\]|\\\\.)*%(q)s' % {'q': chars(q)}
+                  for q in quotes] or ['(?!)'] # Keeps the groups' numbers.
+        regexp = '[%s]+' % chars(self.whitespace)
+        regexp += '|(%s)' % '|'.join(quoted)
+        regexp += '|([^%s][^%s]*)' % (chars(self.separators),
+                                      chars(wordSeparators))
+        regexp += '|([%s])' % chars(punctuation)
+        regexp += '|(.)' # A quote that is never closed.
+        self.regexp = re.compile(regexp, re.DOTALL)
+
+    def tokenize(self, s):
+        args = []
+        ends = []
+        stack = [] # The lists the brackets we are in are in.
+        for m in self.regexp.finditer(s):
+            kind = m.lastindex
+            if kind is None: # Whitespace
+                continue
+            token = m.group(kind)
+            if kind == 1:
+                args.append(self._handleToken(token))
+            elif kind == 2:
+                args.append(token)
+            elif kind == 4:
+                raise ValueError('No closing quotation')
+            elif token == '|' and self.pipe and not stack:
+                if not args:
+                    raise SyntaxError(_('"|" with nothing preceding.  I '
+                                       'obviously can\'t do a pipe with '
+                                       'nothing before the |.'))
+                ends.append(args)
+                args = []
+            elif token == self.left:
+                stack.append(args)
+                args = []
+            elif token == self.right:
+                if not stack:
+                    raise SyntaxError(_('Spurious "%s".  You may want to '
+                                       'quote your arguments with double '
+                                       'quotes in order to prevent extra '
+                                       'brackets from being evaluated '
+                                       'as nested commands.') % self.right)
+                stack[-1].append(args)
+                args = stack.pop()
+            else:
+                args.append(token)
+        if stack:
+            raise SyntaxError(_('Missing "%s".  You may want to '
+                               'quote your arguments with double '
+                               'quotes in order to prevent extra '
+                               'brackets from being evaluated '
+                               'as nested commands.') % self.right)
+        if ends:
+            if not args:
+                raise SyntaxError(_('"|" with nothing following.  I '
+                                   'obviously can\'t do a pipe with '
+                                   'nothing after the |.'))
+            args.append(ends.pop())
+            while ends:
+                args[-1].append(ends.pop())
+        return args
+
+def _copyTokens(tokens):
+    return [isinstance(token, list) and _copyTokens(token) or token
+            for token in tokens]
+
+_tokenizers = {}
+_tokens = utils.structures.LRUCacheDict(1000)
+_tokensLock = threading.Lock()
 def tokenize(s, channel=None):
     """A utility function to create a Tokenizer and tokenize a string."""
     pipe = False
@@ -373,11 +458,24 @@ def tokenize(s, channel=None):
         if conf.get(nested.pipeSyntax, channel): # No nesting, no pipe.
             pipe = True
     quotes = conf.get(conf.supybot.commands.quotes, channel)
-    try:
-        ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes).tokenize(s)
-        return ret
-    except ValueError as e:
-        raise SyntaxError(str(e))
+    key = (s, brackets, pipe, quotes)
+    with _tokensLock:
+        tokens = _tokens.get(key)
+    if tokens is None:
+        try:
+            tokenizer = _tokenizers[(brackets, pipe, quotes)]
+        except KeyError:
+            tokenizer = FastTokenizer(brackets=brackets, pipe=pipe,
+                                      quotes=quotes)
+            _tokenizers[(brackets, pipe, quotes)] = tokenizer
+        try:
+            tokens = tokenizer.tokenize(s)
+        except ValueError as e:
+            raise SyntaxError(str(e))
+        with _tokensLock:
+            _tokens[key] = tokens
+    # The lists are changed by whatever evaluates them.
+    return _copyTokens(tokens)
 
 def formatCommand(command):
     return ' '.join(command)
@@ -687,14 +785,22 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                 # ircutils.standardSubstitute, this would be where we would
                 # probably put it.
                 self.counter += 1
+            elif isinstance(self.args[self.counter], ConcurrentNestedCommand):
+                # It was evaluated along with its siblings; we reply with
+                # what it replied, as if it had just been evaluated.
+                self.args[self.counter].replay()
+                return
             else:
                 assert isinstance(self.args[self.counter], list)
+                cls = withClass or self.__class__
+                if conf.supybot.commands.nested.concurrent() and \
+                   self._evalConcurrently(cls):
+                    return
                 # It's a list.  So we spawn another NestedCommandsIrcProxy
                 # to evaluate its args.  When that class has finished
                 # evaluating its args, it will call our reply method, which
                 # will subsequently call this function again, and we'll
                 # pick up where we left off via self.counter.
-                cls = withClass or self.__class__
                 cls(self, self.msg, self.args[self.counter],
                         nested=self.nested+1)
                 # We have to return here because the new NestedCommandsIrcProxy
@@ -707,6 +813,75 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         assert all(lambda x: isinstance(x, minisix.string_types), self.args)
         self.finalEval()
 
+    def _getThreadedCallback(self, args):
+        """Returns the plugin that will run the nested command <args> if it
+        is threaded, None otherwise."""
+        command = []
+        for arg in args:
+            if not isinstance(arg, minisix.string_types):
+                break
+            command.append(arg)
+        if not command:
+            return None
+        (command, cbs) = self.findCallbacksForArgs(command)
+        if len(cbs) == 1 and \
+           (cbs[0].threaded or conf.supybot.debug.threadAllCommands()):
+            return cbs[0]
+        else:
+            return None
+
+    def _evalConcurrently(self, cls):
+        """Starts evaluating the nested command we are at along with the
+        following ones if they are all run by threaded plugins, each in the
+        thread pool, and returns whether it did.  Once they have all replied,
+        the evaluation goes on as if they had been evaluated one after the
+        other."""
+        nested = []
+        for (i, arg) in enumerate(self.args[self.counter:]):
+            if isinstance(arg, list):
+                cb = self._getThreadedCallback(arg)
+                if cb is not None:
+                    nested.append((self.counter + i, cb))
+                elif not i:
+                    return False
+        if len(nested) < 2:
+            return False
+        self._concurrentLock = threading.Lock()
+        self._concurrentPending = len(nested)
+        self._concurrentFailed = False
+        for (i, cb) in nested:
+            proxy = ConcurrentNestedCommand(self, i)
+            if not commandThreadPool.submit(cb, cls,
+                                            args=(proxy, proxy.msg,
+                                                  self.args[i]),
+                                            kwargs={'nested': self.nested+1}):
+                proxy.error(_('Too many commands are waiting to be run; '
+                              'try again later.'))
+                break
+        return True
+
+    def _concurrentReplied(self, proxy):
+        """Called by the ConcurrentNestedCommand <proxy> when its nested
+        command replied."""
+        with self._concurrentLock:
+            if self._concurrentFailed:
+                return
+            self.args[proxy.index] = proxy
+            self._concurrentPending -= 1
+            if self._concurrentPending:
+                return
+        self.evalArgs()
+
+    def _concurrentErrored(self, s, kwargs):
+        """Called by a ConcurrentNestedCommand when its nested command
+        errored; like when evaluating them one after the other, we give up
+        on the others."""
+        with self._concurrentLock:
+            if self._concurrentFailed:
+                return
+            self._concurrentFailed = True
+        return self.error(s, **kwargs)
+
     def _callInvalidCommands(self):
         log.debug('Calling invalidCommands.')
         threaded = False
@@ -745,9 +920,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         args = list(map(canonicalName, args))
         cbs = []
         maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
+        for cb in commandIndex.getCandidates(self.irc.callbacks, args):
             L = cb.getCommand(args)
             #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
             if L and L >= maxL:
@@ -833,9 +1006,10 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             args = self.args[len(command):]
             if world.isMainThread() and \
                (cb.threaded or conf.supybot.debug.threadAllCommands()):
-                t = CommandThread(target=cb._callCommand,
-                                  args=(command, self, self.msg, args))
-                t.start()
+                if not commandThreadPool.submit(cb, cb._callCommand,
+                                    args=(command, self, self.msg, args)):
+                    self.error(_('Too many commands are waiting to be run; '
+                                 'try again later.'))
             else:
                 cb._callCommand(command, self, self.msg, args)
 
@@ -888,7 +1062,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             s = str(s) # Allow non-string esses.
         if self.finalEvaled:
             try:
-                if isinstance(self.irc, self.__class__):
+                if isinstance(self.irc, NestedCommandsIrcProxy):
                     s = s[:conf.supybot.reply.maximumLength()]
                     return self.irc.reply(s, to=self.to,
                                           notice=self.notice,
@@ -1043,6 +1217,44 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
 
 IrcObjectProxy = NestedCommandsIrcProxy
 
+class ConcurrentNestedCommand(NestedCommandsIrcProxy):
+    """What a nested command evaluated along with its siblings (see
+    NestedCommandsIrcProxy._evalConcurrently) replies to.  It keeps the reply
+    until its parent replays it, in the order of its args."""
+    def __init__(self, irc, index):
+        self.irc = irc
+        # The siblings run at the same time, so each has its own copy of the
+        # message to tag (eg. 'ignored').
+        self.msg = ircmsgs.IrcMsg(msg=irc.msg)
+        self.nested = irc.nested
+        self.index = index
+        self.finalEvaled = False
+        self.replied = False
+        self.s = None
+        self.kwargs = None
+        self.ignored = False
+
+    def reply(self, s, **kwargs):
+        if self.replied:
+            return
+        self.replied = True
+        self.s = s
+        self.kwargs = kwargs
+        self.ignored = bool(self.msg.ignored)
+        self.irc._concurrentReplied(self)
+
+    def error(self, s='', Raise=False, **kwargs):
+        if Raise or not s:
+            return super(ConcurrentNestedCommand, self).error(s, Raise=Raise,
+                                                              **kwargs)
+        self.replied = True
+        return self.irc._concurrentErrored(s, kwargs)
+
+    def replay(self):
+        if self.ignored:
+            self.irc.msg.tag('ignored')
+        self.irc.reply(self.s, **self.kwargs)
+
 class CommandThread(world.SupyThread):
     """Just does some extra logging and error-recovery for commands that need
     to run in threads.
@@ -1067,6 +1279,98 @@ class CommandThread(world.SupyThread):
         finally:
             self.cb.threaded = self.originalThreaded
 
+class CommandThreadPool(object):
+    """Runs threaded commands in a bounded number of threads, instead of
+    spawning a thread for each of them.  Commands wait in a queue when all the
+    threads are busy, or when as many commands of their plugin as
+    supybot.commands.threads.perPlugin are already running; they are rejected
+    when supybot.commands.threads.queueSize commands are already waiting."""
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.queue = [] # (cb, f, args, kwargs) of the waiting commands
+        self.threads = 0
+        self.busy = 0
+        self.running = {} # cb -> number of its commands being run
+        self.originalThreaded = {}
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, cb, f, args=(), kwargs={}):
+        """Queues a call to f, a method running a command of the plugin cb.
+        Returns False (and doesn't queue it) if too many commands are
+        waiting."""
+        threads = conf.supybot.commands.threads
+        with self.lock:
+            if len(self.queue) >= threads.queueSize():
+                self.rejected += 1
+                log.warning('Too many threaded commands waiting, not running '
+                            'one of %s.', cb.name())
+                return False
+            self.queue.append((cb, f, args, kwargs))
+            if self.threads - self.busy < self._runnable() and \
+               self.threads < threads.maximum():
+                self._spawn()
+            self.lock.notify()
+        return True
+
+    def _spawn(self):
+        self.threads += 1
+        name = 'Thread #%s (for threaded commands)' % world.threadsSpawned
+        t = world.SupyThread(target=self._work, name=name)
+        t.setDaemon(True)
+        t.start()
+
+    def _runnable(self):
+        """Returns how many of the waiting commands could run now."""
+        perPlugin = conf.supybot.commands.threads.perPlugin()
+        running = self.running.copy()
+        n = 0
+        for job in self.queue:
+            cb = job[0]
+            if running.get(cb, 0) < perPlugin:
+                n += 1
+            running[cb] = running.get(cb, 0) + 1
+        return n
+
+    def _take(self):
+        perPlugin = conf.supybot.commands.threads.perPlugin()
+        for (i, job) in enumerate(self.queue):
+            if self.running.get(job[0], 0) < perPlugin:
+                return self.queue.pop(i)
+        return None
+
+    def _work(self):
+        while True:
+            with self.lock:
+                job = self._take()
+                while job is None:
+                    self.lock.wait()
+                    job = self._take()
+                (cb, f, args, kwargs) = job
+                self.busy += 1
+                if cb not in self.running:
+                    self.running[cb] = 0
+                    self.originalThreaded[cb] = cb.threaded
+                    cb.threaded = True
+                self.running[cb] += 1
+            try:
+                f(*args, **kwargs)
+            except Exception:
+                log.exception('Uncaught exception in threaded command of %s:',
+                              cb.name())
+            finally:
+                # The thread takes the next command itself, so there is no
+                # one else to notify.
+                with self.lock:
+                    self.busy -= 1
+                    self.completed += 1
+                    self.running[cb] -= 1
+                    if not self.running[cb]:
+                        del self.running[cb]
+                        cb.threaded = self.originalThreaded.pop(cb)
+
+commandThreadPool = CommandThreadPool()
+
 class CommandProcess(world.SupyProcess):
     """Just does some extra logging and error-recovery for commands that need
     to run in processes.
@@ -1130,6 +1434,8 @@ class DisabledCommands(object):
         return False
 
     def add(self, command, plugin=None):
+        # commandIndex does not need to know, since the commands it returns
+        # are checked anyway.
         if plugin is None:
             self.d[command] = None
         else:
@@ -1145,6 +1451,8 @@ class DisabledCommands(object):
         else:
             if self.d[command] is not None:
                 self.d[command].remove(plugin)
+        # Disabled commands were not indexed.
+        commandIndex.reset()
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1178,6 +1486,11 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
     __firewalled__ = {'isCommand': None,
                       '_callCommand': None}
     commandArgs = ['self', 'irc', 'msg', 'args']
+    # Whether the plugin has commands which are not given by listCommands, or
+    # which change without it calling commandIndex.add.  Such plugins are
+    # asked for every command whether they have it.  By default, those which
+    # override getCommand, isCommandMethod or listCommands are.
+    dynamicCommands = None
     # These must be class-scope, so all plugins use the same one.
     _disabled = DisabledCommands()
     pre_command_callbacks = []
@@ -1343,6 +1656,103 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
             return format(_('The %q command has no help.'),
                           formatCommand(command))
 
+class _CommandNode(object):
+    __slots__ = ('children', 'callbacks')
+    def __init__(self):
+        self.children = {}
+        self.callbacks = set()
+
+def _function(method):
+    return getattr(method, '__func__', method)
+
+class CommandIndex(object):
+    """Index of the commands of plugins, as a trie of the words of their
+    canonical names (both with and without the plugin's name), which tells
+    findCallbacksForArgs which plugins may have a command for some
+    arguments.  Plugins are indexed on the first lookup after they are
+    created, and must be indexed again (with add) when their commands
+    change; plugins with dynamic commands are returned for every lookup."""
+    def __init__(self):
+        self.root = _CommandNode()
+        self.indexed = {} # callback -> list of the nodes it is in
+        self.dynamic = set()
+        self.pending = set() # callbacks to index on the next lookup
+
+    def reset(self):
+        """Forgets the commands of all plugins; they will be indexed again on
+        the next lookup."""
+        self.pending.update(self.indexed)
+        self.root = _CommandNode()
+        self.indexed = {}
+        self.dynamic = set()
+
+    def isDynamic(self, cb):
+        if not isinstance(cb, Commands):
+            return True
+        if cb.dynamicCommands is not None:
+            return cb.dynamicCommands
+        cls = cb.__class__
+        for name in ('getCommand', 'isCommandMethod', 'listCommands'):
+            if _function(getattr(cls, name)) is not \
+                    _function(getattr(Commands, name)):
+                return True
+        return False
+
+    def add(self, cb):
+        """Indexes the commands of the plugin, replacing the ones it had."""
+        self.remove(cb)
+        nodes = []
+        self.indexed[cb] = nodes
+        if not hasattr(cb, 'getCommand'):
+            return
+        if self.isDynamic(cb):
+            self.dynamic.add(cb)
+            return
+        name = cb.canonicalName()
+        for command in cb.listCommands():
+            words = list(map(canonicalName, command.split()))
+            for path in (words, [name] + words):
+                node = self.root
+                for word in path:
+                    child = node.children.get(word)
+                    if child is None:
+                        child = node.children[word] = _CommandNode()
+                    node = child
+                node.callbacks.add(cb)
+                nodes.append(node)
+
+    def remove(self, cb):
+        """Removes the plugin from the index."""
+        self.pending.discard(cb)
+        self.dynamic.discard(cb)
+        for node in self.indexed.pop(cb, ()):
+            node.callbacks.discard(cb)
+
+    def getCandidates(self, callbacks, args):
+        """Returns, in the order of callbacks, the plugins among them which
+        may have a command the (canonical) args start with."""
+        while self.pending:
+            self.add(self.pending.pop())
+        found = set(self.dynamic)
+        node = self.root
+        for word in args:
+            node = node.children.get(word)
+            if node is None:
+                break
+            found.update(node.callbacks)
+        # There are only a few candidates, so looking them up in callbacks is
+        # cheaper than going through all of them.
+        L = []
+        for cb in found:
+            try:
+                L.append((callbacks.index(cb), cb))
+            except ValueError: # Not added to this Irc (yet).
+                pass
+        L.sort(key=lambda x: x[0])
+        return [cb for (__, cb) in L]
+
+commandIndex = CommandIndex()
+
 class PluginMixin(BasePlugin, irclib.IrcCallback):
     public = True
     alwaysCall = ()
@@ -1353,8 +1763,12 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     def __init__(self, irc):
         myName = self.name()
         self.log = log.getPluginLogger(myName)
+        # (name, channel) -> registry node, for registryValue.
+        self._registryNodes = utils.structures.CacheDict(1000)
+        self._registryGeneration = registry.generation
         self.__parent = super(PluginMixin, self)
         self.__parent.__init__(irc)
+        commandIndex.pending.add(self)
         # We can't do this because of the specialness that Owner and Misc do.
         # I guess plugin authors will have to get the capitalization right.
         # self.callAfter = map(str.lower, self.callAfter)
@@ -1363,6 +1777,10 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     def canonicalName(self):
         return canonicalName(self.name())
 
+    def die(self):
+        commandIndex.remove(self)
+        self.__parent.die()
+
     def __call__(self, irc, msg):
         irc = SimpleProxy(irc, msg)
         if msg.command == 'PRIVMSG':
@@ -1378,6 +1796,21 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
             self.__parent.__call__(irc, msg)
 
     def registryValue(self, name, channel=None, value=True):
+        if self._registryGeneration != registry.generation:
+            self._registryNodes.clear()
+            self._registryGeneration = registry.generation
+        key = (name, channel)
+        try:
+            group = self._registryNodes[key]
+        except KeyError:
+            group = self._getRegistryNode(name, channel)
+            self._registryNodes[key] = group
+        if value:
+            return group()
+        else:
+            return group
+
+    def _getRegistryNode(self, name, channel):
         plugin = self.name()
         group = conf.supybot.plugins.get(plugin)
         names = registry.split(name)
@@ -1389,10 +1822,7 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
             else:
                 self.log.debug('%s: registryValue got channel=%r', plugin,
                                channel)
-        if value:
-            return group()
-        else:
-            return group
+        return group
 
     def setRegistryValue(self, name, value, channel=None):
         plugin = self.name()
@@ -1443,6 +1873,10 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
         else:
             return None
 
+# PluginMixin.__call__ only checks the message is not ignored before
+# dispatching it.
+irclib.dispatchingCalls.add(PluginMixin.__dict__['__call__'])
+
 class Plugin(PluginMixin, Commands):
     pass
 Privmsg = Plugin # Backwards compatibility.
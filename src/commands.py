@@ -32,6 +32,7 @@
 Includes wrappers for commands.
 """
 
+import os
 import time
 import getopt
 import inspect
@@ -61,9 +62,10 @@ def thread(f):
     def newf(self, irc, msg, args, *L, **kwargs):
         if world.isMainThread():
             targetArgs = (self.callingCommand, irc, msg, args) + tuple(L)
-            t = callbacks.CommandThread(target=self._callCommand,
-                                        args=targetArgs, kwargs=kwargs)
-            t.start()
+            if not callbacks.commandThreadPool.submit(self, self._callCommand,
+                                                      targetArgs, kwargs):
+                irc.error(_('Too many commands are waiting to be run; '
+                            'try again later.'))
         else:
             f(self, irc, msg, args, *L, **kwargs)
     return utils.python.changeFunctionName(newf, f.__name__, f.__doc__)
@@ -72,6 +74,170 @@ class ProcessTimeoutError(Exception):
     """Gets raised when a process is killed due to timeout."""
     pass
 
+def _closeInheritedFds(keep):
+    """Closes the file descriptors the process inherited from the bot (IRC
+    sockets, listening sockets, selectors, ...), except the standard ones and
+    <keep>, so they don't stay open as long as the process lives.  They are
+    replaced with /dev/null rather than closed, so the objects still holding
+    them can't close files opened later."""
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError: # Not Linux
+        fds = range(3, os.sysconf('SC_OPEN_MAX'))
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        for fd in fds:
+            if fd > 2 and fd != devnull and fd not in keep:
+                try:
+                    os.fstat(fd)
+                except OSError: # Not open (or listdir's own fd).
+                    continue
+                os.dup2(devnull, fd)
+    finally:
+        os.close(devnull)
+
+def _processWorkerLoop(conn, parentConn, heap_size):
+    parentConn.close()
+    _closeInheritedFds([conn.fileno()])
+    if resource:
+        rsrc = resource.RLIMIT_DATA
+        resource.setrlimit(rsrc, (heap_size, heap_size))
+    while True:
+        try:
+            (f, args, kwargs) = conn.recv()
+        except EOFError:
+            return
+        except Exception:
+            # Probably a function of a plugin loaded after this process was
+            # forked; the caller will fork a new one instead.
+            conn.send((False, None))
+            continue
+        try:
+            r = f(*args, **kwargs)
+        except Exception as e:
+            r = e
+        try:
+            conn.send((True, r))
+        except Exception:
+            # r can't be pickled; like when forking, there is no result.
+            conn.send((True, None))
+
+class _ProcessWorker(object):
+    __slots__ = ('process', 'conn', 'generation')
+    def __init__(self, heap_size, generation):
+        self.generation = generation
+        (self.conn, childConn) = multiprocessing.Pipe()
+        name = 'Process #%s (worker for commands.process)' % \
+               world.processesSpawned
+        self.process = world.SupyProcess(target=_processWorkerLoop, name=name,
+                                         args=(childConn, self.conn,
+                                               heap_size))
+        self.process.daemon = True
+        self.process.start()
+        childConn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+_unavailable = object()
+
+class ProcessPool(object):
+    """Keeps processes to run the functions given to process() in, instead of
+    forking a new process for each call.  Since a process's memory limit can
+    only be lowered, there are up to supybot.commands.processes.workers of
+    them for each heap_size.  Calls that can't be sent to another process
+    (closures, for instance) still fork a new one, as do calls made while all
+    the processes are busy.  A process is killed when a call times out."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0 # Incremented by restart.
+        self.idle = {} # heap_size -> list of idle workers
+        self.workers = {} # heap_size -> number of workers
+        self.pooled = 0
+        self.pooledTime = 0.0
+        self.forked = 0
+        self.forkedTime = 0.0
+        self.killed = 0
+
+    def _get(self, heap_size):
+        with self.lock:
+            idle = self.idle.get(heap_size)
+            if idle:
+                return idle.pop()
+            workers = self.workers.get(heap_size, 0)
+            if workers >= conf.supybot.commands.processes.workers():
+                return None
+            self.workers[heap_size] = workers + 1
+        try:
+            return _ProcessWorker(heap_size, self.generation)
+        except Exception:
+            log.exception('Could not start a process worker:')
+            self._remove(heap_size)
+            return None
+
+    def _put(self, heap_size, worker):
+        with self.lock:
+            if worker.generation == self.generation:
+                self.idle.setdefault(heap_size, []).append(worker)
+                return
+            self.workers[heap_size] -= 1
+        worker.kill()
+
+    def _remove(self, heap_size, worker=None):
+        with self.lock:
+            self.workers[heap_size] -= 1
+        if worker is not None:
+            worker.kill()
+
+    def restart(self):
+        """Kills the processes, so the next calls are run by new ones.  They
+        run the code they were forked with, so this is called when a plugin
+        is reloaded.  The busy ones are killed once they are done."""
+        with self.lock:
+            self.generation += 1
+            idle = self.idle
+            self.idle = {}
+            for (heap_size, workers) in idle.items():
+                self.workers[heap_size] -= len(workers)
+        for workers in idle.values():
+            for worker in workers:
+                worker.kill()
+
+    def call(self, f, args, kwargs, timeout, heap_size, name):
+        """Calls f in one of the processes, and returns what it returned (or
+        the exception it raised), or _unavailable if it can't be run there."""
+        worker = self._get(heap_size)
+        if worker is None:
+            return _unavailable
+        start = time.time()
+        try:
+            worker.conn.send((f, args, kwargs))
+        except Exception: # It can't be pickled.
+            self._put(heap_size, worker)
+            return _unavailable
+        if not worker.conn.poll(timeout):
+            self._remove(heap_size, worker)
+            with self.lock:
+                self.killed += 1
+            raise ProcessTimeoutError('%s aborted due to timeout.' % name)
+        try:
+            (ran, r) = worker.conn.recv()
+        except (EOFError, IOError, OSError):
+            # The process died, so there is no result, as when forking.
+            self._remove(heap_size, worker)
+            return None
+        self._put(heap_size, worker)
+        if not ran:
+            return _unavailable
+        with self.lock:
+            self.pooled += 1
+            self.pooledTime += time.time() - start
+        return r
+
+processPool = ProcessPool()
+
 def process(f, *args, **kwargs):
     """Runs a function <f> in a subprocess.
     
@@ -79,7 +245,12 @@ def process(f, *args, **kwargs):
     <pn>, the pluginname, and <cn>, the command name, are strings used to
     create the process name, for identification purposes.
     <timeout>, if supplied, limits the length of execution of target 
-    function to <timeout> seconds."""
+    function to <timeout> seconds.
+
+    The function is run by one of the processes of processPool if it can be
+    pickled (module-level functions, methods of builtin objects, and
+    functools.partial objects of them can); otherwise a new process is
+    forked to run it."""
     timeout = kwargs.pop('timeout', None)
     heap_size = kwargs.pop('heap_size', None)
     if resource and heap_size is None:
@@ -92,7 +263,30 @@ def process(f, *args, **kwargs):
             return f(*args, **kwargs)
         except Exception as e:
             raise e
-    
+
+    pn = kwargs.pop('pn', 'Unknown')
+    cn = kwargs.pop('cn', 'unknown')
+    v = processPool.call(f, args, kwargs, timeout, heap_size,
+                         'Process for %s.%s' % (pn, cn))
+    if v is _unavailable:
+        start = time.time()
+        kwargs.update(pn=pn, cn=cn)
+        try:
+            v = _forkAndCall(f, args, kwargs, timeout, heap_size)
+        except ProcessTimeoutError:
+            with processPool.lock:
+                processPool.killed += 1
+            raise
+        finally:
+            with processPool.lock:
+                processPool.forked += 1
+                processPool.forkedTime += time.time() - start
+    if isinstance(v, Exception):
+        raise v
+    else:
+        return v
+
+def _forkAndCall(f, args, kwargs, timeout, heap_size):
     try:
         q = multiprocessing.Queue()
     except OSError:
@@ -123,30 +317,27 @@ def process(f, *args, **kwargs):
         q.close()
         raise ProcessTimeoutError("%s aborted due to timeout." % (p.name,))
     try:
-        v = q.get(block=False)
+        return q.get(block=False)
     except minisix.queue.Empty:
         return None
     finally:
         q.close()
-    if isinstance(v, Exception):
-        raise v
+
+def _re_bool(s, reobj):
+    """Since we can't enqueue match objects into the multiprocessing queue,
+    we'll just wrap the function to return bools."""
+    if reobj.search(s) is not None:
+        return True
     else:
-        return v
+        return False
 
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     '''A convenient wrapper to stuff regexp search queries through a subprocess.
     
     This is used because specially-crafted regexps can use exponential time
     and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
     try:
-        v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
+        v = process(_re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
         return v
     except ProcessTimeoutError:
         return False
@@ -717,6 +717,13 @@ registerGlobalValue(supybot.commands.nested, 'maximum',
     registry.PositiveInteger(10, _("""Determines what the maximum number of
     nested commands will be; users will receive an error if they attempt
     commands more nested than this.""")))
+registerGlobalValue(supybot.commands.nested, 'concurrent',
+    registry.Boolean(False, _("""Determines whether the nested commands of
+    threaded plugins given to the same command are run at the same time
+    instead of one after the other.  Their results are still used in the
+    order they were given.  Only commands of different plugins run in
+    parallel: a plugin runs one command at a time, so nested commands of the
+    same plugin still wait for each other.""")))
 
 class ValidBrackets(registry.OnlySomeStrings):
     validStrings = ('', '[]', '<>', '{}', '()')
@@ -747,6 +754,31 @@ registerGlobalValue(supybot.commands.defaultPlugins, 'importantPlugins',
         know what you're doing, then also know that this set is
         case-sensitive.""")))
 
+registerGroup(supybot.commands, 'threads')
+registerGlobalValue(supybot.commands.threads, 'maximum',
+    registry.PositiveInteger(10, _("""Determines how many threads the bot will
+    use at most to run threaded commands (those of threaded plugins, like RSS
+    or Web, and those which are threaded themselves).  Commands wait for a
+    thread when they are all busy.""")))
+registerGlobalValue(supybot.commands.threads, 'perPlugin',
+    registry.PositiveInteger(1, _("""Determines how many threads can run
+    threaded commands of the same plugin at the same time; its other commands
+    wait, so a single plugin can't keep all the threads busy.  Plugins run
+    one command at a time anyway, so more threads would only be waiting for
+    the first one.""")))
+registerGlobalValue(supybot.commands.threads, 'queueSize',
+    registry.PositiveInteger(50, _("""Determines how many threaded commands
+    can wait for a thread; the bot replies with an error to those given when
+    that many are already waiting.""")))
+
+registerGroup(supybot.commands, 'processes')
+registerGlobalValue(supybot.commands.processes, 'workers',
+    registry.NonNegativeInteger(2, _("""Determines how many processes the bot
+    keeps (for each memory limit) to run what it runs in another process,
+    like the regexps users give it, instead of forking a new process for each
+    of them.  If this is 0, or all of them are busy, a new process is
+    forked.""")))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -803,14 +835,22 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input.""")))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Twisted', 'Asyncio')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', _("""Determines what driver module the 
     bot will use. The default is Socket which is simple and stable 
-    and supports SSL. Twisted doesn't work if the IRC server which 
+    and supports SSL. Asyncio handles all connections from a single asyncio
+    event loop, and requires Python 3.5 or newer (3.11 for STARTTLS).
+    Twisted doesn't work if the IRC server which 
     you are connecting to has IPv6 (most of them do).""")))
 
+registerGlobalValue(supybot.drivers, 'readSize',
+    registry.PositiveInteger(16384, _("""Determines how many bytes the Socket
+    driver reads from the network at once.  Bigger values reduce the number
+    of system calls when the server sends large bursts of messages (like
+    NAMES replies or history playback).""")))
+
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, _("""Determines the maximum time the bot will
     wait before attempting to reconnect to an IRC server.  The bot may, of
@@ -1141,10 +1181,36 @@ registerGlobalValue(supybot.protocols.irc, 'maxHistoryLength',
     keep around in its history.  Changing this variable will not take effect
     until the bot is restarted.""")))
 
+registerGlobalValue(supybot.protocols.irc.maxHistoryLength, 'messages',
+    registry.PositiveInteger(10000, _("""Determines how many messages the
+    bot will keep around in its indexed history of messages (which is used by
+    commands like Misc's last, and stores them more compactly than IrcMsg
+    objects).  The history of supybot.protocols.irc.maxHistoryLength
+    messages is made of its last messages.  Changing this variable will not
+    take effect until the bot reconnects.""")))
+
+registerGlobalValue(supybot.protocols.irc, 'maxHostmasks',
+    registry.NonNegativeInteger(10000, _("""Determines how many hostmasks the
+    bot will remember.  When it knows more of them, it forgets the least
+    recently used hostmasks of users who are not in any of its channels.  0
+    means there is no limit.""")))
+
+registerGlobalValue(supybot.protocols.irc, 'whoOnJoin',
+    registry.Boolean(True, _("""Determines whether the bot will send a WHO
+    for each channel it joins, to know the hostmasks of all the users in it.
+    On big networks, you may want to disable it and enable
+    supybot.protocols.irc.whoOnDemand instead.""")))
+
+registerGlobalValue(supybot.protocols.irc, 'whoOnDemand',
+    registry.Boolean(False, _("""Determines whether the bot will send a WHO
+    for a nick when it needs its hostmask but doesn't know it, so that it
+    knows it the next time.""")))
+
 registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, _("""A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
-    throttleTime seconds.""")))
+    throttleTime seconds, once the burst allowed by
+    supybot.protocols.irc.queuing.burst is spent.""")))
 
 registerGlobalValue(supybot.protocols.irc, 'ping',
     registry.Boolean(True, _("""Determines whether the bot will send PINGs to
@@ -1165,6 +1231,13 @@ registerGlobalValue(supybot.protocols.irc.queuing, 'duplicates',
     message multiple times; most of the time it doesn't matter, unless you're
     doing certain kinds of plugin hacking.""")))
 
+registerGlobalValue(supybot.protocols.irc.queuing, 'burst',
+    registry.PositiveFloat(5.0, _("""Determines how many messages the bot
+    can send at once before being throttled by
+    supybot.protocols.irc.throttleTime.  Some messages (such as WHO or LIST)
+    count as more than one (but not more than this), because servers penalize
+    them more.  Most servers allow bursts of about 5 messages.""")))
+
 registerGroup(supybot.protocols.irc.queuing, 'rateLimit')
 registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'join',
     registry.Float(0, _("""Determines how many seconds must elapse between
@@ -1295,6 +1368,12 @@ registerGlobalValue(supybot.debug, 'flushVeryOften',
     registry.Boolean(False, _("""Determines whether the bot will automatically
     flush all flushers *very* often.  Useful for debugging when you don't know
     what's breaking or when, but think that it might be logged.""")))
+registerGlobalValue(supybot.debug, 'instrument',
+    registry.Boolean(False, _("""Determines whether the bot will measure the
+    time it spends in each stage of handling messages: parsing the messages it
+    receives, updating its state, running the inFilters, the callbacks, and
+    the outFilters on the messages it sends.  The averages are given by the
+    'status net' command.""")))
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,434 @@
+###
+# Copyright (c) 2026, The Limnoria Contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a driver based on asyncio streams.  All connections are handled by
+a single event loop, which the main loop runs until something needs to be
+done outside of it (the next deadline of another driver, such as the next
+scheduled event, at most supybot.drivers.poll seconds).
+
+Requires Python 3.5 or newer, and 3.11 or newer for STARTTLS (connections
+to networks requiring it use the Socket driver otherwise, see
+drivers.newDriver).
+"""
+
+import os
+import time
+import socket
+import asyncio
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+from .. import (conf, drivers, log, utils, world)
+from ..utils.str import decode_raw_line
+
+# Whether streams can be upgraded with STARTTLS (Python >= 3.11).
+supportsStarttls = hasattr(asyncio.StreamWriter, 'start_tls')
+
+# Both are created with the first AsyncioDriver, see _startLoop.
+loop = None
+runner = None
+
+def _startLoop():
+    global loop, runner
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    if runner is None:
+        runner = AsyncioRunnerDriver()
+
+def _currentTask():
+    if hasattr(asyncio, 'current_task'): # Python >= 3.7
+        return asyncio.current_task(loop)
+    else:
+        return asyncio.Task.current_task(loop)
+
+def _cancel(task):
+    # A task cancelled while it is running and about to return ends with an
+    # exception nobody retrieves, so tasks are left to return by themselves
+    # when they are the ones asking to cancel.
+    if task is not None and task is not _currentTask():
+        task.cancel()
+
+
+class AsyncioRunnerDriver(drivers.IrcDriver):
+    """Runs the event loop shared by all AsyncioDriver instances, each time
+    the main loop runs the drivers."""
+    def name(self):
+        return self.__class__.__name__
+
+    def run(self):
+        handle = loop.call_later(drivers.getTimeout(), loop.stop)
+        try:
+            loop.run_forever()
+        except Exception:
+            drivers.log.exception('Uncaught exception outside event loop:')
+        finally:
+            handle.cancel()
+
+
+class AsyncioDriver(drivers.IrcDriver, drivers.ServersMixin):
+    def __init__(self, irc):
+        assert irc is not None
+        _startLoop()
+        self.irc = irc
+        drivers.IrcDriver.__init__(self, irc)
+        drivers.ServersMixin.__init__(self, irc)
+        self._attempt = -1
+        self.servers = ()
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.zombie = False
+        self.connected = False
+        self.upgrading = False
+        self.nextReconnectTime = None
+        self.canSend = asyncio.Event()
+        self.resetDelay()
+        if self.networkGroup.get('ssl').value and ssl is None:
+            drivers.log.error('The Asyncio driver can not connect to SSL '
+                              'servers for your Python version.')
+            self.ssl = False
+        else:
+            self.ssl = self.networkGroup.get('ssl').value
+        self.connect()
+
+    def getDelay(self):
+        ret = self.currentDelay
+        self.currentDelay = min(self.currentDelay * 2,
+                                conf.supybot.drivers.maxReconnectWait())
+        return ret
+
+    def resetDelay(self):
+        self.currentDelay = 10.0
+
+    def _getNextServer(self):
+        oldServer = getattr(self, 'currentServer', None)
+        server = drivers.ServersMixin._getNextServer(self)
+        if self.currentServer != oldServer:
+            self.resetDelay()
+        return server
+
+    def run(self):
+        # The connection is handled by the event loop, which is run by
+        # AsyncioRunnerDriver.  Messages may have been queued outside of it
+        # (by scheduled events or threads), so let the sender know.
+        self.canSend.set()
+
+    def wakeUp(self):
+        if world.isMainThread():
+            self.canSend.set()
+        else:
+            # Threaded commands must not wait for the next run of the loop.
+            loop.call_soon_threadsafe(self.canSend.set)
+
+    def connect(self, **kwargs):
+        self.reconnect(reset=False, **kwargs)
+
+    def reconnect(self, wait=False, reset=True):
+        self.nextReconnectTime = None
+        if self.connected:
+            drivers.log.reconnect(self.irc.network)
+            self._close()
+        _cancel(self.task)
+        self.task = None
+        if reset:
+            drivers.log.debug('Resetting %s.', self.irc)
+            self.irc.reset()
+        else:
+            drivers.log.debug('Not resetting %s.', self.irc)
+        delay = 0
+        if wait:
+            delay = self.getDelay()
+            self.nextReconnectTime = time.time() + delay
+            if not world.dying:
+                drivers.log.reconnect(self.irc.network,
+                                      self.nextReconnectTime)
+        self.task = loop.create_task(self._connection(delay))
+
+    def scheduleReconnect(self):
+        self.reconnect(wait=True)
+
+    def _close(self):
+        self.connected = False
+        self.upgrading = False
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+    def _sslContext(self, network_config):
+        certfile = network_config.certfile()
+        if not certfile:
+            certfile = conf.supybot.protocols.irc.certfile()
+        if not certfile:
+            certfile = None
+        elif not os.path.isfile(certfile):
+            drivers.log.warning('Could not find cert file %s.' %
+                    certfile)
+            certfile = None
+        verifyCertificates = conf.supybot.protocols.ssl.verifyCertificates()
+        if not verifyCertificates:
+            drivers.log.warning('Not checking SSL certificates, connections '
+                    'are vulnerable to man-in-the-middle attacks. Set '
+                    'supybot.protocols.ssl.verifyCertificates to "true" '
+                    'to enable validity checks.')
+        return utils.net.ssl_context(certfile=certfile,
+                verify=verifyCertificates,
+                trusted_fingerprints=network_config.ssl.serverFingerprints(),
+                ca_file=network_config.ssl.authorityCertificate(),
+                )
+
+    def _checkCertificate(self, network_config, writer):
+        """Checks the fingerprint of the server's certificate, if the
+        network is configured with a list of trusted fingerprints."""
+        fingerprints = network_config.ssl.serverFingerprints()
+        if fingerprints and conf.supybot.protocols.ssl.verifyCertificates():
+            utils.net.check_certificate_fingerprint(
+                    writer.get_extra_info('ssl_object'), fingerprints)
+
+    def _logCertificateError(self, e):
+        drivers.log.error(('Certificate validation failed when '
+            'connecting to %s: %s\n'
+            'This means either someone is doing a man-in-the-middle '
+            'attack on your connection, or the server\'s certificate is '
+            'not trusted.')
+            % (self.irc.network, e))
+
+    async def _resolve(self, hostname, port):
+        addrinfo = await loop.getaddrinfo(hostname, port,
+                                          type=socket.SOCK_STREAM)
+        addresses = []
+        for (family, socktype, proto, canonname, sockaddr) in addrinfo:
+            if (family, sockaddr[0]) not in addresses:
+                addresses.append((family, sockaddr[0]))
+        return addresses[self._attempt % len(addresses)]
+
+    async def _connection(self, delay):
+        """Connects to the next server, and handles the connection until it
+        is closed."""
+        if delay:
+            await asyncio.sleep(delay)
+        self.nextReconnectTime = None
+        self._attempt += 1
+        self.server = self._getNextServer()
+        (hostname, port) = self.server
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        if network_config.socksproxy():
+            # Only set after the driver was created (see drivers.newDriver).
+            drivers.log.error('The Asyncio driver does not support SOCKS '
+                              'proxies, use the Socket driver instead.')
+            self.scheduleReconnect()
+            return
+        try:
+            (family, address) = await self._resolve(hostname, port)
+        except (socket.gaierror, socket.error) as e:
+            drivers.log.connectError(self.currentServer, e)
+            self.scheduleReconnect()
+            return
+        kwargs = {}
+        if family == socket.AF_INET6:
+            vhost = conf.supybot.protocols.irc.vhostv6()
+        else:
+            vhost = conf.supybot.protocols.irc.vhost()
+        if vhost:
+            kwargs['local_addr'] = (vhost, 0)
+        if self.ssl:
+            kwargs['ssl'] = self._sslContext(network_config)
+            kwargs['server_hostname'] = hostname
+        drivers.log.connect(self.currentServer)
+        try:
+            # We allow more time for the connect here, since it might take
+            # longer.  At least 10 seconds.
+            (reader, writer) = await asyncio.wait_for(
+                    asyncio.open_connection(address, port, **kwargs),
+                    max(10, conf.supybot.drivers.poll()*10))
+            if self.ssl:
+                self._checkCertificate(network_config, writer)
+        except getattr(ssl, 'CertificateError', ()) as e:
+            self._logCertificateError(e)
+            self.scheduleReconnect()
+            return
+        except (asyncio.TimeoutError, socket.error) as e:
+            drivers.log.connectError(self.currentServer, e)
+            self.scheduleReconnect()
+            return
+        if not self.ssl and not network_config.requireStarttls():
+            drivers.log.warning(('Connection to network %s '
+                'does not use SSL/TLS, which makes it vulnerable to '
+                'man-in-the-middle attacks and passive eavesdropping. '
+                'You should consider upgrading your connection to SSL/TLS '
+                '<http://doc.supybot.aperio.fr/en/latest/use/faq.html#how-to-make-a-connection-secure>')
+                % self.irc.network)
+        (self.reader, self.writer) = (reader, writer)
+        self.connected = True
+        self.resetDelay()
+        sender = loop.create_task(self._sender(writer))
+        try:
+            await self._receiver(reader, writer)
+        finally:
+            _cancel(sender)
+
+    async def _receiver(self, reader, writer):
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError as e:
+                # Line longer than the reader's limit; it is dropped.
+                drivers.log.warning('Dropping overlong line from %s: %s',
+                                    self.currentServer, e)
+                continue
+            except socket.error as e:
+                self._handleSocketError(e)
+                return
+            if not line:
+                self._handleSocketError(None)
+                return
+            line = decode_raw_line(line)
+            msg = drivers.parseMsg(line)
+            if msg is not None and self.irc is not None:
+                self.irc.feedMsg(msg)
+            if writer is not self.writer:
+                # We reconnected or died while handling this message.
+                return
+            if self.upgrading:
+                try:
+                    await self._upgrade(reader, writer)
+                except Exception as e:
+                    self._handleSocketError(e)
+                    return
+            # Handling the message may have queued replies.
+            self.canSend.set()
+
+    def _getSendTimeout(self):
+        """Returns how long the sender can wait before calling
+        Irc.takeMsg again even if nothing new was queued."""
+        timeout = conf.supybot.drivers.poll()
+        deadline = self.irc.getDeadline()
+        if deadline is not None:
+            timeout = min(timeout, max(0, deadline - time.time()))
+        return timeout
+
+    async def _sender(self, writer):
+        while writer is self.writer:
+            self.canSend.clear()
+            if not self.upgrading:
+                if not self._sendIfMsgs(writer):
+                    return
+                try:
+                    # Waits until the socket is writable again, if the
+                    # transport's buffer is full.
+                    await writer.drain()
+                except socket.error as e:
+                    self._handleSocketError(e)
+                    return
+            try:
+                await asyncio.wait_for(self.canSend.wait(),
+                                       self._getSendTimeout())
+            except asyncio.TimeoutError:
+                pass
+
+    def _sendIfMsgs(self, writer):
+        """Writes all messages Irc.takeMsg is willing to give us.  Returns
+        False if the connection went away while doing so."""
+        while not self.zombie:
+            msg = self.irc.takeMsg()
+            if writer is not self.writer:
+                # takeMsg made us reconnect or die.
+                return False
+            if msg is None:
+                break
+            writer.write(bytes(msg))
+        return True
+
+    async def _upgrade(self, reader, writer):
+        """Replaces the transport of the connection with a TLS one, after
+        the server accepted a STARTTLS."""
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        context = self._sslContext(network_config)
+        hostname = self.server[0]
+        if not supportsStarttls:
+            raise socket.error('STARTTLS is not supported by the Asyncio '
+                               'driver on this Python version.')
+        await writer.start_tls(context, server_hostname=hostname)
+        try:
+            self._checkCertificate(network_config, writer)
+        except ssl.CertificateError as e:
+            self._logCertificateError(e)
+            raise
+        self.upgrading = False
+
+    def _handleSocketError(self, e):
+        drivers.log.disconnect(self.currentServer, e)
+        self._close()
+        if self.zombie:
+            self._reallyDie()
+        else:
+            self.scheduleReconnect()
+
+    def starttls(self):
+        assert ssl is not None
+        # We are called while handling the server's reply to STARTTLS, the
+        # receiver does the actual upgrade before reading anything else,
+        # and the sender waits for it.
+        self.upgrading = True
+
+    def die(self):
+        self.zombie = True
+        self.nextReconnectTime = None
+        drivers.log.die(self.irc)
+        if self.writer is not None:
+            loop.create_task(self._flushAndDie(self.writer))
+        else:
+            self._reallyDie()
+
+    async def _flushAndDie(self, writer):
+        try:
+            await writer.drain()
+        except socket.error:
+            pass
+        if writer is self.writer:
+            self._reallyDie()
+
+    def _reallyDie(self):
+        self._close()
+        _cancel(self.task)
+        self.task = None
+        drivers.IrcDriver.die(self)
+
+    def name(self):
+        return '%s(%s)' % (self.__class__.__name__, self.irc)
+
+
+Driver = AsyncioDriver
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -39,6 +39,13 @@ import time
 import errno
 import select
 import socket
+import itertools
+import collections
+
+try:
+    import selectors
+except ImportError: # Python 2
+    selectors = None
 
 from .. import (conf, drivers, log, utils, world)
 from ..utils import minisix
@@ -50,6 +57,7 @@ try:
 except:
     drivers.log.debug('ssl module is not available, '
                       'cannot connect to SSL servers.')
+    ssl = None
     class SSLError(Exception):
         pass
 
@@ -57,8 +65,13 @@ except:
 class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     _instances = []
     _selecting = [False] # We want it to be mutable.
+    # Connected sockets stay registered here for their whole lifetime, so
+    # that we don't have to rebuild the list of sockets on every loop.
+    # Created by the first _addInstance call.  None when the selectors
+    # module is not available, in which case we fall back to
+    # select.select().
+    _selector = None
     def __init__(self, irc):
-        self._instances.append(self)
         assert irc is not None
         self.irc = irc
         drivers.IrcDriver.__init__(self, irc)
@@ -67,14 +80,21 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self._attempt = -1
         self.servers = ()
         self.eagains = 0
-        self.inbuffer = b''
-        self.outbuffer = ''
+        self.inbuffer = bytearray()
+        self.readbuffer = None
+        # Encoded messages waiting to be sent, with the time they were
+        # taken from the Irc object, and how much of the first one has
+        # already been sent.
+        self.outbuffer = collections.deque()
+        self.outbufferOffset = 0
+        self.outbufferSize = 0
+        self.flushLatency = None
         self.zombie = False
         self.connected = False
         self.writeCheckTime = None
         self.nextReconnectTime = None
         self.resetDelay()
-        if self.networkGroup.get('ssl').value and 'ssl' not in globals():
+        if self.networkGroup.get('ssl').value and ssl is None:
             drivers.log.error('The Socket driver can not connect to SSL '
                               'servers for your Python version.  Try the '
                               'Twisted driver instead, or install a Python'
@@ -105,8 +125,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         # hasn't finished yet.  We'll keep track of how many we get.
         if e.args[0] != 11 or self.eagains > 120:
             drivers.log.disconnect(self.currentServer, e)
-            if self in self._instances:
-                self._instances.remove(self)
+            self._removeInstance()
             try:
                 self.conn.close()
             except:
@@ -117,61 +136,142 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             log.debug('Got EAGAIN, current count: %s.', self.eagains)
             self.eagains += 1
 
+    # Maximum number of messages given to a single send call.
+    _maxSendBuffers = 64
+
     def _sendIfMsgs(self):
         if not self.connected:
             return
         if not self.zombie:
-            msgs = [self.irc.takeMsg()]
-            while msgs[-1] is not None:
-                msgs.append(self.irc.takeMsg())
-            del msgs[-1]
-            self.outbuffer += ''.join(map(str, msgs))
+            now = time.time()
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                data = bytes(msg)
+                self.outbuffer.append((data, now))
+                self.outbufferSize += len(data)
+                msg = self.irc.takeMsg()
         if self.outbuffer:
             try:
-                if minisix.PY2:
-                    sent = self.conn.send(self.outbuffer)
-                else:
-                    sent = self.conn.send(self.outbuffer.encode())
-                self.outbuffer = self.outbuffer[sent:]
+                sent = self._send()
                 self.eagains = 0
             except socket.error as e:
                 self._handleSocketError(e)
+            else:
+                self._consume(sent)
         if self.zombie and not self.outbuffer:
             self._reallyDie()
 
+    def _send(self):
+        """Sends as many queued messages as the socket accepts, without
+        copying them when possible.  Returns the number of bytes sent."""
+        buffers = [data for (data, queuedAt)
+                   in itertools.islice(self.outbuffer, self._maxSendBuffers)]
+        if hasattr(self.conn, 'sendmsg') and \
+                not (ssl is not None and
+                     isinstance(self.conn, ssl.SSLSocket)):
+            # Gathered write, the first message may be partially sent.
+            buffers[0] = memoryview(buffers[0])[self.outbufferOffset:]
+            return self.conn.sendmsg(buffers)
+        else:
+            # SSL sockets (and Python 2) do not support sendmsg.
+            buffers[0] = buffers[0][self.outbufferOffset:]
+            return self.conn.send(b''.join(buffers))
+
+    def _consume(self, sent):
+        """Removes the first sent bytes from the output buffer."""
+        self.outbufferSize -= sent
+        sent += self.outbufferOffset
+        now = time.time()
+        while self.outbuffer and sent >= len(self.outbuffer[0][0]):
+            (data, queuedAt) = self.outbuffer.popleft()
+            sent -= len(data)
+            self.flushLatency = now - queuedAt
+        self.outbufferOffset = sent
+
+    def _addInstance(self):
+        """Registers the connected socket in the set of sockets we wait
+        on."""
+        if self not in self._instances:
+            self._instances.append(self)
+        if selectors is not None and SocketDriver._selector is None:
+            SocketDriver._selector = selectors.DefaultSelector()
+        if self._selector is not None:
+            try:
+                self._selector.register(self.conn, selectors.EVENT_READ, self)
+            except KeyError: # Already registered
+                self._selector.modify(self.conn, selectors.EVENT_READ, self)
+
+    def _removeInstance(self):
+        """Unregisters the socket from the set of sockets we wait on."""
+        if self in self._instances:
+            self._instances.remove(self)
+        if self._selector is not None and self.conn is not None:
+            try:
+                self._selector.unregister(self.conn)
+            except (KeyError, ValueError):
+                # Not registered, or the socket is already closed and was
+                # removed from the selector's map.
+                pass
+
+    def getDeadline(self):
+        deadlines = [t for t in (self.nextReconnectTime, self.writeCheckTime)
+                     if t is not None]
+        if self.connected and self.irc is not None and not self.zombie:
+            deadline = self.irc.getDeadline()
+            if deadline is not None:
+                deadlines.append(deadline)
+        return min(deadlines) if deadlines else None
+
     @classmethod
     def _select(cls):
         if cls._selecting[0]:
             return
         try:
             cls._selecting[0] = True
-            for inst in cls._instances:
-                # Do not use a list comprehension here, we have to edit the list
-                # and not to reassign it.
-                if not inst.connected or \
-                        (minisix.PY3 and inst.conn._closed) or \
-                        (minisix.PY2 and
-                            inst.conn._sock.__class__ is socket._closedsocket):
-                    cls._instances.remove(inst)
-                elif inst.conn.fileno() == -1:
-                    inst.reconnect()
-            if not cls._instances:
-                return
-            rlist, wlist, xlist = select.select([x.conn for x in cls._instances],
-                    [], [], conf.supybot.drivers.poll())
-            for instance in cls._instances:
-                if instance.conn in rlist:
-                    instance._read()
+            if cls._selector is not None:
+                cls._selectReadable()
+            else:
+                cls._selectReadableFallback()
         except select.error as e:
             if e.args[0] != errno.EINTR:
                 # 'Interrupted system call'
                 raise
         finally:
             cls._selecting[0] = False
-        for instance in cls._instances:
+        for instance in cls._instances[:]:
             if instance.irc and not instance.irc.zombie:
                 instance._sendIfMsgs()
 
+    @classmethod
+    def _selectReadable(cls):
+        if not cls._instances:
+            return
+        events = cls._selector.select(drivers.getTimeout())
+        # Sockets are unregistered before being closed, so they are all
+        # open.
+        for (key, mask) in events:
+            instance = key.data
+            if instance in cls._instances:
+                instance._read()
+
+    @classmethod
+    def _selectReadableFallback(cls):
+        for inst in cls._instances[:]:
+            if not inst.connected or \
+                    (minisix.PY3 and inst.conn._closed) or \
+                    (minisix.PY2 and
+                        inst.conn._sock.__class__ is socket._closedsocket):
+                cls._instances.remove(inst)
+            elif inst.conn.fileno() == -1:
+                inst.reconnect()
+        if not cls._instances:
+            return
+        rlist, wlist, xlist = select.select([x.conn for x in cls._instances],
+                [], [], drivers.getTimeout())
+        for instance in cls._instances[:]:
+            if instance.conn in rlist:
+                instance._read()
+
 
     def run(self):
         now = time.time()
@@ -181,25 +281,54 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             self._checkAndWriteOrReconnect()
         if not self.connected:
             # We sleep here because otherwise, if we're the only driver, we'll
-            # spin at 100% CPU while we're disconnected.
-            time.sleep(conf.supybot.drivers.poll())
+            # spin at 100% CPU while we're disconnected.  If other sockets
+            # are connected, their select() does the waiting for us.
+            if not self._instances:
+                time.sleep(drivers.getTimeout())
             return
         self._sendIfMsgs()
         self._select()
 
+    def _recv(self):
+        """Reads from the socket into the reusable read buffer, and appends
+        what was read to self.inbuffer.  Returns the number of bytes read."""
+        readSize = conf.supybot.drivers.readSize()
+        if self.readbuffer is None or len(self.readbuffer) != readSize:
+            self.readbuffer = bytearray(readSize)
+        received = self.conn.recv_into(self.readbuffer, readSize)
+        self.inbuffer += memoryview(self.readbuffer)[:received]
+        return received
+
     def _read(self):
         """Called by _select() when we can read data."""
         try:
-            self.inbuffer += self.conn.recv(1024)
+            # Only the newly received bytes need to be searched for line
+            # endings; the beginning of inbuffer is an incomplete line.
+            start = len(self.inbuffer)
+            if not self._recv():
+                self._handleSocketError(
+                        socket.error('Connection closed by the server'))
+                return
+            # An SSL socket may have decrypted more data than we asked for,
+            # which select() will not tell us about.
+            while getattr(self.conn, 'pending', None) and \
+                    self.conn.pending():
+                self._recv()
             self.eagains = 0 # If we successfully recv'ed, we can reset this.
-            lines = self.inbuffer.split(b'\n')
-            self.inbuffer = lines.pop()
-            for line in lines:
-                line = decode_raw_line(line)
+            inbuffer = self.inbuffer
+            lineStart = 0
+            lineEnd = inbuffer.find(b'\n', start)
+            while lineEnd != -1:
+                line = decode_raw_line(bytes(inbuffer[lineStart:lineEnd]))
+                lineStart = lineEnd + 1
+                lineEnd = inbuffer.find(b'\n', lineStart)
 
                 msg = drivers.parseMsg(line)
                 if msg is not None and self.irc is not None:
                     self.irc.feedMsg(msg)
+            # Deleting from the start of a bytearray does not move the rest
+            # of it.
+            del inbuffer[:lineStart]
         except socket.timeout:
             pass
         except SSLError as e:
@@ -222,14 +351,14 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self.nextReconnectTime = None
         if self.connected:
             drivers.log.reconnect(self.irc.network)
-            if self in self._instances:
-                self._instances.remove(self)
+            self._removeInstance()
             try:
                 self.conn.shutdown(socket.SHUT_RDWR)
             except: # "Transport endpoint not connected"
                 pass
             self.conn.close()
             self.connected = False
+        self.inbuffer = bytearray()
         if reset:
             drivers.log.debug('Resetting %s.', self.irc)
             self.irc.reset()
@@ -305,7 +434,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                 drivers.log.connectError(self.currentServer, e)
                 self.scheduleReconnect()
             return
-        self._instances.append(self)
+        self._addInstance()
 
     def _checkAndWriteOrReconnect(self):
         self.writeCheckTime = None
@@ -315,6 +444,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             drivers.log.debug('Socket is writable, it might be connected.')
             self.connected = True
             self.resetDelay()
+            self._addInstance()
         else:
             drivers.log.connectError(self.currentServer, 'Timed out')
             self.reconnect()
@@ -331,8 +461,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self.nextReconnectTime = when
 
     def die(self):
-        if self in self._instances:
-            self._instances.remove(self)
+        self._removeInstance()
         self.zombie = True
         if self.nextReconnectTime is not None:
             self.nextReconnectTime = None
@@ -342,6 +471,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
 
     def _reallyDie(self):
         if self.conn is not None:
+            self._removeInstance()
             self.conn.close()
         drivers.IrcDriver.die(self)
         # self.irc.die() Kill off the ircs yourself, jerk!
@@ -350,7 +480,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         return '%s(%s)' % (self.__class__.__name__, self.irc)
 
     def starttls(self):
-        assert 'ssl' in globals()
+        assert ssl is not None
         network_config = getattr(conf.supybot.networks, self.irc.network)
         certfile = network_config.certfile()
         if not certfile:
@@ -367,6 +497,10 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                     'are vulnerable to man-in-the-middle attacks. Set '
                     'supybot.protocols.ssl.verifyCertificates to "true" '
                     'to enable validity checks.')
+        # Wrapping detaches the underlying socket, so it has to be registered
+        # again afterward.
+        registered = self in self._instances
+        self._removeInstance()
         try:
             self.conn = utils.net.ssl_wrap_socket(self.conn,
                     logger=drivers.log, hostname=self.server[0],
@@ -395,6 +529,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                 % (self.irc.network, e.args[1]))
             raise ssl.SSLError('Aborting because of failed certificate '
                     'verification.')
+        if registered:
+            self._addInstance()
 
 
 
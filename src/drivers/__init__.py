@@ -32,6 +32,7 @@
 Contains various drivers (network, file, and otherwise) for using IRC objects.
 """
 
+import time
 import socket
 
 from .. import conf, ircmsgs, log as supylog, utils
@@ -59,6 +60,16 @@ class IrcDriver(object):
     def reconnect(self, wait=False):
         raise NotImplementedError
 
+    def getDeadline(self):
+        """Returns the time at which this driver needs to be run again even
+        if no input is received in the meantime, or None."""
+        return None
+
+    def wakeUp(self):
+        """Called (possibly from another thread) when a message was queued,
+        for drivers which can send it before their next run."""
+        pass
+
     def name(self):
         return repr(self)
 
@@ -96,6 +107,17 @@ def remove(name):
     """Removes the driver with the given name from the loop."""
     _deadDrivers.add(name)
 
+def getTimeout():
+    """Returns how long a driver can block waiting for input: the time until
+    the earliest deadline of all drivers, bounded by supybot.drivers.poll."""
+    timeout = conf.supybot.drivers.poll()
+    now = time.time()
+    for driver in list(_drivers.values()):
+        deadline = driver.getDeadline()
+        if deadline is not None:
+            timeout = min(timeout, max(0, deadline - now))
+    return timeout
+
 def run():
     """Runs the whole driver loop."""
     for (name, driver) in _drivers.items():
@@ -185,6 +207,20 @@ def newDriver(irc, moduleName=None):
         moduleName = 'supybot.drivers.Socket'
     elif not moduleName.startswith('supybot.drivers.'):
         moduleName = 'supybot.drivers.' + moduleName
+    if moduleName == 'supybot.drivers.Asyncio':
+        network_config = getattr(conf.supybot.networks, irc.network)
+        if network_config.socksproxy():
+            log.warning('The Asyncio driver does not support SOCKS proxies, '
+                        'using the Socket driver for %s.', irc.network)
+            moduleName = 'supybot.drivers.Socket'
+        elif network_config.requireStarttls() and \
+                not network_config.ssl():
+            from . import Asyncio
+            if not Asyncio.supportsStarttls:
+                log.warning('The Asyncio driver does not support STARTTLS '
+                            'on this Python version, using the Socket '
+                            'driver for %s.', irc.network)
+                moduleName = 'supybot.drivers.Socket'
     driverModule = __import__(moduleName, {}, {}, ['not empty'])
     log.debug('Creating new driver (%s) for %s.', moduleName, irc)
     driver = driverModule.Driver(irc)
@@ -194,7 +230,13 @@ def newDriver(irc, moduleName=None):
 def parseMsg(s):
     s = s.strip()
     if s:
-        msg = ircmsgs.IrcMsg(s)
+        if conf.supybot.debug.instrument():
+            start = minisix.time__perf_counter()
+            msg = ircmsgs.IrcMsg(s)
+            # Irc.feedMsg adds it to its stageTimes.
+            msg.tag('parseTime', minisix.time__perf_counter() - start)
+        else:
+            msg = ircmsgs.IrcMsg(s)
         return msg
     else:
         return None
@@ -30,8 +30,12 @@
 import re
 import copy
 import time
+import array
+import heapq
+import bisect
 import random
 import base64
+import logging
 import collections
 
 try:
@@ -41,9 +45,9 @@ except ImportError:
     ecdsa = False
 
 from . import conf, ircdb, ircmsgs, ircutils, log, utils, world
+from .utils import minisix
 from .utils.str import rsplit
-from .utils.iter import chain
-from .utils.structures import smallqueue, RingBuffer
+from .utils.structures import smallqueue, CacheDict
 
 ###
 # The base class for a callback to be registered with an Irc object.  Shows
@@ -66,7 +70,9 @@ class IrcCallback(IrcCommandDispatcher, log.Firewalled):
 
     Callbacks derived from this class should have methods of the form
     "doCommand" -- doPrivmsg, doNick, do433, etc.  These will be called
-    on matching messages.
+    on matching messages.  Unless the callback overrides __call__, the Irc
+    object looks these methods up once per command (until its callbacks
+    change), and only calls the callback for messages it has one for.
     """
     callAfter = ()
     callBefore = ()
@@ -139,26 +145,72 @@ class IrcCallback(IrcCommandDispatcher, log.Firewalled):
         """Makes the callback die.  Called when the parent Irc object dies."""
         pass
 
+# Implementations of IrcCallback.__call__ that do nothing more than calling
+# the callback's handler for the command of the message, if it has one.
+# Callbacks using one of them are not called for other messages.
+dispatchingCalls = set([IrcCallback.__dict__['__call__']])
+
+def _classAttribute(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+def _overrides(callback, name):
+    """Returns whether the callback does something in the given method of
+    IrcCallback."""
+    if not isinstance(callback, IrcCallback):
+        return True
+    return _classAttribute(type(callback), name) is not \
+        IrcCallback.__dict__[name]
+
+def _subscribes(callback, command):
+    """Returns whether the callback must be called for messages with the
+    given command."""
+    if not isinstance(callback, IrcCallback):
+        return True
+    cls = type(callback)
+    if _classAttribute(cls, '__call__') not in dispatchingCalls or \
+       _classAttribute(cls, '__getattr__') is not None or \
+       _classAttribute(cls, 'dispatchCommand') is not \
+            IrcCommandDispatcher.__dict__['dispatchCommand']:
+        return True
+    return callback.dispatchCommand(command) is not None
+
 ###
-# Basic queue for IRC messages.  It doesn't presently (but should at some
-# later point) reorder messages based on priority or penalty calculations.
+# Basic queue for IRC messages.  Messages are ordered by priority, and sent as
+# fast as their penalty allows.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
-class IrcMsgQueue(object):
-    """Class for a queue of IrcMsgs.  Eventually, it should be smart.
 
-    Probably smarter than it is now, though it's gotten quite a bit smarter
-    than it originally was.  A method to "score" methods, and a heapq to
-    maintain a priority queue of the messages would be the ideal way to do
-    intelligent queuing.
+# How many times supybot.protocols.irc.throttleTime sending a message costs,
+# for commands that are more expensive for servers than others.  Other
+# commands cost 1.  No message costs more than supybot.protocols.irc.queuing.
+# burst, so with a burst of 1 they are all sent at the same rate.
+_penalties = {'JOIN': 2, 'NAMES': 2, 'WHO': 2, 'WHOIS': 2, 'WHOWAS': 2,
+              'LINKS': 2, 'MOTD': 2, 'LIST': 5}
 
-    As it stands, however, we simply keep track of 'high priority' messages,
-    'low priority' messages, and normal messages, and just make sure to return
-    the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+def penalty(msg):
+    """Returns how many times supybot.protocols.irc.throttleTime sending the
+    message costs."""
+    return _penalties.get(msg.command, 1)
+
+class IrcMsgQueue(object):
+    """Class for a queue of IrcMsgs.
+
+    Messages are kept in a heap, scored by their priority: 'high priority'
+    ones are returned before the normal ones before the 'low priority'
+    ones.  Within a priority, messages to different targets are interleaved
+    (fair queuing: each message is given a virtual finish time, which is the
+    one of the previous message to the same target, or the current virtual
+    time, plus its penalty), so a long reply to a channel does not delay
+    replies to other channels; messages to the same target are returned in
+    the order they were queued.  How fast they are sent is up to
+    Irc.takeMsg, depending on their penalty.
     """
-    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
+    __slots__ = ('msgs', 'counter', 'lastJoin', 'finishTimes', 'virtualTimes',
+                 'depths', 'index')
     def __init__(self, iterable=()):
         self.reset()
         for msg in iterable:
@@ -167,9 +219,57 @@ class IrcMsgQueue(object):
     def reset(self):
         """Clears the queue."""
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.counter = 0
+        self.msgs = []
+        # (priority, target) -> virtual finish time of its last message
+        self.finishTimes = {}
+        # priority -> virtual finish time of the last message dequeued
+        self.virtualTimes = [0, 0, 0]
+        # target -> number of queued messages
+        self.depths = {}
+        # (command, prefix, args) -> number of such queued messages, so
+        # that finding duplicates does not require a scan of the queue.
+        self.index = {}
+
+    def _push(self, msg):
+        if msg.command in _high:
+            priority = 0
+        elif msg.command in _low:
+            priority = 2
+        else:
+            priority = 1
+        if msg.args:
+            target = ircutils.toLower(msg.args[0])
+        else:
+            target = ''
+        key = (priority, target)
+        finishTime = max(self.virtualTimes[priority],
+                         self.finishTimes.get(key, 0)) + penalty(msg)
+        self.finishTimes[key] = finishTime
+        self.depths[target] = self.depths.get(target, 0) + 1
+        key = (msg.command, msg.prefix, msg.args)
+        self.index[key] = self.index.get(key, 0) + 1
+        # The counter makes sure two entries are never equal, so messages
+        # themselves are never compared.
+        heapq.heappush(self.msgs,
+                       (priority, finishTime, self.counter, target, msg))
+        self.counter += 1
+
+    def _pop(self):
+        (priority, finishTime, _, target, msg) = heapq.heappop(self.msgs)
+        self.virtualTimes[priority] = finishTime
+        self.depths[target] -= 1
+        if not self.depths[target]:
+            # Forget about it, its next message will start from the current
+            # virtual time anyway.
+            del self.depths[target]
+            for priority in range(3):
+                self.finishTimes.pop((priority, target), None)
+        key = (msg.command, msg.prefix, msg.args)
+        self.index[key] -= 1
+        if not self.index[key]:
+            del self.index[key]
+        return msg
 
     def enqueue(self, msg):
         """Enqueues a given message."""
@@ -179,50 +279,44 @@ class IrcMsgQueue(object):
             log.info('Not adding message %q to queue, already added.', s)
             return False
         else:
-            if msg.command in _high:
-                self.highpriority.enqueue(msg)
-            elif msg.command in _low:
-                self.lowpriority.enqueue(msg)
-            else:
-                self.normal.enqueue(msg)
+            self._push(msg)
             return True
 
+    def peek(self):
+        """Returns the message dequeue would return, without removing it."""
+        if self.msgs:
+            return self.msgs[0][-1]
+        else:
+            return None
+
     def dequeue(self):
         """Dequeues a given message."""
-        msg = None
-        if self.highpriority:
-            msg = self.highpriority.dequeue()
-        elif self.normal:
-            msg = self.normal.dequeue()
-        elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
-            if msg.command == 'JOIN':
-                limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
-                now = time.time()
-                if self.lastJoin + limit <= now:
-                    self.lastJoin = now
-                else:
-                    self.lowpriority.enqueue(msg)
-                    msg = None
+        if not self.msgs:
+            return None
+        msg = self._pop()
+        if msg.command == 'JOIN':
+            limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+            now = time.time()
+            if self.lastJoin + limit <= now:
+                self.lastJoin = now
+            else:
+                self._push(msg)
+                msg = None
         return msg
 
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return (msg.command, msg.prefix, msg.args) in self.index
 
     def __bool__(self):
-        return bool(self.highpriority or self.normal or self.lowpriority)
+        return bool(self.msgs)
     __nonzero__ = __bool__
 
     def __len__(self):
-        return len(self.highpriority)+len(self.lowpriority)+len(self.normal)
+        return len(self.msgs)
 
     def __repr__(self):
         name = self.__class__.__name__
-        return '%s(%r)' % (name, list(chain(self.highpriority,
-                                            self.normal,
-                                            self.lowpriority)))
+        return '%s(%r)' % (name, [x[-1] for x in sorted(self.msgs)])
     __str__ = __repr__
 
 
@@ -230,67 +324,195 @@ class IrcMsgQueue(object):
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+# Flags of the members of a channel, in ChannelState.members.  Only _USER
+# members are in the channel; the other flags may be set on nicks we did not
+# see joining.
+_USER = 1
+_OP = 2
+_HALFOP = 4
+_VOICE = 8
+_FLAGS = (_USER, _OP, _HALFOP, _VOICE)
+
+# Power prefixes, in NAMES replies.
+# & is used to denote protected users in UnrealIRCd
+# ~ is used to denote channel owner in UnrealIRCd
+# ! is used to denote protected users in UltimateIRCd
+_prefixFlags = {'@': _OP, '&': _OP, '~': _OP, '!': _OP,
+                '%': _HALFOP, '+': _VOICE}
+_prefixChars = ''.join(_prefixFlags)
+
+class ChannelMembers(collections.MutableSet):
+    """The nicks of a ChannelState having a given flag.  Behaves like the
+    IrcSet which was used to store them."""
+    __slots__ = ('chan', 'flag')
+    def __init__(self, chan, flag):
+        self.chan = chan
+        self.flag = flag
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # Used by the operators of MutableSet, like &.
+        return ircutils.IrcSet(iterable)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def __contains__(self, nick):
+        return bool(self.chan._getFlags(nick) & self.flag)
+
+    def __iter__(self):
+        nicks = self.chan.nicks
+        flag = self.flag
+        for (key, flags) in self.chan.members.items():
+            if flags & flag:
+                yield nicks[key]
+
+    def __len__(self):
+        return self.chan.counts[self.flag]
+
+    def add(self, nick):
+        self.chan._setFlags(nick, self.flag, 0)
+
+    def discard(self, nick):
+        self.chan._setFlags(nick, 0, self.flag)
+
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    __slots__ = ('members', 'nicks', 'counts', 'bans', 'topic', 'modes',
+                 'created')
+    # Set by the ChannelsDict this is stored in (not part of the state, so
+    # not in __slots__), to keep its index of nicks up to date.
+    _name = None
+    _nicksToChannels = None
     def __init__(self):
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
+        # Normalized nick -> flags, and normalized nick -> nick.
+        self.members = {}
+        self.nicks = {}
+        # Flag -> number of members having it.
+        self.counts = dict.fromkeys(_FLAGS, 0)
         self.modes = {}
 
+    users = property(lambda self: ChannelMembers(self, _USER))
+    ops = property(lambda self: ChannelMembers(self, _OP))
+    halfops = property(lambda self: ChannelMembers(self, _HALFOP))
+    voices = property(lambda self: ChannelMembers(self, _VOICE))
+
     def isOp(self, nick):
-        return nick in self.ops
+        return bool(self._getFlags(nick) & _OP)
     def isOpPlus(self, nick):
-        return nick in self.ops
+        return bool(self._getFlags(nick) & _OP)
     def isVoice(self, nick):
-        return nick in self.voices
+        return bool(self._getFlags(nick) & _VOICE)
     def isVoicePlus(self, nick):
-        return nick in self.voices or nick in self.halfops or nick in self.ops
+        return bool(self._getFlags(nick) & (_VOICE | _HALFOP | _OP))
     def isHalfop(self, nick):
-        return nick in self.halfops
+        return bool(self._getFlags(nick) & _HALFOP)
     def isHalfopPlus(self, nick):
-        return nick in self.halfops or nick in self.ops
+        return bool(self._getFlags(nick) & (_HALFOP | _OP))
 
     def addUser(self, user):
         "Adds a given user to the ChannelState.  Power prefixes are handled."
-        nick = user.lstrip('@%+&~!')
-        if not nick:
-            return
-        # & is used to denote protected users in UnrealIRCd
-        # ~ is used to denote channel owner in UnrealIRCd
-        # ! is used to denote protected users in UltimateIRCd
-        while user and user[0] in '@%+&~!':
-            (marker, user) = (user[0], user[1:])
-            assert user, 'Looks like my caller is passing chars, not nicks.'
-            if marker in '@&~!':
-                self.ops.add(nick)
-            elif marker == '%':
-                self.halfops.add(nick)
-            elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+        self.addUsers((user,))
+
+    def addUsers(self, users):
+        """Adds the given users to the ChannelState at once, eg. from a NAMES
+        reply.  Power prefixes are handled, including several of them for
+        the same user (multi-prefix)."""
+        members = self.members
+        nicks = self.nicks
+        added = []
+        for user in users:
+            nick = user.lstrip(_prefixChars)
+            if not nick:
+                continue
+            flags = _USER
+            for marker in user[:len(user)-len(nick)]:
+                flags |= _prefixFlags[marker]
+            key = ircutils.toLower(nick)
+            old = members.get(key, 0)
+            if not old:
+                key = minisix.intern(key)
+                nicks[key] = key if nick == key else minisix.intern(nick)
+            members[key] = old | flags
+            self._count(old, old | flags)
+            if not old & _USER:
+                added.append(nicks[key])
+        for nick in added:
+            self._indexUser(nick)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of their categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        flags = self._getFlags(oldNick)
+        if flags:
+            self._setFlags(oldNick, 0, flags)
+            self._setFlags(newNick, flags, 0)
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        self._setFlags(user, 0, _USER | _OP | _HALFOP | _VOICE)
+
+    def _getFlags(self, nick):
+        try:
+            return self.members.get(ircutils.toLower(nick), 0)
+        except (TypeError, AttributeError):
+            # Not a nick.
+            return 0
+
+    def _setFlags(self, nick, add, remove):
+        key = ircutils.toLower(nick)
+        old = self.members.get(key, 0)
+        new = (old | add) & ~remove
+        if new == old:
+            return
+        if not old:
+            # Nicks are shared by all the channels they are in.
+            key = minisix.intern(key)
+            self.nicks[key] = key if nick == key else minisix.intern(nick)
+        nick = self.nicks[key]
+        if new:
+            self.members[key] = new
+        else:
+            del self.members[key]
+            del self.nicks[key]
+        self._count(old, new)
+        if (old ^ new) & _USER:
+            if new & _USER:
+                self._indexUser(nick)
+            else:
+                self._unindexUser(nick)
+
+    def _count(self, old, new):
+        counts = self.counts
+        for flag in _FLAGS:
+            if (old ^ new) & flag:
+                if new & flag:
+                    counts[flag] += 1
+                else:
+                    counts[flag] -= 1
+
+    def _indexUser(self, nick):
+        index = self._nicksToChannels
+        if index is not None:
+            try:
+                index[nick].add(self._name)
+            except KeyError:
+                index[nick] = ircutils.IrcSet([self._name])
+
+    def _unindexUser(self, nick):
+        index = self._nicksToChannels
+        if index is not None:
+            try:
+                channels = index[nick]
+            except KeyError:
+                return
+            channels.discard(self._name)
+            if not channels:
+                del index[nick]
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -342,8 +564,333 @@ class ChannelState(utils.python.Object):
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
+class ChannelsDict(ircutils.IrcDict):
+    """An IrcDict of ChannelStates, which also keeps track of the channels
+    each nick is in, so we don't have to look for a nick in every channel
+    on QUITs and NICKs."""
+    def __init__(self, dict=None):
+        # nick -> IrcSet of the names of its channels
+        self.nicksToChannels = ircutils.IrcDict()
+        super(ChannelsDict, self).__init__(dict)
+
+    def __setitem__(self, name, chan):
+        if name in self:
+            del self[name]
+        super(ChannelsDict, self).__setitem__(name, chan)
+        if isinstance(chan, ChannelState):
+            chan._name = name
+            chan._nicksToChannels = self.nicksToChannels
+            for nick in chan.users:
+                chan._indexUser(nick)
+
+    def __delitem__(self, name):
+        chan = self[name]
+        if isinstance(chan, ChannelState):
+            for nick in chan.users:
+                chan._unindexUser(nick)
+            chan._name = None
+            chan._nicksToChannels = None
+        super(ChannelsDict, self).__delitem__(name)
+
+class HostmaskCache(ircutils.IrcDict):
+    """An IrcDict of nicks to hostmasks which, when it holds more than
+    supybot.protocols.irc.maxHostmasks of them, forgets the ones least
+    recently used, except those of the users in the given ChannelsDict."""
+    # Value of supybot.protocols.irc.maxHostmasks, kept up to date by
+    # _maxHostmasksChanged so it isn't read for each hostmask.
+    maxHostmasks = 0
+    def __init__(self, dict=None, channels=None):
+        self.channels = channels
+        # normalized nick -> None, from the least to the most recently used
+        self.lastUsed = collections.OrderedDict()
+        # When most of the hostmasks are those of users in the channels, we
+        # wait until there are some more before trying to evict again.
+        self.nextEviction = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        super(HostmaskCache, self).__init__(dict)
+
+    def use(self, key):
+        self.lastUsed.pop(key, None)
+        self.lastUsed[key] = None
+
+    def __getitem__(self, nick):
+        key = self.key(nick)
+        try:
+            hostmask = self.data[key][1]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.use(key)
+        return hostmask
+
+    def __setitem__(self, nick, hostmask):
+        key = self.key(nick)
+        self.data[key] = (nick, hostmask)
+        # Not evicted with the others (the user may be joining a channel).
+        self.lastUsed.pop(key, None)
+        maxHostmasks = self.maxHostmasks
+        if maxHostmasks and len(self.data) > maxHostmasks and \
+                len(self.data) > self.nextEviction:
+            self.evict(maxHostmasks - maxHostmasks // 10)
+            if len(self.data) > maxHostmasks:
+                self.nextEviction = len(self.data) + \
+                                    max(1, maxHostmasks // 10)
+        self.lastUsed[key] = None
+
+    def __delitem__(self, nick):
+        key = self.key(nick)
+        del self.data[key]
+        del self.lastUsed[key]
+
+    def clear(self):
+        self.data.clear()
+        self.lastUsed.clear()
+        self.nextEviction = 0
+
+    def evict(self, size):
+        """Forgets the least recently used hostmasks of users not in any
+        channel, until at most size are left (or there are no such users
+        left).  The hostmasks of users in channels it goes through become
+        the most recently used."""
+        if self.channels is None:
+            present = ()
+        else:
+            present = self.channels.nicksToChannels
+        kept = []
+        while len(self.data) > size and self.lastUsed:
+            (key, _) = self.lastUsed.popitem(last=False)
+            if key in present:
+                kept.append(key)
+            else:
+                del self.data[key]
+                self.evictions += 1
+        for key in kept:
+            self.lastUsed[key] = None
+
+def _maxHostmasksChanged():
+    HostmaskCache.maxHostmasks = conf.supybot.protocols.irc.maxHostmasks()
+conf.supybot.protocols.irc.maxHostmasks.addCallback(_maxHostmasksChanged)
+_maxHostmasksChanged()
+
+class MessageHistory(object):
+    """A history of the messages received, which keeps columns of their
+    time, command, prefix and arguments instead of IrcMsg objects, and
+    indexes of the PRIVMSGs and NOTICEs to each target and from each nick.
+    IrcState.history is a view of its last messages (see HistoryView)."""
+    indexedCommands = frozenset(['PRIVMSG', 'NOTICE'])
+    def __init__(self, maxSize):
+        self.reset(maxSize)
+
+    def reset(self, maxSize=None):
+        if maxSize is not None:
+            self.maxSize = max(1, maxSize)
+        maxSize = self.maxSize
+        # Number of messages ever appended, ie. the number of the next one.
+        # Message number n is in row n % maxSize of the columns.
+        self.count = 0
+        self.times = array.array('d', [0]) * maxSize
+        self.commands = [None] * maxSize
+        self.prefixes = [None] * maxSize
+        # The first argument of each message, and the others: PRIVMSGs and
+        # NOTICEs, most of the history, only have a text, which is kept as
+        # is; other messages have a tuple (or None).
+        self.targets = [None] * maxSize
+        self.texts = [None] * maxSize
+        self.serverTags = [None] * maxSize
+        self.networks = [None] * maxSize
+        # Normalized target/nick -> array of message numbers.
+        self.byTarget = {}
+        self.byNick = {}
+
+    def __len__(self):
+        return min(self.count, self.maxSize)
+
+    def append(self, msg):
+        n = self.count
+        row = n % self.maxSize
+        args = msg.args
+        self.times[row] = msg.tagged('receivedAt') or msg.time or time.time()
+        self.commands[row] = msg.command
+        self.prefixes[row] = msg.prefix
+        if args:
+            self.targets[row] = minisix.intern(args[0])
+        else:
+            self.targets[row] = None
+        if len(args) == 2:
+            self.texts[row] = args[1]
+        elif len(args) > 2:
+            self.texts[row] = args[1:]
+        else:
+            self.texts[row] = None
+        self.serverTags[row] = msg.server_tags or None
+        self.networks[row] = msg.tagged('receivedOn')
+        self.count += 1
+        if msg.command in self.indexedCommands and msg.prefix and \
+                len(args) >= 2:
+            self._index(self.byTarget, ircutils.toLower(args[0]), n)
+            self._index(self.byNick, ircutils.toLower(msg.nick), n)
+        if self.count % self.maxSize == 0:
+            self._sweep()
+
+    def _index(self, index, key, n):
+        numbers = index.get(key)
+        if numbers is None:
+            index[key] = array.array('l', [n])
+            return
+        numbers.append(n)
+        oldest = self.count - self.maxSize
+        if numbers[0] < oldest:
+            # Forget the numbers of messages which are gone, once they are
+            # half of the index.
+            i = bisect.bisect_left(numbers, oldest)
+            if 2*i >= len(numbers):
+                del numbers[:i]
+
+    def _sweep(self):
+        """Forgets the targets and nicks with no message left."""
+        oldest = self.count - self.maxSize
+        for index in (self.byTarget, self.byNick):
+            for key in [key for (key, numbers) in index.items()
+                        if numbers[-1] < oldest]:
+                del index[key]
+
+    def _getArgs(self, row):
+        target = self.targets[row]
+        text = self.texts[row]
+        if target is None:
+            return ()
+        elif text is None:
+            return (target,)
+        elif isinstance(text, tuple):
+            return (target,) + text
+        else:
+            return (target, text)
+
+    def _getMsg(self, row):
+        msg = ircmsgs.IrcMsg(prefix=self.prefixes[row],
+                             command=self.commands[row],
+                             args=self._getArgs(row))
+        if self.serverTags[row] is not None:
+            msg.server_tags = self.serverTags[row].copy()
+        msg.time = self.times[row]
+        msg.tag('receivedAt', self.times[row])
+        if self.networks[row] is not None:
+            msg.tag('receivedOn', self.networks[row])
+        return msg
+
+    def getMsg(self, n):
+        """Returns message number n, or None if it is not kept anymore."""
+        if self.count - len(self) <= n < self.count:
+            return self._getMsg(n % self.maxSize)
+        return None
+
+    def search(self, channel=None, nick=None, before=None):
+        """Yields the PRIVMSGs and NOTICEs sent to the given channel (or
+        nick), and/or from the given nick, received before the given time,
+        most recent first."""
+        if channel is not None:
+            channel = ircutils.toLower(channel)
+        if nick is not None:
+            nick = ircutils.toLower(nick)
+        if channel is None and nick is None:
+            numbers = range(self.count - 1, self.count - len(self) - 1, -1)
+        else:
+            indexes = []
+            if channel is not None:
+                indexes.append(self.byTarget.get(channel, ()))
+            if nick is not None:
+                indexes.append(self.byNick.get(nick, ()))
+            # Messages may be appended while we are iterating.
+            numbers = reversed(min(indexes, key=len)[:])
+        for n in numbers:
+            if n < self.count - self.maxSize:
+                break
+            row = n % self.maxSize
+            if self.commands[row] not in self.indexedCommands or \
+                    not self.prefixes[row] or self.texts[row] is None:
+                continue
+            if before is not None and self.times[row] >= before:
+                continue
+            if channel is not None and \
+                    ircutils.toLower(self.targets[row]) != channel:
+                continue
+            if nick is not None and ircutils.toLower(
+                    ircutils.nickFromHostmask(self.prefixes[row])) != nick:
+                continue
+            yield self._getMsg(row)
+
+    def last(self, n=1, channel=None, nick=None, regexp=None, before=None):
+        """Returns a list of the (at most) n last messages matching the
+        given criteria, most recent first.  regexp may be a string or a
+        compiled regular expression, searched in the text of messages."""
+        if isinstance(regexp, minisix.string_types):
+            regexp = re.compile(regexp)
+        ret = []
+        if n <= 0:
+            return ret
+        for msg in self.search(channel, nick, before):
+            if regexp is None or regexp.search(msg.args[1]):
+                ret.append(msg)
+                if len(ret) >= n:
+                    break
+        return ret
+
+class HistoryView(object):
+    """The last <maxLength> messages of a MessageHistory, as a read-only
+    sequence of IrcMsgs, oldest first, like the RingBuffer IrcState.history
+    used to be."""
+    __slots__ = ('messages', 'maxLength')
+    def __init__(self, messages, maxLength):
+        self.messages = messages
+        self.maxLength = maxLength
+
+    def __len__(self):
+        return min(len(self.messages), self.maxLength)
+
+    def _numbers(self):
+        count = self.messages.count
+        return range(count - len(self), count)
+
+    def _getMsgs(self, numbers):
+        for n in numbers:
+            # Messages may be appended while we are iterating.
+            msg = self.messages.getMsg(n)
+            if msg is not None:
+                yield msg
+
+    def __iter__(self):
+        return self._getMsgs(self._numbers())
+
+    def __reversed__(self):
+        return self._getMsgs(reversed(self._numbers()))
+
+    def __getitem__(self, i):
+        numbers = self._numbers()
+        if isinstance(i, slice):
+            return list(self._getMsgs(numbers[i]))
+        msg = self.messages.getMsg(numbers[i])
+        if msg is None:
+            raise IndexError(i)
+        return msg
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'HistoryView(%r)' % list(self)
+
 Batch = collections.namedtuple('Batch', 'type arguments messages')
 
+# How many seconds must elapse between two WHOs for the same nick requested by
+# IrcState.requestWho.
+_whoRequestInterval = 60
+
 class IrcState(IrcCommandDispatcher, log.Firewalled):
     """Maintains state of the Irc connection.  Should also become smarter.
     """
@@ -352,35 +899,67 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                  nicksToHostmasks=None, channels=None,
                  capabilities_ack=None, capabilities_nak=None,
                  capabilities_ls=None):
-        if history is None:
-            history = RingBuffer(conf.supybot.protocols.irc.maxHistoryLength())
+        self.maxHistoryLength = conf.supybot.protocols.irc.maxHistoryLength()
+        if isinstance(history, MessageHistory):
+            self.messages = history
+        else:
+            self.messages = MessageHistory(self._getMessagesSize())
+            for msg in history or ():
+                self.messages.append(msg)
         if supported is None:
             supported = utils.InsensitivePreservingDict()
-        if nicksToHostmasks is None:
-            nicksToHostmasks = ircutils.IrcDict()
         if channels is None:
-            channels = ircutils.IrcDict()
+            channels = ChannelsDict()
+        elif not isinstance(channels, ChannelsDict):
+            channels = ChannelsDict(channels)
+        if nicksToHostmasks is None:
+            nicksToHostmasks = HostmaskCache(channels=channels)
+        elif not isinstance(nicksToHostmasks, HostmaskCache):
+            nicksToHostmasks = HostmaskCache(nicksToHostmasks, channels)
+        else:
+            nicksToHostmasks.channels = channels
         self.capabilities_ack = capabilities_ack or set()
         self.capabilities_nak = capabilities_nak or set()
         self.capabilities_ls = capabilities_ls or {}
         self.ircd = None
         self.supported = supported
-        self.history = history
         self.channels = channels
         self.nicksToHostmasks = nicksToHostmasks
         self.batches = {}
+        # NAMES and WHO replies being received, applied all at once when
+        # they end.
+        self._names = ircutils.IrcDict()
+        self._whoReplies = []
+        # Nicks to send a WHO for, see nickToHostmask.
+        self.whoRequests = []
+        self._whoRequested = CacheDict(1000)
+
+    @staticmethod
+    def _getMessagesSize():
+        return max(conf.supybot.protocols.irc.maxHistoryLength(),
+                   conf.supybot.protocols.irc.maxHistoryLength.messages())
+
+    @property
+    def history(self):
+        """The last supybot.protocols.irc.maxHistoryLength messages of
+        self.messages, oldest first."""
+        return HistoryView(self.messages, self.maxHistoryLength)
 
     def reset(self):
         """Resets the state to normal, unconnected state."""
-        self.history.reset()
         self.channels.clear()
         self.supported.clear()
         self.nicksToHostmasks.clear()
-        self.history.resize(conf.supybot.protocols.irc.maxHistoryLength())
+        self.maxHistoryLength = conf.supybot.protocols.irc.maxHistoryLength()
+        self.messages.reset(self._getMessagesSize())
         self.batches = {}
+        self._names.clear()
+        self._whoReplies = []
+        self.whoRequests = []
+        self._whoRequested.clear()
 
     def __reduce__(self):
-        return (self.__class__, (self.history, self.supported,
+        return (self.__class__, (self.messages, self.supported,
                                  self.nicksToHostmasks, self.channels))
 
     def __eq__(self, other):
@@ -395,15 +974,17 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
 
     def copy(self):
         ret = self.__class__()
-        ret.history = copy.deepcopy(self.history)
+        ret.maxHistoryLength = self.maxHistoryLength
+        ret.messages = copy.deepcopy(self.messages)
         ret.nicksToHostmasks = copy.deepcopy(self.nicksToHostmasks)
         ret.channels = copy.deepcopy(self.channels)
+        ret.nicksToHostmasks.channels = ret.channels
         ret.batches = copy.deepcopy(self.batches)
         return ret
 
     def addMsg(self, irc, msg):
         """Updates the state based on the irc object and the message."""
-        self.history.append(msg)
+        self.messages.append(msg)
         if ircutils.isUserHostmask(msg.prefix) and not msg.command == 'NICK':
             self.nicksToHostmasks[msg.nick] = msg.prefix
         if 'batch' in msg.server_tags:
@@ -420,8 +1001,33 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         return self.channels[channel].topic
 
     def nickToHostmask(self, nick):
-        """Returns the hostmask for a given nick."""
-        return self.nicksToHostmasks[nick]
+        """Returns the hostmask for a given nick.
+
+        If it is unknown, a KeyError is raised; and if
+        supybot.protocols.irc.whoOnDemand is enabled, a WHO for the nick is
+        requested, so it will be known next time."""
+        try:
+            return self.nicksToHostmasks[nick]
+        except KeyError:
+            if conf.supybot.protocols.irc.whoOnDemand():
+                self.requestWho(nick)
+            raise
+
+    def requestWho(self, nick):
+        """Asks the Irc object to send a WHO for the given nick, unless one
+        was requested recently."""
+        if not ircutils.isNick(nick):
+            return
+        now = time.time()
+        key = ircutils.toLower(nick)
+        if now - self._whoRequested.get(key, 0) >= _whoRequestInterval:
+            self._whoRequested[key] = now
+            self.whoRequests.append(nick)
+
+    def nickToChannels(self, nick):
+        """Returns the names of the channels a given nick is in, as an
+        IrcSet."""
+        return ircutils.IrcSet(self.channels.nicksToChannels.get(nick, ()))
 
     def do004(self, irc, msg):
         """Handles parsing the 004 reply
@@ -506,7 +1112,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
 
         (nick, user, host) = (msg.args[5], msg.args[2], msg.args[3])
         hostmask = '%s!%s@%s' % (nick, user, host)
-        self.nicksToHostmasks[nick] = hostmask
+        self._whoReplies.append((nick, hostmask))
 
     def do354(self, irc, msg):
         # WHOX reply.
@@ -516,21 +1122,42 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
 
         (__, ___, user, host, nick, ___) = msg.args
         hostmask = '%s!%s@%s' % (nick, user, host)
-        self.nicksToHostmasks[nick] = hostmask
+        self._whoReplies.append((nick, hostmask))
+
+    def do315(self, irc, msg):
+        # End of WHO reply.
+        self.nicksToHostmasks.update(self._whoReplies)
+        self._whoReplies = []
 
     def do353(self, irc, msg):
         # NAMES reply.
         (__, type, channel, items) = msg.args
+        try:
+            self._names[channel][1].append(items)
+        except KeyError:
+            self._names[channel] = (type, [items])
+
+    def do366(self, irc, msg):
+        # End of NAMES reply.
+        channel = msg.args[1]
+        try:
+            (type, replies) = self._names.pop(channel)
+        except KeyError:
+            return
+        names = []
+        for item in ' '.join(replies).split():
+            nick = item.lstrip(_prefixChars)
+            if '!' in nick:
+                # userhost-in-names
+                hostmask = nick
+                nick = nick.split('!', 1)[0]
+                self.nicksToHostmasks[nick] = hostmask
+                item = item[:len(item)-len(hostmask)] + nick
+            names.append(item)
         if channel not in self.channels:
             self.channels[channel] = ChannelState()
         c = self.channels[channel]
-        for item in items.split():
-            if ircutils.isUserHostmask(item):
-                name = ircutils.nickFromHostmask(item)
-                self.nicksToHostmasks[name] = name
-            else:
-                name = item
-            c.addUser(name)
+        c.addUsers(names)
         if type == '@':
             c.modes['s'] = None
 
@@ -619,11 +1246,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-                channel.removeUser(msg.nick)
+        channel_names = self.nickToChannels(msg.nick)
+        for name in channel_names:
+            self.channels[name].removeUser(msg.nick)
         # Remember which channels the user was on
         msg.tag('channels', channel_names)
         if msg.nick in self.nicksToHostmasks:
@@ -655,11 +1280,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             del self.nicksToHostmasks[oldNick]
         except KeyError:
             pass
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-            channel.replaceUser(oldNick, newNick)
+        channel_names = self.nickToChannels(oldNick)
+        for name in channel_names:
+            self.channels[name].replaceUser(oldNick, newNick)
         msg.tag('channels', channel_names)
 
     def doBatch(self, irc, msg):
@@ -676,11 +1299,37 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             assert False, msg.args[0]
 
     def doAway(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-        msg.tag('channels', channel_names)
+        msg.tag('channels', self.nickToChannels(msg.nick))
+
+
+class StageTimes(object):
+    """Keeps the time an Irc object spent in each stage of handling messages,
+    when supybot.debug.instrument is on: parsing the messages it receives,
+    updating its state with them, running the inFilters, then the
+    callbacks, and running the outFilters on the messages it sends."""
+    __slots__ = ('totals', 'counts')
+    stages = ('parse', 'state', 'inFilter', 'callbacks', 'outFilter')
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.totals = dict.fromkeys(self.stages, 0.0)
+        self.counts = dict.fromkeys(self.stages, 0)
+
+    def add(self, stage, elapsed):
+        self.totals[stage] += elapsed
+        self.counts[stage] += 1
+
+    def average(self, stage):
+        """Returns the average time spent in the stage per message, or None
+        if no message went through it."""
+        if not self.counts[stage]:
+            return None
+        return self.totals[stage] / self.counts[stage]
+
+    def __bool__(self):
+        return any(self.counts.values())
+    __nonzero__ = __bool__
 
 
 ###
@@ -711,6 +1360,8 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         self.state = IrcState()
         self.queue = IrcMsgQueue()
         self.fastqueue = smallqueue()
+        self.stageTimes = StageTimes()
+        self._resetDispatchTables()
         self.driver = None # The driver should set this later.
         self._setNonResettingVariables()
         self._queueConnectMessages()
@@ -775,6 +1426,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         assert len(cbs) == len(self.callbacks), \
                'cbs: %s, self.callbacks: %s' % (cbs, self.callbacks)
         self.callbacks[:] = cbs
+        self._callbacksChanged()
 
     def getCallback(self, name):
         """Gets a given callback by name."""
@@ -792,12 +1444,51 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             return cb.name().lower() == name
         (bad, good) = utils.iter.partition(nameMatches, self.callbacks)
         self.callbacks[:] = good
+        self._callbacksChanged()
         return bad
 
+    def _callbacksChanged(self):
+        # The list of callbacks is usually shared by all Irc objects.
+        for irc in world.ircs:
+            if irc.callbacks is self.callbacks:
+                irc._resetDispatchTables()
+        self._resetDispatchTables()
+
+    def _resetDispatchTables(self):
+        """Forgets which callbacks have to be called for what; it is
+        computed again as messages come."""
+        self._subscribers = {}
+        self._inFilters = None
+        self._outFilters = None
+
+    def _getSubscribers(self, command):
+        """Returns the callbacks which must be called for messages with the
+        given command, in order."""
+        subscribers = self._subscribers.get(command)
+        if subscribers is None:
+            subscribers = [cb for cb in self.callbacks
+                           if _subscribes(cb, command)]
+            self._subscribers[command] = subscribers
+        return subscribers
+
+    def _getInFilters(self):
+        if self._inFilters is None:
+            self._inFilters = [cb for cb in self.callbacks
+                               if _overrides(cb, 'inFilter')]
+        return self._inFilters
+
+    def _getOutFilters(self):
+        if self._outFilters is None:
+            self._outFilters = [cb for cb in reversed(self.callbacks)
+                                if _overrides(cb, 'outFilter')]
+        return self._outFilters
+
     def queueMsg(self, msg):
         """Queues a message to be sent to the server."""
         if not self.zombie:
-            return self.queue.enqueue(msg)
+            ret = self.queue.enqueue(msg)
+            self._wakeUpDriver()
+            return ret
         else:
             log.warning('Refusing to queue %r; %s is a zombie.', msg, self)
             return False
@@ -806,23 +1497,72 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         """Queues a message to be sent to the server *immediately*"""
         if not self.zombie:
             self.fastqueue.enqueue(msg)
+            self._wakeUpDriver()
         else:
             log.warning('Refusing to send %r; %s is a zombie.', msg, self)
 
+    def _wakeUpDriver(self):
+        # Not all drivers are IrcDriver instances (Twisted's isn't).
+        if self.driver is not None and hasattr(self.driver, 'wakeUp'):
+            self.driver.wakeUp()
+
+    def getDeadline(self):
+        """Called by the IrcDriver; returns the time at which takeMsg may
+        return a message even if nothing is queued in the meantime (the end
+        of the throttling of the queue, or the next ping), or None."""
+        if self.fastqueue or self.state.whoRequests:
+            return time.time()
+        elif self.queue:
+            return self._getQueueDeadline()
+        elif self.afterConnect and conf.supybot.protocols.irc.ping():
+            return self.lastping + conf.supybot.protocols.irc.ping.interval()
+        else:
+            return None
+
+    def _getQueueDeadline(self):
+        """Returns the time at which the next queued message can be sent.
+
+        Like servers do, we keep a penalty clock which is pushed forward by
+        the penalty of each message sent (and never lags behind the current
+        time); a message can be sent as long as the clock is less than
+        supybot.protocols.irc.queuing.burst messages ahead."""
+        msg = self.queue.peek()
+        (cost, allowance) = self._getQueueCost(msg)
+        # Messages costing the whole allowance are sent as soon as the clock
+        # caught up with the current time.
+        deadline = self.penaltyTime - allowance + cost
+        if msg.command == 'JOIN':
+            limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+            deadline = max(deadline, self.queue.lastJoin + limit)
+        return deadline
+
+    def _getQueueCost(self, msg):
+        """Returns how many seconds sending the message pushes the penalty
+        clock forward, and how far ahead of the current time the clock can
+        be."""
+        throttleTime = conf.supybot.protocols.irc.throttleTime()
+        allowance = conf.supybot.protocols.irc.queuing.burst() * throttleTime
+        return (min(penalty(msg) * throttleTime, allowance), allowance)
+
     def takeMsg(self):
         """Called by the IrcDriver; takes a message to be sent."""
         if not self.callbacks:
             log.critical('No callbacks in %s.', self)
         now = time.time()
         msg = None
+        if self.state.whoRequests:
+            self._sendWhoRequests()
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            if now < self._getQueueDeadline():
                 log.debug('Irc.takeMsg throttling.')
             else:
                 self.lastTake = now
                 msg = self.queue.dequeue()
+                if msg is not None:
+                    self.penaltyTime = max(self.penaltyTime, now) + \
+                                       self._getQueueCost(msg)[0]
         elif self.afterConnect and \
              conf.supybot.protocols.irc.ping() and \
              now > self.lastping + conf.supybot.protocols.irc.ping.interval():
@@ -838,12 +1578,23 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
                 self.outstandingPing = True
                 self.queueMsg(ircmsgs.ping(now))
         if msg:
-            for callback in reversed(self.callbacks):
+            flush = conf.supybot.debug.flushVeryOften()
+            instrument = conf.supybot.debug.instrument()
+            if instrument:
+                start = minisix.time__perf_counter()
+            for callback in self._getOutFilters():
                 msg = callback.outFilter(self, msg)
                 if msg is None:
                     log.debug('%s.outFilter returned None.', callback.name())
+                    if instrument:
+                        self.stageTimes.add('outFilter',
+                            minisix.time__perf_counter() - start)
                     return self.takeMsg()
-                world.debugFlush()
+                if flush:
+                    world.flush()
+            if instrument:
+                self.stageTimes.add('outFilter',
+                                    minisix.time__perf_counter() - start)
             if len(str(msg)) > 512:
                 # Yes, this violates the contract, but at this point it doesn't
                 # matter.  That's why we gotta go munging in private attributes
@@ -854,6 +1605,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
                 # warning.
                 log.debug('Truncating %r, message is too long.', msg)
                 msg._str = msg._str[:500] + '\r\n'
+                msg._bytes = None
                 msg._len = len(str(msg))
             # I don't think we should do this.  Why should it matter?  If it's
             # something important, then the server will send it back to us,
@@ -861,7 +1613,9 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             # On second thought, we need this for testing.
             if world.testing:
                 self.state.addMsg(self, msg)
-            log.debug('Outgoing message (%s): %s', self.network, str(msg).rstrip('\r\n'))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Outgoing message (%s): %s', self.network,
+                          str(msg).rstrip('\r\n'))
             return msg
         elif self.zombie:
             # We kill the driver here so it doesn't continue to try to
@@ -877,12 +1631,24 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         msg.tag('receivedBy', self)
         msg.tag('receivedOn', self.network)
         msg.tag('receivedAt', time.time())
+        # These are checked once per message rather than every time they
+        # would be needed.
+        debug = log.isEnabledFor(logging.DEBUG)
+        flush = conf.supybot.debug.flushVeryOften()
+        instrument = conf.supybot.debug.instrument()
+        if instrument:
+            clock = minisix.time__perf_counter
+            parseTime = msg.tagged('parseTime')
+            if parseTime is not None:
+                self.stageTimes.add('parse', parseTime)
+            start = clock()
         if msg.args and self.isChannel(msg.args[0]):
             channel = msg.args[0]
         else:
             channel = None
-        preInFilter = str(msg).rstrip('\r\n')
-        log.debug('Incoming message (%s): %s', self.network, preInFilter)
+        if debug:
+            preInFilter = str(msg).rstrip('\r\n')
+            log.debug('Incoming message (%s): %s', self.network, preInFilter)
 
         # Yeah, so this is odd.  Some networks (oftc) seem to give us certain
         # messages with our nick instead of our prefix.  We'll fix that here.
@@ -916,10 +1682,15 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             self.state.addMsg(self, msg)
         except:
             log.exception('Exception in update of IrcState object:')
+        if instrument:
+            end = clock()
+            self.stageTimes.add('state', end - start)
+            start = end
 
         # Now call the callbacks.
-        world.debugFlush()
-        for callback in self.callbacks:
+        if flush:
+            world.flush()
+        for callback in self._getInFilters():
             try:
                 m = callback.inFilter(self, msg)
                 if not m:
@@ -928,17 +1699,27 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
                 msg = m
             except:
                 log.exception('Uncaught exception in inFilter:')
-            world.debugFlush()
-        postInFilter = str(msg).rstrip('\r\n')
-        if postInFilter != preInFilter:
-            log.debug('Incoming message (post-inFilter): %s', postInFilter)
-        for callback in self.callbacks:
+            if flush:
+                world.flush()
+        if instrument:
+            end = clock()
+            self.stageTimes.add('inFilter', end - start)
+            start = end
+        if debug:
+            postInFilter = str(msg).rstrip('\r\n')
+            if postInFilter != preInFilter:
+                log.debug('Incoming message (post-inFilter): %s',
+                          postInFilter)
+        for callback in self._getSubscribers(msg.command):
             try:
                 if callback is not None:
                     callback(self, msg)
             except:
                 log.exception('Uncaught exception in callback:')
-            world.debugFlush()
+            if flush:
+                world.flush()
+        if instrument:
+            self.stageTimes.add('callbacks', clock() - start)
 
     def die(self):
         """Makes the Irc object *promise* to die -- but it won't die (of its
@@ -978,6 +1759,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         self.prefix = '%s!%s@%s' % (self.nick, self.ident, 'unset.domain')
         # The rest.
         self.lastTake = 0
+        self.penaltyTime = 0
         self.server = 'unset'
         self.afterConnect = False
         self.startedAt = time.time()
@@ -1033,13 +1815,13 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         else:
             self.sendAuthenticationMessages()
 
-    def do670(self, irc, msg):
+    def do670(self, msg):
         """STARTTLS accepted."""
         log.info('%s: Starting TLS session.', self.network)
         self.requireStarttls = False
         self.driver.starttls()
         self.sendAuthenticationMessages()
-    def do691(self, irc, msg):
+    def do691(self, msg):
         """STARTTLS refused."""
         log.error('%s: Server refused STARTTLS: %s', self.network, msg.args[0])
         self.feedMsg(ircmsgs.error('STARTTLS upgrade refused by the server'))
@@ -1372,12 +2154,26 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
     def doJoin(self, msg):
         if msg.nick == self.nick:
             channel = msg.args[0]
-            self.queueMsg(ircmsgs.who(channel, args=('%tuhna,1',))) # Ends with 315.
+            if conf.supybot.protocols.irc.whoOnJoin():
+                self.queueMsg(self._who(channel)) # Ends with 315.
             self.queueMsg(ircmsgs.mode(channel)) # Ends with 329.
             for channel in msg.args[0].split(','):
                 self.queueMsg(ircmsgs.mode(channel, '+b'))
             self.startedSync[channel] = time.time()
 
+    def _who(self, target):
+        """Returns a WHO for the given channel or nick, using WHOX if the
+        server supports it."""
+        if 'whox' in self.state.supported:
+            return ircmsgs.who(target, args=('%tuhna,1',))
+        else:
+            return ircmsgs.who(target)
+
+    def _sendWhoRequests(self):
+        for nick in self.state.whoRequests:
+            self.queueMsg(self._who(nick))
+        self.state.whoRequests = []
+
     def do315(self, msg):
         channel = msg.args[1]
         if channel in self.startedSync:
@@ -1442,6 +2238,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
                 # hurt anybody.
                 log.debug('Last Irc, clearing callbacks.')
                 self.callbacks[:] = []
+                self._resetDispatchTables()
         else:
             log.warning('Irc object killed twice: %s', utils.stackTrace())
 
@@ -38,6 +38,7 @@ object (which, as you'll read later, is quite...full-featured :))
 import re
 import time
 import base64
+import calendar
 import datetime
 import warnings
 import functools
@@ -75,6 +76,19 @@ def parse_server_tags(s):
             (key, value) = tag.split('=', 1)
             server_tags[key] = unescape_server_tag_value(value)
     return server_tags
+def parse_server_time(s):
+    """Returns the timestamp in the value of a 'time' server tag."""
+    if len(s) == 24 and s[4] == s[7] == '-' and s[10] == 'T' and \
+            s[13] == s[16] == ':' and s[19] == '.' and s[23] == 'Z':
+        # Usual case, with milliseconds; much faster than strptime.
+        fields = (int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                  int(s[11:13]), int(s[14:16]), int(s[17:19]))
+        datetime.datetime(*fields) # Raises ValueError if it is not a date
+        microseconds = calendar.timegm(fields) * 10**6 + int(s[20:23]) * 1000
+        return float(microseconds) / 10**6
+    date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
+    date = minisix.make_datetime_utc(date)
+    return minisix.datetime__timestamp(date)
 def format_server_tags(server_tags):
     parts = []
     for (key, value) in server_tags.items():
@@ -114,18 +128,26 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
-                 '_hash', '_str', '_repr', '_len', 'tags', 'reply_env',
-                 'server_tags', 'time')
+    __slots__ = ('args', 'command', 'prefix', '_nick', '_user', '_host',
+                 '_hash', '_str', '_bytes', '_repr', '_len', 'tags',
+                 'reply_env', '_raw_tags', '_server_tags', '_time',
+                 '_time_tag')
     def __init__(self, s='', command='', args=(), prefix='', msg=None,
             reply_env=None):
         assert not (msg and s), 'IrcMsg.__init__ cannot accept both s and msg'
         if not s and not command and not msg:
             raise MalformedIrcMsg('IRC messages require a command.')
         self._str = None
+        self._bytes = None
         self._repr = None
         self._hash = None
         self._len = None
+        # The nick, user and host are split from the prefix, and the server
+        # tags (and their time) are parsed, only when they are first used.
+        self._nick = None
+        self._raw_tags = None
+        self._server_tags = None
+        self._time_tag = None
         self.reply_env = reply_env
         self.tags = {}
         if s:
@@ -135,28 +157,24 @@ class IrcMsg(object):
                     s += '\n'
                 self._str = s
                 if s[0] == '@':
-                    (server_tags, s) = s.split(' ', 1)
-                    self.server_tags = parse_server_tags(server_tags[1:])
-                else:
-                    self.server_tags = {}
+                    (raw_tags, s) = s.split(' ', 1)
+                    self._raw_tags = raw_tags[1:]
                 if s[0] == ':':
-                    self.prefix, s = s[1:].split(None, 1)
+                    (prefix, s) = s[1:].split(None, 1)
+                    # The same few prefixes (servers, active users) come up
+                    # again and again; share them.
+                    self.prefix = minisix.intern(prefix)
                 else:
                     self.prefix = ''
-                if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
-                    s, last = s.split(' :', 1)
-                    self.args = s.split()
-                    self.args.append(last.rstrip('\r\n'))
-                else:
-                    self.args = s.split()
-                self.command = self.args.pop(0)
-                if 'time' in self.server_tags:
-                    s = self.server_tags['time']
-                    date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
-                    date = minisix.make_datetime_utc(date)
-                    self.time = minisix.datetime__timestamp(date)
-                else:
-                    self.time = time.time()
+                # Note the space: IPV6 addresses are bad w/o it.
+                (s, separator, last) = s.partition(' :')
+                args = s.split()
+                if separator:
+                    args.append(last.rstrip('\r\n'))
+                self.command = minisix.intern(args.pop(0))
+                self.args = tuple(args)
+                # Overridden by the time tag, if any.
+                self._time = time.time()
             except (IndexError, ValueError):
                 raise MalformedIrcMsg(repr(originalString))
         else:
@@ -180,20 +198,101 @@ class IrcMsg(object):
                 else:
                     self.reply_env = None
                 self.tags = msg.tags.copy()
-                self.server_tags = msg.server_tags
-                self.time = msg.time
+                self._raw_tags = msg._raw_tags
+                self._server_tags = msg._server_tags
+                self._time = msg._time
+                self._time_tag = msg._time_tag
             else:
                 self.prefix = prefix
                 self.command = command
                 assert all(ircutils.isValidArgument, args), args
                 self.args = args
-                self.time = None
-                self.server_tags = {}
-        self.args = tuple(self.args)
+                self._time = None
+            self.args = tuple(self.args)
+
+    def _splitPrefix(self):
         if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+            (self._nick, self._user, self._host) = \
+                    ircutils.splitHostmask(self.prefix)
         else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+            (self._nick, self._user, self._host) = (self.prefix,)*3
+
+    @property
+    def nick(self):
+        if self._nick is None:
+            self._splitPrefix()
+        return self._nick
+
+    @nick.setter
+    def nick(self, value):
+        if self._nick is None:
+            self._splitPrefix()
+        self._nick = value
+
+    @property
+    def user(self):
+        if self._nick is None:
+            self._splitPrefix()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        if self._nick is None:
+            self._splitPrefix()
+        self._user = value
+
+    @property
+    def host(self):
+        if self._nick is None:
+            self._splitPrefix()
+        return self._host
+
+    @host.setter
+    def host(self, value):
+        if self._nick is None:
+            self._splitPrefix()
+        self._host = value
+
+    def _parseServerTags(self):
+        if self._raw_tags is None:
+            # Most messages have no tags; don't keep an empty dict for each
+            # of them until it is needed.
+            self._server_tags = {}
+            return
+        self._server_tags = parse_server_tags(self._raw_tags)
+        self._raw_tags = None
+        self._time_tag = self._server_tags.get('time')
+
+    @property
+    def server_tags(self):
+        if self._server_tags is None:
+            self._parseServerTags()
+        return self._server_tags
+
+    @server_tags.setter
+    def server_tags(self, value):
+        self.time # Parses the time tag of the old server tags, if any.
+        self._server_tags = value
+
+    @property
+    def time(self):
+        if self._raw_tags is not None:
+            self._parseServerTags()
+        if self._time_tag is not None:
+            try:
+                self._time = parse_server_time(self._time_tag)
+            except ValueError:
+                # Keep the time the message was received at.
+                pass
+            self._time_tag = None
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        if self._raw_tags is not None:
+            self._parseServerTags()
+        self._time_tag = None
+        self._time = value
 
     def __str__(self):
         if self._str is not None:
@@ -221,10 +320,24 @@ class IrcMsg(object):
                     self._str = '%s\r\n' % self.command
         return self._str
 
+    def __bytes__(self):
+        """Returns the message as it is sent on the wire.  This is computed
+        once, so drivers do not have to encode a message every time they
+        try to send it."""
+        if self._bytes is not None:
+            return self._bytes
+        if minisix.PY2:
+            self._bytes = str(self)
+        else:
+            self._bytes = str(self).encode('utf8')
+        return self._bytes
+
     def __len__(self):
         return len(str(self))
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return isinstance(other, self.__class__) and \
                hash(self) == hash(other) and \
                self.command == other.command and \
@@ -239,9 +352,7 @@ class IrcMsg(object):
     def __hash__(self):
         if self._hash is not None:
             return self._hash
-        self._hash = hash(self.command) ^ \
-                     hash(self.prefix) ^ \
-                     hash(repr(self.args))
+        self._hash = hash((self.command, self.prefix, self.args))
         return self._hash
 
     def __repr__(self):
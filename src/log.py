@@ -117,6 +117,7 @@ class StdoutStreamHandler(logging.StreamHandler):
     def disable(self):
         self.setLevel(sys.maxsize) # Just in case.
         _logger.removeHandler(self)
+        _setLoggerLevel()
         logging._acquireLock()
         try:
             del logging._handlers[self]
@@ -210,6 +211,16 @@ logging.setLoggerClass(Logger)
 _logger = logging.getLogger('supybot')
 _stdoutHandler = StdoutStreamHandler(sys.stdout)
 
+def _setLoggerLevel():
+    # Messages below the level of every handler would be formatted, then
+    # dropped by each of them; the logger's own level lets us not even
+    # format them.
+    levels = [handler.level for handler in _logger.handlers]
+    level = min(levels) if levels else -1
+    if level <= logging.NOTSET: # NOTSET means "use the parent's level".
+        level = -1
+    _logger.setLevel(level)
+
 class ValidLogLevel(registry.String):
     """Invalid log level."""
     handler = None
@@ -230,6 +241,7 @@ class ValidLogLevel(registry.String):
             self.error()
         if self.handler is not None:
             self.handler.setLevel(level)
+            _setLoggerLevel()
         self.setValue(level)
 
     def __str__(self):
@@ -313,6 +325,7 @@ warning = _logger.warning
 error = _logger.error
 critical = _logger.critical
 exception = _logger.exception
+isEnabledFor = _logger.isEnabledFor
 
 # These were just begging to be replaced.
 registry.error = error
@@ -335,6 +348,8 @@ def getPluginLogger(name):
         handler.setLevel(-1)
         handler.setFormatter(pluginFormatter)
         log.addHandler(handler)
+        # Plugin logfiles get everything, whatever the level of the others.
+        log.setLevel(-1)
     if name in sys.modules:
         log.info('Starting log for %s.', name)
     return log
@@ -411,13 +426,13 @@ _handler.addFilter(PluginLogFilter())
 
 _handler.setLevel(conf.supybot.log.level())
 _logger.addHandler(_handler)
-_logger.setLevel(-1)
 
 _stdoutFormatter = ColorizedFormatter('IF YOU SEE THIS, FILE A BUG!')
 _stdoutHandler.setFormatter(_stdoutFormatter)
 _stdoutHandler.setLevel(conf.supybot.log.stdout.level())
 if not conf.daemonized:
     _logger.addHandler(_stdoutHandler)
+_setLoggerLevel()
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
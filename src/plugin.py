@@ -89,6 +89,8 @@ def renameCommand(cb, name, newName):
         method = getattr(cb.__class__, name)
         setattr(cb.__class__, newName, method)
         delattr(cb.__class__, name)
+        # Other instances of the class may be indexed too.
+        callbacks.commandIndex.reset()
 
 def registerRename(plugin, command=None, newName=None):
     g = conf.registerGlobalValue(conf.supybot.commands.renames, plugin,
@@ -72,9 +72,13 @@ encoder = codecs.getencoder(ENCODING)
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Incremented whenever nodes are removed from the tree, or the registry file
+# is loaded; until it changes, the nodes found by walking the tree can be
+# kept (see callbacks.PluginMixin.registryValue).
+generation = 0
 def open_registry(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
-    global _lastModified
+    global _lastModified, generation
     if clear:
         _cache.clear()
     _fd = open(filename)
@@ -106,6 +110,7 @@ def open_registry(filename, clear=False):
             raise InvalidRegistryFile('Error unpacking line %r' % acc)
         _cache[key] = value
     _lastModified = time.time()
+    generation += 1
     _fd.close()
 
 CONF_FILE_HEADER = """
@@ -295,9 +300,11 @@ class Group(object):
         return node
 
     def unregister(self, name):
+        global generation
         try:
             node = self._children[name]
             del self._children[name]
+            generation += 1
             # We do this because we need to remove case-insensitively.
             name = name.lower()
             for elt in reversed(self._added):
@@ -128,12 +128,21 @@ class Schedule(drivers.IrcDriver):
 
     removePeriodicEvent = removeEvent
 
+    def getDeadline(self):
+        """Returns the time of the next event, so that the driver loop does
+        not block past it."""
+        schedule = self.schedule
+        if schedule:
+            return schedule[0][0]
+        else:
+            return None
+
     def run(self):
         if len(drivers._drivers) == 1 and not world.testing:
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
-        while self.schedule and self.schedule[0][0] < time.time():
+        while self.schedule and self.schedule[0][0] <= time.time():
             with self.lock:
                 (t, name, args, kwargs) = heapq.heappop(self.schedule)
                 f = self.events.pop(name)
@@ -243,6 +243,8 @@ class PluginTestCase(SupyTestCase):
                                                      ignoreDeprecation=True)
                     plugin.loadPluginClass(self.irc, module)
         self.irc.addCallback(TestInstance)
+        # It died with the Irc object of the previous test.
+        callbacks.commandIndex.add(TestInstance)
         for (name, value) in self.config.items():
             group = conf.supybot
             parts = registry.split(name)
@@ -32,6 +32,7 @@
 from __future__ import division
 
 import sys
+import time
 import warnings
 
 if sys.version_info[0] >= 3:
@@ -103,3 +104,6 @@ else:
                      'Python and may lead to incorrect results. You should '
                      'consider upgrading to Python 3.')
         return timedelta__totalseconds(dt - datetime.datetime(1970, 1, 1))
+
+# time.perf_counter was added in Python 3.3.
+time__perf_counter = getattr(time, 'perf_counter', time.time)
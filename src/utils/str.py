@@ -37,6 +37,7 @@ import re
 import time
 import string
 import textwrap
+import functools
 
 from . import minisix
 from .iter import any
@@ -244,6 +245,17 @@ def perlReToPythonRe(s, allowG=False):
     else:
         return r
 
+# The functions returned by perlReToFindall and perlReToReplacer are
+# partials of these, so they can be pickled to be run in another process.
+def _findall(r, s):
+    return r.findall(s)
+
+def _search(r, s):
+    return r.search(s) and r.search(s).group(0) or ''
+
+def _sub(r, replace, count, s):
+    return r.sub(replace, s, count)
+
 def perlReToFindall(s):
     """Converts a string representation of a Perl regular expression (i.e.,
     m/^foo$/i or /foo|bar/) to a Python regular expression, with support for
@@ -251,9 +263,9 @@ def perlReToFindall(s):
     """
     (r, g) = perlReToPythonRe(s, allowG=True)
     if g:
-        return lambda s: r.findall(s)
+        return functools.partial(_findall, r)
     else:
-        return lambda s: r.search(s) and r.search(s).group(0) or ''
+        return functools.partial(_search, r)
 
 def perlReToReplacer(s):
     """Converts a string representation of a Perl regular expression (i.e.,
@@ -280,9 +292,9 @@ def perlReToReplacer(s):
         flags = ''.join(flags)
     r = perlReToPythonRe(sep.join(('', regexp, flags)))
     if g:
-        return lambda s: r.sub(replace, s)
+        return functools.partial(_sub, r, replace, 0)
     else:
-        return lambda s: r.sub(replace, s, 1)
+        return functools.partial(_sub, r, replace, 1)
 
 _perlVarSubstituteRe = re.compile(r'\$\{([^}]+)\}|\$([a-zA-Z][a-zA-Z0-9]*)')
 def perlVariableSubstitute(vars, text):
@@ -456,6 +456,68 @@ class CacheDict(collections.MutableMapping):
     def __len__(self):
         return len(self.d)
 
+class LRUCacheDict(collections.MutableMapping):
+    """A dictionary that forgets the least recently used key when it has
+    <max> keys and another one is set."""
+    __slots__ = ('d', 'max', 'root')
+    def __init__(self, max, **kwargs):
+        self.d = {} # key -> [previous link, next link, key, value]
+        self.max = max
+        self.root = [] # The least recently used key follows it.
+        self.root[:] = [self.root, self.root, None, None]
+        for (key, value) in kwargs.items():
+            self[key] = value
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+    def __getitem__(self, key):
+        link = self.d[key]
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        link = self.d.get(key)
+        if link is None:
+            if len(self.d) >= self.max:
+                oldest = self.root[1]
+                self._unlink(oldest)
+                del self.d[oldest[2]]
+            link = [None, None, key, value]
+            self.d[key] = link
+        else:
+            self._unlink(link)
+            link[3] = value
+        self._append(link)
+
+    def __delitem__(self, key):
+        self._unlink(self.d.pop(key))
+
+    def __contains__(self, key):
+        return key in self.d
+
+    def __iter__(self):
+        # Getting the items moves them, so we can't follow the links while
+        # iterating.
+        keys = []
+        link = self.root[1]
+        while link is not self.root:
+            keys.append(link[2])
+            link = link[1]
+        return iter(keys)
+
+    def __len__(self):
+        return len(self.d)
+
 class TruncatableSet(collections.MutableSet):
     """A set that keeps track of the order of inserted elements so
     the oldest can be removed."""
@@ -30,6 +30,10 @@
 
 from supybot.test import *
 
+import time
+import random
+import threading
+
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
@@ -161,6 +165,67 @@ def testUnicode(self):
         self.assertEqual(tokenize(s), [s])
 
 
+    def testCachedTokensCanBeChanged(self):
+        tokens = tokenize('foo [bar baz]')
+        tokens[1].append('quux')
+        tokens.append('quux')
+        self.assertEqual(tokenize('foo [bar baz]'), ['foo', ['bar', 'baz']])
+
+    def testChannelBrackets(self):
+        brackets = conf.supybot.commands.nested.brackets
+        with brackets.get('#test').context('{}'):
+            self.assertEqual(tokenize('foo {bar} [baz]', channel='#test'),
+                             ['foo', ['bar'], '[baz]'])
+            self.assertEqual(tokenize('foo {bar} [baz]'),
+                             ['foo', '{bar}', ['baz']])
+
+
+class FastTokenizerTestCase(SupyTestCase):
+    """Checks FastTokenizer gives the same tokens (or errors) as
+    Tokenizer."""
+    configurations = [('[]', False, '"'), ('[]', True, '"'), ('', False, '"'),
+                      ('{}', True, '"\''), ('<>', False, '`'),
+                      ('[]', False, '')]
+    corpus = [
+        '', ' ', 'foo', 'foo bar', '  foo \t bar\r\nbaz  ', '"foo bar"', '""',
+        'foo "" bar', '"\\""', '"\\\\"', '"\\"foo\\""', '"foo\\nbar"',
+        '"\\x80"', '"\\u00e9"', "it's", "'foo bar'", '`foo`', 'foo"bar baz"',
+        'foo"', '"foo', '"foo\\"', 'foo\x00bar', '"\x00"', '\x02foo\x02',
+        '\x032,3foo\x03', '[]', '[foo]', '[ foo ]', 'foo [bar]',
+        'foo bar [baz quux]', 'foo [bar [baz] quux]', '[[[]]]', 'a[b]c',
+        '[foo', 'foo]', '[foo]]', '"[foo]"', '{foo}', '<foo>', '(foo)',
+        'foo|bar', 'foo | bar', 'foo | bar | baz', 'foo bar | baz quux',
+        '| foo', 'foo ||bar', 'bar |', '[foo | bar]', '"foo | bar"',
+        'foo [bar] | baz [quux]', 'echo [echo "[foo]"] "bar \\" baz"',
+    ]
+    if minisix.PY3:
+        corpus += ['好', '"好"', '[好 "é"]']
+
+    def assertSameTokens(self, configuration, s):
+        def tokens(tokenizer):
+            try:
+                return tokenizer(*configuration).tokenize(s)
+            except (SyntaxError, ValueError) as e:
+                return (e.__class__, str(e))
+        self.assertEqual(tokens(callbacks.FastTokenizer),
+                         tokens(callbacks.Tokenizer),
+                         '%r with %r' % (s, configuration))
+
+    def testCorpus(self):
+        for configuration in self.configurations:
+            for s in self.corpus:
+                self.assertSameTokens(configuration, s)
+
+    def testRandomStrings(self):
+        rng = random.Random(42)
+        chars = list('ab \t\n"\'`\\[]{}<>|\x00')
+        for configuration in self.configurations:
+            for i in range(500):
+                s = ''.join([rng.choice(chars)
+                             for j in range(rng.randint(0, 12))])
+                self.assertSameTokens(configuration, s)
+
+
 class FunctionsTestCase(SupyTestCase):
     def testCanonicalName(self):
         self.assertEqual('foo', callbacks.canonicalName('foo'))
@@ -286,6 +351,202 @@ class AmbiguityTestCase(PluginTestCase):
         self.irc.addCallback(self.Bar(self.irc))
         self.assertResponse('bar', 'bar.bar')
 
+class CommandIndexTestCase(PluginTestCase):
+    plugins = ('Utilities', 'Alias')
+    class Dynamic(callbacks.Plugin):
+        def isCommandMethod(self, name):
+            return name == 'anything' or \
+                super(CommandIndexTestCase.Dynamic, self).isCommandMethod(name)
+        def getCommandMethod(self, command):
+            return lambda irc, msg, args: irc.reply('dynamic')
+
+    def getCandidates(self, args):
+        cbs = callbacks.commandIndex.getCandidates(self.irc.callbacks, args)
+        return [cb.name() for cb in cbs]
+
+    def testCandidates(self):
+        self.assertEqual(self.getCandidates(['echo', 'foo']), ['Utilities'])
+        self.assertEqual(self.getCandidates(['utilities', 'echo']),
+                         ['Utilities'])
+        self.assertEqual(self.getCandidates(['config', 'list']), ['Config'])
+        self.assertEqual(self.getCandidates(['nonexistentcommand']), [])
+        self.irc.addCallback(self.Dynamic(self.irc))
+        self.assertEqual(self.getCandidates(['nonexistentcommand']),
+                         ['Dynamic'])
+        self.assertResponse('anything', 'dynamic')
+
+    def testAlias(self):
+        self.assertEqual(self.getCandidates(['indexedalias']), [])
+        self.assertNotError('alias add indexedalias echo bar')
+        self.assertEqual(self.getCandidates(['indexedalias']), ['Alias'])
+        self.assertResponse('indexedalias', 'bar')
+        self.assertNotError('alias remove indexedalias')
+        self.assertEqual(self.getCandidates(['indexedalias']), [])
+
+    def testRemoveCallback(self):
+        cb = self.irc.getCallback('Utilities')
+        self.assertEqual(self.getCandidates(['echo', 'foo']), ['Utilities'])
+        self.failUnless(cb in callbacks.commandIndex.indexed)
+        self.irc.removeCallback('Utilities')
+        try:
+            self.assertEqual(self.getCandidates(['echo', 'foo']), [])
+            cb.die()
+            self.failIf(cb in callbacks.commandIndex.indexed)
+        finally:
+            self.irc.addCallback(cb)
+            callbacks.commandIndex.add(cb)
+        self.assertEqual(self.getCandidates(['echo', 'foo']), ['Utilities'])
+
+    def testNewPlugin(self):
+        cb = self.Dynamic(self.irc)
+        try:
+            self.failUnless(cb in callbacks.commandIndex.pending)
+            # Not added to the Irc object yet.
+            self.assertEqual(self.getCandidates(['anything']), [])
+            self.failUnless(cb in callbacks.commandIndex.indexed)
+        finally:
+            cb.die()
+        self.failIf(cb in callbacks.commandIndex.indexed)
+
+    def testDisableEnable(self):
+        self.assertNotError('disable echo')
+        # Index Utilities while echo is disabled.
+        callbacks.commandIndex.reset()
+        try:
+            self.assertNotRegexp('echo foo', 'foo')
+        finally:
+            self.assertNotError('enable echo')
+        self.assertResponse('echo foo', 'foo')
+
+class RegistryValueTestCase(PluginTestCase):
+    plugins = ('Misc',)
+    def testCachedNodes(self):
+        cb = self.irc.getCallback('Misc')
+        mores = conf.supybot.plugins.Misc.mores
+        original = mores()
+        try:
+            self.assertEqual(cb.registryValue('mores', '#foo'), original)
+            # Drops the value of #foo, which was the default one.
+            mores.setValue(original + 1)
+            self.assertEqual(cb.registryValue('mores', '#foo'), original + 1)
+            cb.setRegistryValue('mores', original + 2, '#foo')
+            self.assertEqual(cb.registryValue('mores', '#foo'), original + 2)
+            self.assertEqual(cb.registryValue('mores', '#bar'), original + 1)
+            self.assertEqual(cb.registryValue('mores'), original + 1)
+            self.assertEqual(cb.registryValue('mores', value=False), mores)
+        finally:
+            mores.setValue(original)
+            mores.unregister('#foo')
+        self.assertEqual(cb.registryValue('mores', '#foo'), original)
+
+class CommandThreadPoolTestCase(PluginTestCase):
+    plugins = ('Utilities',)
+    class Blocking(callbacks.Plugin):
+        threaded = True
+        unblocked = threading.Event()
+        def block(self, irc, msg, args):
+            self.unblocked.wait(10)
+            irc.reply('unblocked')
+
+    def testLimits(self):
+        pool = callbacks.commandThreadPool
+        cb = self.Blocking(self.irc)
+        self.irc.addCallback(cb)
+        threads = conf.supybot.commands.threads
+        try:
+            with threads.perPlugin.context(1):
+                with threads.queueSize.context(1):
+                    self.feedMsg('block')
+                    timeout = time.time() + 5
+                    while pool.running.get(cb) != 1 and time.time() < timeout:
+                        time.sleep(0.1)
+                    self.assertEqual(pool.running.get(cb), 1)
+                    # Waits for the first one, even if threads are idle.
+                    self.feedMsg('block')
+                    self.assertEqual(len(pool.queue), 1)
+                    rejected = pool.rejected
+                    self.assertRegexp('block', 'Too many commands')
+                    self.assertEqual(pool.rejected, rejected + 1)
+                    cb.unblocked.set()
+                    replies = []
+                    timeout = time.time() + 5
+                    while len(replies) < 2 and time.time() < timeout:
+                        m = self.irc.takeMsg()
+                        if m is None:
+                            time.sleep(0.1)
+                        else:
+                            replies.append(m.args[1])
+                    self.assertEqual(replies, ['unblocked', 'unblocked'])
+        finally:
+            cb.unblocked.set()
+        timeout = time.time() + 5
+        while cb in pool.running and time.time() < timeout:
+            time.sleep(0.1)
+        self.failIf(pool.queue)
+        self.failIf(cb in pool.running)
+
+class ConcurrentNestedCommandsTestCase(PluginTestCase):
+    plugins = ('Utilities',)
+    class Meeting(object):
+        """Commands that only reply once all of them are running."""
+        def __init__(self, n):
+            self.n = n
+            self.lock = threading.Lock()
+            self.arrived = 0
+            self.everyone = threading.Event()
+        def arrive(self, timeout):
+            with self.lock:
+                self.arrived += 1
+                if self.arrived == self.n:
+                    self.everyone.set()
+            self.everyone.wait(timeout)
+            return self.everyone.isSet()
+
+    def makePlugin(self, name, meeting):
+        def command(self, irc, msg, args):
+            if meeting.arrive(2):
+                irc.reply('%s met' % name)
+            else:
+                irc.reply('%s waited' % name)
+        def fail(self, irc, msg, args):
+            irc.error('%s failed' % name)
+        def ignore(self, irc, msg, args):
+            # Tagged before the others reply, but replies after them.
+            msg.tag('ignored')
+            meeting.arrive(2)
+            time.sleep(0.2)
+            irc.reply('')
+        cb = type(name.capitalize(), (callbacks.Plugin,),
+                  {'threaded': True, name: command, name + 'fail': fail,
+                   name + 'ignore': ignore})
+        return cb(self.irc)
+
+    def testConcurrentNestedCommands(self):
+        meeting = self.Meeting(2)
+        for name in ('foo', 'bar'):
+            self.irc.addCallback(self.makePlugin(name, meeting))
+        with conf.supybot.commands.nested.concurrent.context(True):
+            self.assertResponse('echo [foo] [echo baz] [ignore] [bar]',
+                                'foo met baz bar met', timeout=5)
+            self.assertRegexp('echo [foo] [barfail]', 'bar failed',
+                              timeout=5)
+            self.failIf(self.irc.takeMsg())
+
+    def testConcurrentIgnoredNestedCommands(self):
+        meeting = self.Meeting(2)
+        for name in ('foo', 'bar'):
+            self.irc.addCallback(self.makePlugin(name, meeting))
+        with conf.supybot.commands.nested.concurrent.context(True):
+            self.assertResponse('echo [fooignore] [bar] baz',
+                                'bar met baz', timeout=5)
+
+    def testSequentialNestedCommands(self):
+        meeting = self.Meeting(2)
+        for name in ('foo', 'bar'):
+            self.irc.addCallback(self.makePlugin(name, meeting))
+        self.assertResponse('echo [foo] [bar]', 'foo waited bar met',
+                            timeout=5)
+
 class ProperStringificationOfReplyArgs(PluginTestCase):
     plugins = ('Misc',) # Same as above.
     class NonString(callbacks.Plugin):
@@ -28,13 +28,18 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+import socket
 import sys
+import time
 import getopt
+import threading
 
 from supybot.test import *
 
 from supybot.commands import *
 import supybot.conf as conf
+import supybot.commands as commands
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.utils.minisix as minisix
@@ -202,6 +207,58 @@ class FirstTestCase(CommandsTestCase):
         spec = [first('regexpMatcher', 'regexpReplacer'), 'text']
         self.assertStateErrored(spec, ['s/foo/bar/', 'x' * 512], errored=False)
 
+class ProcessTestCase(SupyTestCase):
+    if not world.disableMultiprocessing:
+        def testPooledProcess(self):
+            pid = process(os.getpid, timeout=10)
+            self.assertNotEqual(pid, os.getpid())
+            self.assertEqual(process(os.getpid, timeout=10), pid)
+            self.assertRaises(ZeroDivisionError, process, divmod, 1, 0,
+                              timeout=10)
+
+        def testClosuresAreForked(self):
+            pool = commands.processPool
+            forked = pool.forked
+            self.assertEqual(process(lambda x: x + 1, 41, timeout=10), 42)
+            self.assertEqual(pool.forked, forked + 1)
+
+        def testTimeout(self):
+            pool = commands.processPool
+            killed = pool.killed
+            pid = process(os.getpid, timeout=10)
+            self.assertRaises(commands.ProcessTimeoutError, process,
+                              time.sleep, 10, timeout=0.5)
+            self.assertEqual(pool.killed, killed + 1)
+            # The process that timed out was killed, so another one is
+            # started.
+            self.assertNotEqual(process(os.getpid, timeout=10), pid)
+
+        def testRestart(self):
+            pid = process(os.getpid, timeout=10)
+            commands.processPool.restart()
+            self.assertNotEqual(process(os.getpid, timeout=10), pid)
+
+        def testUnpicklableResult(self):
+            # Like when forking a process, there is no result.
+            self.assertEqual(process(threading.Lock, timeout=10), None)
+            self.assertEqual(process(lambda: threading.Lock(), timeout=10),
+                             None)
+
+        def testInheritedSocketsAreClosed(self):
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(1)
+            # Workers forked while the socket is open.
+            commands.processPool.restart()
+            process(os.getpid, timeout=10)
+            address = sock.getsockname()
+            sock.close()
+            client = socket.socket()
+            try:
+                self.assertRaises(socket.error, client.connect, address)
+            finally:
+                client.close()
+
 class GetoptTestCase(PluginTestCase):
     plugins = ('Misc',) # We put something so it does not complain
     class Foo(callbacks.Plugin):
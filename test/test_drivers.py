@@ -0,0 +1,269 @@
+###
+# Copyright (c) 2026, The Limnoria Contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import os
+import socket
+import threading
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+from supybot.utils import minisix
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+try:
+    import supybot.drivers.Asyncio as Asyncio
+except (ImportError, SyntaxError): # Python < 3.5
+    Asyncio = None
+
+certfile = os.path.join(os.path.dirname(__file__), 'test_drivers.pem')
+
+class LoopbackServer(object):
+    """A server accepting connections on the loopback interface, from a
+    thread.  The lines it receives are put in the queue of each
+    connection."""
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.connections = minisix.queue.Queue()
+        self.thread = threading.Thread(target=self._accept)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                (conn, address) = self.sock.accept()
+            except socket.error: # Closed
+                return
+            self.connections.put(LoopbackConnection(conn))
+
+    def close(self):
+        self.sock.close()
+
+class LoopbackConnection(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.file = conn.makefile('rb')
+        self.lines = minisix.queue.Queue()
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self):
+        while True:
+            try:
+                line = self.file.readline()
+            except (socket.error, ValueError): # Closed
+                line = b''
+            if not line:
+                self.lines.put(None)
+                return
+            self.receivedAt = time.time()
+            line = line.decode().strip()
+            self.lines.put(line)
+            if line == 'STARTTLS':
+                # Like a server would, reply and upgrade the connection
+                # before reading anything else.
+                self.send(':server 670 test :STARTTLS successful')
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.load_cert_chain(certfile)
+                self.conn = context.wrap_socket(self.conn, server_side=True)
+                self.file = self.conn.makefile('rb')
+
+    def send(self, line):
+        self.conn.sendall(line.encode() + b'\r\n')
+
+    def close(self):
+        # The reading thread's file still refers to the socket.
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.conn.close()
+
+
+if Asyncio is not None:
+    class AsyncioDriverTestCase(SupyTestCase):
+        network = 'testasyncio'
+
+        def setUp(self):
+            SupyTestCase.setUp(self)
+            self.server = LoopbackServer()
+            conf.registerNetwork(self.network)
+            self.config = conf.supybot.networks.get(self.network)
+            self.config.servers.setValue(['127.0.0.1:%s' % self.server.port])
+            self.config.ssl.setValue(False)
+            self.irc = irclib.Irc(self.network)
+            self.driver = Asyncio.AsyncioDriver(self.irc)
+            self.irc.driver = self.driver
+
+        def tearDown(self):
+            # The next test's driver has the same name, so this one must be
+            # added to the drivers, then removed, before it is created.
+            with conf.supybot.drivers.poll.context(0.05):
+                drivers.run()
+                self.driver.die()
+                self.runDrivers(lambda: self.driver.task is None)
+                drivers.run()
+            self.server.close()
+            self.config.requireStarttls.setValue(False)
+            SupyTestCase.tearDown(self)
+
+        def runDrivers(self, predicate, timeout=10):
+            with conf.supybot.drivers.poll.context(0.05):
+                deadline = time.time() + timeout
+                while not predicate():
+                    self.assertTrue(time.time() < deadline, 'timed out')
+                    drivers.run()
+
+        def getConnection(self):
+            self.runDrivers(lambda: not self.server.connections.empty())
+            return self.server.connections.get()
+
+        def getMsg(self, conn):
+            """Returns the next message the server received on the
+            connection, or None if it was closed."""
+            self.runDrivers(lambda: not conn.lines.empty())
+            line = conn.lines.get()
+            if line is not None:
+                return ircmsgs.IrcMsg(line)
+            return None
+
+        def assertCommand(self, msg, command, *args):
+            self.assertEqual(msg.command, command)
+            self.assertEqual(msg.args[:len(args)], args)
+
+        def testLazyLoop(self):
+            self.assertTrue(Asyncio.runner is not None)
+            self.assertTrue(Asyncio.loop is not None)
+
+        def testConnectAndSend(self):
+            conn = self.getConnection()
+            self.assertCommand(self.getMsg(conn), 'CAP', 'LS', '302')
+            self.assertCommand(self.getMsg(conn), 'NICK', self.irc.nick)
+            self.assertCommand(self.getMsg(conn), 'USER')
+            self.assertTrue(self.driver.connected)
+            conn.send('PING :foo')
+            self.assertCommand(self.getMsg(conn), 'PONG', 'foo')
+            conn.close()
+
+        def testReceive(self):
+            conn = self.getConnection()
+            conn.send(':server 376 %s :End of /MOTD command.' % self.irc.nick)
+            self.runDrivers(lambda: self.irc.afterConnect)
+            conn.close()
+
+        def testThreadedSend(self):
+            conn = self.getConnection()
+            for i in range(3):
+                self.getMsg(conn) # CAP, NICK, USER
+            # The runner stops the loop after supybot.drivers.poll seconds,
+            # but the sender is woken as soon as the message is queued.
+            timer = threading.Timer(0.1, self.irc.sendMsg,
+                                    args=(ircmsgs.ping('bar'),))
+            start = time.time()
+            timer.start()
+            with conf.supybot.drivers.poll.context(3):
+                while conn.lines.empty():
+                    Asyncio.runner.run()
+                    self.assertTrue(time.time() < start + 10, 'timed out')
+            self.assertCommand(self.getMsg(conn), 'PING', 'bar')
+            self.assertTrue(conn.receivedAt - start < 1)
+            conn.close()
+
+        def testReconnect(self):
+            conn = self.getConnection()
+            self.getMsg(conn)
+            self.driver.reconnect()
+            while self.getMsg(conn) is not None:
+                pass
+            conn = self.getConnection()
+            self.assertCommand(self.getMsg(conn), 'CAP', 'LS', '302')
+            conn.close()
+
+        def testReconnectAfterDisconnect(self):
+            conn = self.getConnection()
+            self.getMsg(conn)
+            self.driver.currentDelay = 1
+            conn.close()
+            self.runDrivers(lambda: not self.driver.connected)
+            self.assertTrue(self.driver.nextReconnectTime is not None)
+            conn = self.getConnection()
+            self.assertCommand(self.getMsg(conn), 'CAP', 'LS', '302')
+            conn.close()
+
+        if ssl is not None and Asyncio.supportsStarttls:
+            def testStarttls(self):
+                self.config.requireStarttls.setValue(True)
+                # Before the first connection, so the Irc object is reset
+                # with the new value.
+                self.driver.reconnect()
+                conn = self.getConnection()
+                self.assertCommand(self.getMsg(conn), 'CAP', 'LS', '302')
+                self.assertCommand(self.getMsg(conn), 'STARTTLS')
+                self.assertCommand(self.getMsg(conn), 'NICK', self.irc.nick)
+                self.assertTrue(isinstance(conn.conn, ssl.SSLSocket))
+                self.assertTrue(
+                    self.driver.writer.get_extra_info('ssl_object'))
+                conn.send('PING :foo')
+                self.assertCommand(self.getMsg(conn), 'USER')
+                self.assertCommand(self.getMsg(conn), 'PONG', 'foo')
+                conn.close()
+
+    class NewDriverTestCase(SupyTestCase):
+        def testStarttlsFallback(self):
+            conf.registerNetwork('testasyncio')
+            config = conf.supybot.networks.get('testasyncio')
+            config.servers.setValue(['127.0.0.1:1'])
+            with config.requireStarttls.context(True), \
+                    config.ssl.context(False):
+                irc = irclib.Irc('testasyncio')
+                driver = drivers.newDriver(irc, 'Asyncio')
+                try:
+                    if Asyncio.supportsStarttls:
+                        self.assertEqual(driver.__class__.__name__,
+                                         'AsyncioDriver')
+                    else:
+                        self.assertEqual(driver.__class__.__name__,
+                                         'SocketDriver')
+                finally:
+                    driver.die()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -33,6 +33,7 @@ import copy
 import pickle
 
 import supybot.conf as conf
+import supybot.drivers as drivers
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 
@@ -89,6 +90,14 @@ class IrcMsgQueueTestCase(SupyTestCase):
         q.dequeue()
         self.failIf(self.msg in q)
 
+    def testContainsEqualMessages(self):
+        q = irclib.IrcMsgQueue()
+        q.enqueue(ircmsgs.IrcMsg('PRIVMSG #foo :bar'))
+        self.failUnless(ircmsgs.privmsg('#foo', 'bar') in q)
+        self.failIf(ircmsgs.privmsg('#foo', 'baz') in q)
+        q.reset()
+        self.failIf(ircmsgs.privmsg('#foo', 'bar') in q)
+
     def testRepr(self):
         q = irclib.IrcMsgQueue()
         self.assertEqual(repr(q), 'IrcMsgQueue([])')
@@ -103,6 +112,16 @@ class IrcMsgQueueTestCase(SupyTestCase):
         q = irclib.IrcMsgQueue()
         self.failIf(q)
 
+    def testPeek(self):
+        q = irclib.IrcMsgQueue()
+        self.assertEqual(q.peek(), None)
+        q.enqueue(self.msg)
+        q.enqueue(self.mode)
+        self.assertEqual(q.peek(), self.mode)
+        self.assertEqual(len(q), 2)
+        self.assertEqual(q.dequeue(), self.mode)
+        self.assertEqual(q.peek(), self.msg)
+
     def testEnqueueDequeue(self):
         q = irclib.IrcMsgQueue()
         q.enqueue(self.msg)
@@ -139,6 +158,32 @@ class IrcMsgQueueTestCase(SupyTestCase):
         self.assertEqual(self.msgs[0], q.dequeue())
         self.assertEqual(self.msgs[1], q.dequeue())
 
+    def testFairness(self):
+        q = irclib.IrcMsgQueue()
+        foo = [ircmsgs.privmsg('#foo', str(i)) for i in range(5)]
+        bar = [ircmsgs.privmsg('#bar', str(i)) for i in range(2)]
+        for msg in foo:
+            q.enqueue(msg)
+        self.assertEqual(q.dequeue(), foo[0])
+        for msg in bar:
+            q.enqueue(msg)
+        self.assertEqual(q.depths, {'#foo': 4, '#bar': 2})
+        self.assertEqual([q.dequeue() for i in range(6)],
+                         [foo[1], bar[0], foo[2], bar[1], foo[3], foo[4]])
+        self.assertEqual(q.depths, {})
+        self.assertEqual(q.finishTimes, {})
+        self.assertEqual(q.index, {})
+
+    def testFairnessKeepsPriorities(self):
+        q = irclib.IrcMsgQueue()
+        for i in range(3):
+            q.enqueue(ircmsgs.privmsg('#foo', str(i)))
+        q.enqueue(ircmsgs.privmsg('#bar', 'baz'))
+        q.enqueue(self.mode)
+        self.assertEqual(q.dequeue(), self.mode)
+        self.assertEqual(q.dequeue().args, ('#foo', '0'))
+        self.assertEqual(q.dequeue().args, ('#bar', 'baz'))
+
     def testNoIdenticals(self):
         configVar = conf.supybot.protocols.irc.queuing.duplicates
         original = configVar()
@@ -224,6 +269,132 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('quuz' in c.halfops)
         self.failIf('quuz' in c.voices)
 
+    def testMembers(self):
+        c = irclib.ChannelState()
+        c.addUser('@Foo')
+        c.addUser('+bar')
+        c.addUser('@%Baz[]')
+        self.assertEqual(sorted(c.users), ['Baz[]', 'Foo', 'bar'])
+        self.assertEqual(c.users, ircutils.IrcSet(['foo', 'BAR', 'baz{}']))
+        self.assertEqual(c.ops, ircutils.IrcSet(['foo', 'baz{}']))
+        self.assertEqual(len(c.users), 3)
+        self.assertEqual(len(c.halfops), 1)
+        self.failUnless(c.isOp('FOO'))
+        self.failUnless(c.isHalfopPlus('baz{}'))
+        self.failUnless(c.isVoicePlus('bar'))
+        self.failIf(c.isVoicePlus('qux'))
+        c.replaceUser('foo', 'Qux')
+        self.assertEqual(sorted(c.users), ['Baz[]', 'Qux', 'bar'])
+        self.failUnless(c.isOp('qux'))
+        self.failIf('foo' in c.ops)
+        c.ops.discard('qux')
+        self.failIf(c.isOp('qux'))
+        self.failUnless('qux' in c.users)
+        # Modes may be set on nicks we don't know about.
+        c.voices.add('quux')
+        self.failUnless(c.isVoice('quux'))
+        self.failIf('quux' in c.users)
+        self.assertEqual(len(c.users), 3)
+        c.removeUser('Baz[]')
+        c.voices.remove('quux')
+        self.assertEqual(sorted(c.members), ['bar', 'qux'])
+        self.assertEqual(c.nicks, {'bar': 'bar', 'qux': 'Qux'})
+        self.assertEqual((len(c.users), len(c.ops), len(c.halfops),
+                          len(c.voices)), (2, 0, 0, 1))
+        c.addUsers(['@bar', '+corge'])
+        self.assertEqual((len(c.users), len(c.ops), len(c.voices)),
+                         (3, 1, 2))
+        c1 = copy.deepcopy(c)
+        self.assertEqual(len(c1.voices), 2)
+
+    def testMembersOperators(self):
+        c = irclib.ChannelState()
+        c.addUsers(['@foo', 'bar', '+baz'])
+        self.assertEqual(c.users & ircutils.IrcSet(['FOO', 'qux']),
+                         ircutils.IrcSet(['foo']))
+        self.assertEqual(c.users - c.ops, ircutils.IrcSet(['bar', 'baz']))
+        self.assertEqual(c.ops | c.voices, ircutils.IrcSet(['foo', 'baz']))
+        self.failUnless(isinstance(c.users - c.ops, ircutils.IrcSet))
+
+
+class MessageHistoryTestCase(SupyTestCase):
+    def msg(self, target, text, nick='foo', at=None):
+        m = ircmsgs.privmsg(target, text, prefix='%s!bar@baz' % nick)
+        if at is not None:
+            m.tag('receivedAt', at)
+        return m
+
+    def testLast(self):
+        h = irclib.MessageHistory(10)
+        h.append(self.msg('#foo', 'one', at=1))
+        h.append(self.msg('#bar', 'two', nick='qux', at=2))
+        h.append(ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        h.append(self.msg('#FOO', 'three', nick='Qux', at=3))
+        # The JOIN is kept, but not searched.
+        self.assertEqual(len(h), 4)
+        self.assertEqual([m.args[1] for m in h.last(5)],
+                         ['three', 'two', 'one'])
+        self.assertEqual(h.last(), [self.msg('#FOO', 'three', nick='Qux')])
+        self.assertEqual(h.last()[0].receivedAt, 3)
+        self.assertEqual([m.args[1] for m in h.last(5, channel='#foo')],
+                         ['three', 'one'])
+        self.assertEqual([m.args[1] for m in h.last(5, nick='QUX')],
+                         ['three', 'two'])
+        self.assertEqual([m.args[1] for m in h.last(5, channel='#foo',
+                                                    nick='qux')],
+                         ['three'])
+        self.assertEqual([m.args[1] for m in h.last(5, regexp='^t')],
+                         ['three', 'two'])
+        self.assertEqual([m.args[1] for m in h.last(5, before=3)],
+                         ['two', 'one'])
+        self.assertEqual(h.last(5, channel='#baz'), [])
+        self.assertEqual(h.last(5, channel='#bar', nick='foo'), [])
+
+    def testMaxSize(self):
+        h = irclib.MessageHistory(4)
+        for i in range(12):
+            h.append(self.msg('#foo' if i % 2 else '#bar', str(i),
+                              nick='n%i' % i))
+        self.assertEqual(len(h), 4)
+        self.assertEqual([m.args[1] for m in h.last(10)],
+                         ['11', '10', '9', '8'])
+        self.assertEqual([m.args[1] for m in h.last(10, channel='#foo')],
+                         ['11', '9'])
+        self.assertEqual(h.last(10, nick='n5'), [])
+        # Nicks with no message left are forgotten.
+        self.assertEqual(sorted(h.byNick), ['n10', 'n11', 'n8', 'n9'])
+        self.failUnless(len(h.byTarget['#foo']) <= 4)
+        h.reset(2)
+        self.assertEqual(len(h), 0)
+        self.assertEqual(h.last(10), [])
+
+    def testView(self):
+        h = irclib.MessageHistory(6)
+        msgs = [ircmsgs.join('#foo', prefix='foo!bar@baz'),
+                self.msg('#foo', 'one'),
+                ircmsgs.IrcMsg('@time=2020-01-01T00:00:00.000Z '
+                               ':foo!bar@baz PRIVMSG #foo :two'),
+                ircmsgs.kick('#foo', 'qux', 'three', prefix='foo!bar@baz'),
+                ircmsgs.IrcMsg('PING')]
+        msgs[1].tag('receivedOn', 'test')
+        for msg in msgs:
+            h.append(msg)
+        view = irclib.HistoryView(h, 3)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(list(view), msgs[2:])
+        self.assertEqual(list(reversed(view)), msgs[:1:-1])
+        self.assertEqual(view[0], msgs[2])
+        self.assertEqual(view[-1], msgs[-1])
+        self.assertEqual(view[1:], msgs[3:])
+        self.assertRaises(IndexError, view.__getitem__, 3)
+        self.assertEqual(view[0].server_tags,
+                         {'time': '2020-01-01T00:00:00.000Z'})
+        self.assertEqual(view[0].time, msgs[2].time)
+        self.assertEqual(irclib.HistoryView(h, 10)[1].receivedOn, 'test')
+        for i in range(5):
+            h.append(self.msg('#foo', str(i)))
+        self.assertEqual([m.args[1] for m in view], ['2', '3', '4'])
+        self.assertEqual(len(irclib.HistoryView(h, 10)), 6)
 
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
@@ -336,6 +507,136 @@ class IrcStateTestCase(SupyTestCase):
         self.failIf('foo' in st.channels['#foo'].users)
         self.failUnless('foo' in st2.channels['#foo'].users)
 
+    def testNames(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 353 nick = #foo :@nick +foo'))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 353 nick = #foo :@+Bar baz'))
+        # Applied once the reply is over.
+        self.failIf('#foo' in st.channels)
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 366 nick #foo :End of /NAMES list.'))
+        c = st.channels['#foo']
+        self.assertEqual(sorted(c.users), ['Bar', 'baz', 'foo', 'nick'])
+        self.assertEqual(c.ops, ircutils.IrcSet(['nick', 'bar']))
+        self.assertEqual(c.voices, ircutils.IrcSet(['foo', 'bar']))
+        self.failIf('s' in c.modes)
+        self.assertEqual(st.nickToChannels('bar'), ircutils.IrcSet(['#foo']))
+
+    def testNamesUserhosts(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 353 nick @ #foo :@+foo!bar@baz qux!~quux@example.org'))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 366 nick #foo :End of /NAMES list.'))
+        c = st.channels['#foo']
+        self.assertEqual(sorted(c.users), ['foo', 'qux'])
+        self.failUnless(c.isOp('foo'))
+        self.failUnless(c.isVoice('foo'))
+        self.failIf(c.isVoicePlus('qux'))
+        self.failUnless('s' in c.modes)
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+        self.assertEqual(st.nickToHostmask('qux'), 'qux!~quux@example.org')
+
+    def testWho(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 352 nick #foo ~bar baz.example.org irc.server foo '
+            'H :0 Foo Bar'))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 354 nick 1 ~quux example.org qux 0'))
+        self.failIf('foo' in st.nicksToHostmasks)
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':irc.server 315 nick #foo :End of /WHO list.'))
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!~bar@baz.example.org')
+        self.assertEqual(st.nickToHostmask('qux'), 'qux!~quux@example.org')
+
+    def testHostmaskCache(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        with conf.supybot.protocols.irc.maxHostmasks.context(10):
+            for i in range(8):
+                st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                                    prefix='n%i!u@h' % i))
+            self.assertEqual(len(st.nicksToHostmasks), 10)
+            self.assertEqual(st.nickToHostmask('n0'), 'n0!u@h')
+            st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                                prefix='n8!u@h'))
+        # Users in channels and recently used hostmasks are kept.
+        self.assertEqual(len(st.nicksToHostmasks), 9)
+        self.assertEqual(st.nicksToHostmasks.evictions, 2)
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+        self.assertEqual(st.nickToHostmask('n0'), 'n0!u@h')
+        self.assertEqual(st.nickToHostmask('n8'), 'n8!u@h')
+        self.assertRaises(KeyError, st.nickToHostmask, 'n1')
+        self.assertEqual(st.nicksToHostmasks.misses, 1)
+        st2 = st.copy()
+        self.failUnless(st2.nicksToHostmasks.channels is st2.channels)
+        st.nicksToHostmasks.evict(0)
+        self.assertEqual(sorted(st.nicksToHostmasks), ['foo', 'nick'])
+
+    def testHostmaskCacheOfUsersInChannels(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        evictions = []
+        evict = st.nicksToHostmasks.evict
+        st.nicksToHostmasks.evict = lambda size: evictions.append(evict(size))
+        with conf.supybot.protocols.irc.maxHostmasks.context(100):
+            for i in range(110):
+                st.addMsg(self.irc, ircmsgs.join('#foo',
+                                                 prefix='u%i!u@h' % i))
+            self.assertEqual(len(st.nicksToHostmasks), 111)
+            self.assertEqual(len(evictions), 1)
+            # Nothing could be evicted, so it waits for ten more hostmasks.
+            for i in range(11):
+                st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                                    prefix='n%i!u@h' % i))
+            self.assertEqual(len(evictions), 2)
+            st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                                prefix='n11!u@h'))
+            self.assertEqual(len(evictions), 3)
+        self.assertEqual(len(st.nicksToHostmasks), 112)
+        self.assertEqual(st.nicksToHostmasks.evictions, 11)
+        self.assertEqual(st.nickToHostmask('n11'), 'n11!u@h')
+
+    def testNickToChannels(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        self.assertEqual(st.nickToChannels('FOO'),
+                         ircutils.IrcSet(['#foo', '#bar']))
+        st.addMsg(self.irc, ircmsgs.part('#bar', prefix='foo!bar@baz'))
+        self.assertEqual(st.nickToChannels('foo'), ircutils.IrcSet(['#foo']))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':foo!bar@baz NICK qux'))
+        self.assertEqual(st.nickToChannels('foo'), ircutils.IrcSet())
+        self.assertEqual(st.nickToChannels('qux'), ircutils.IrcSet(['#foo']))
+        st.addMsg(self.irc, ircmsgs.kick('#foo', 'qux',
+                                         prefix=self.irc.prefix))
+        self.assertEqual(st.nickToChannels('qux'), ircutils.IrcSet())
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='qux!bar@baz'))
+        st2 = st.copy()
+        st3 = pickle.loads(pickle.dumps(st))
+        st.addMsg(self.irc, ircmsgs.quit(prefix='qux!bar@baz'))
+        self.assertEqual(st.nickToChannels('qux'), ircutils.IrcSet())
+        self.assertEqual(st2.nickToChannels('qux'), ircutils.IrcSet(['#foo']))
+        self.assertEqual(st3.nickToChannels('qux'), ircutils.IrcSet(['#foo']))
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix=self.irc.prefix))
+        self.assertEqual(st.nickToChannels(self.irc.nick),
+                         ircutils.IrcSet(['#bar']))
+        # Channels added directly are indexed as well.
+        chan = irclib.ChannelState()
+        chan.addUser('@foo')
+        st.channels['#baz'] = chan
+        self.assertEqual(st.nickToChannels('foo'), ircutils.IrcSet(['#baz']))
+        st.channels['#baz'] = irclib.ChannelState()
+        self.assertEqual(st.nickToChannels('foo'), ircutils.IrcSet())
+        st.reset()
+        self.assertEqual(st.nickToChannels(self.irc.nick), ircutils.IrcSet())
+
 
     def testEq(self):
         state1 = irclib.IrcState()
@@ -441,10 +742,151 @@ class IrcTestCase(SupyTestCase):
         msg = self.irc.takeMsg()
         self.failUnless(msg.command == 'NOTICE')
 
+    def testDeadline(self):
+        throttleTime = conf.supybot.protocols.irc.throttleTime
+        burst = conf.supybot.protocols.irc.queuing.burst
+        originals = (throttleTime(), burst())
+        try:
+            throttleTime.setValue(10)
+            burst.setValue(1)
+            self.irc.queueMsg(ircmsgs.privmsg('#foo', 'bar'))
+            self.irc.queueMsg(ircmsgs.privmsg('#foo', 'baz'))
+            self.assertEqual(self.irc.takeMsg().args[1], 'bar')
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.assertEqual(self.irc.getDeadline(), self.irc.lastTake + 10)
+            self.irc.sendMsg(ircmsgs.privmsg('#foo', 'qux'))
+            self.failUnless(self.irc.getDeadline() <= time.time())
+        finally:
+            throttleTime.setValue(originals[0])
+            burst.setValue(originals[1])
+
+    def testWhoOnDemand(self):
+        self.assertRaises(KeyError, self.irc.state.nickToHostmask, 'foo')
+        self.assertEqual(self.irc.takeMsg(), None)
+        with conf.supybot.protocols.irc.whoOnDemand.context(True):
+            self.assertRaises(KeyError, self.irc.state.nickToHostmask, 'foo')
+            self.assertRaises(KeyError, self.irc.state.nickToHostmask, 'FOO')
+            self.assertRaises(KeyError, self.irc.state.nickToHostmask, '#foo')
+        self.failUnless(self.irc.getDeadline() <= time.time())
+        self.assertEqual(self.irc.takeMsg(), ircmsgs.who('foo'))
+        self.assertEqual(self.irc.takeMsg(), None)
+        self.irc.feedMsg(ircmsgs.IrcMsg(
+            ':irc.server 352 test * ~bar baz irc.server foo H :0 Foo'))
+        self.irc.feedMsg(ircmsgs.IrcMsg(
+            ':irc.server 315 test foo :End of /WHO list.'))
+        self.assertEqual(self.irc.state.nickToHostmask('foo'), 'foo!~bar@baz')
+
+    def testStageTimes(self):
+        self.irc.feedMsg(ircmsgs.ping('foo'))
+        self.failIf(self.irc.stageTimes)
+        with conf.supybot.debug.instrument.context(True):
+            self.irc.feedMsg(drivers.parseMsg('PING :foo'))
+            self.irc.takeMsg()
+        self.irc.feedMsg(ircmsgs.ping('foo'))
+        self.irc.takeMsg()
+        times = self.irc.stageTimes
+        self.failUnless(times)
+        for stage in times.stages:
+            self.assertEqual(times.counts[stage], 1, stage)
+            self.failUnless(times.average(stage) >= 0, stage)
+        times.reset()
+        self.failIf(times)
+        self.assertEqual(times.average('parse'), None)
+
+    def testBurst(self):
+        throttleTime = conf.supybot.protocols.irc.throttleTime
+        burst = conf.supybot.protocols.irc.queuing.burst
+        originals = (throttleTime(), burst())
+        try:
+            throttleTime.setValue(10)
+            burst.setValue(3)
+            msgs = [ircmsgs.privmsg('#foo', str(i)) for i in range(4)]
+            for msg in msgs:
+                self.irc.queueMsg(msg)
+            self.assertEqual(self.irc.takeMsg(), msgs[0])
+            self.assertEqual(self.irc.takeMsg(), msgs[1])
+            self.assertEqual(self.irc.takeMsg(), msgs[2])
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.failUnless(self.irc.getDeadline() > time.time() + 9)
+            self.irc.penaltyTime -= 10
+            self.assertEqual(self.irc.takeMsg(), msgs[3])
+        finally:
+            throttleTime.setValue(originals[0])
+            burst.setValue(originals[1])
+
+    def testPenalty(self):
+        throttleTime = conf.supybot.protocols.irc.throttleTime
+        burst = conf.supybot.protocols.irc.queuing.burst
+        originals = (throttleTime(), burst())
+        try:
+            throttleTime.setValue(10)
+            burst.setValue(3)
+            # Costs more than the allowance; sent only because the penalty
+            # clock is not ahead of the current time.
+            self.irc.queueMsg(ircmsgs.IrcMsg('LIST'))
+            self.irc.queueMsg(ircmsgs.who('#foo'))
+            self.assertEqual(self.irc.takeMsg().command, 'LIST')
+            self.assertEqual(self.irc.takeMsg(), None)
+            # LIST cost the whole allowance, so the clock is 30 seconds
+            # ahead; WHO costs 20 seconds, so it can be sent when the clock
+            # is at most 10 seconds ahead.
+            self.irc.penaltyTime -= 19
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.irc.penaltyTime -= 2
+            self.assertEqual(self.irc.takeMsg().command, 'WHO')
+        finally:
+            throttleTime.setValue(originals[0])
+            burst.setValue(originals[1])
+
+    def testDefaultPenalty(self):
+        throttleTime = conf.supybot.protocols.irc.throttleTime
+        original = throttleTime()
+        try:
+            throttleTime.setValue(10)
+            # The default burst is large enough for WHO to cost more than
+            # PRIVMSG.
+            for i in range(3):
+                self.irc.queueMsg(ircmsgs.who('#foo%s' % i))
+            self.assertEqual(self.irc.takeMsg().command, 'WHO')
+            self.assertEqual(self.irc.takeMsg().command, 'WHO')
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.irc.penaltyTime = time.time()
+            self.assertEqual(self.irc.takeMsg().command, 'WHO')
+            self.irc.penaltyTime = time.time()
+            for i in range(6):
+                self.irc.queueMsg(ircmsgs.privmsg('#foo', str(i)))
+            for i in range(5):
+                self.assertEqual(self.irc.takeMsg().args[1], str(i))
+            self.assertEqual(self.irc.takeMsg(), None)
+        finally:
+            throttleTime.setValue(original)
+
+    def testPenaltyWithoutBurst(self):
+        throttleTime = conf.supybot.protocols.irc.throttleTime
+        burst = conf.supybot.protocols.irc.queuing.burst
+        originals = (throttleTime(), burst())
+        try:
+            throttleTime.setValue(10)
+            burst.setValue(1)
+            # With a burst of 1, all messages are sent every throttleTime
+            # seconds, as before penalties.
+            self.irc.queueMsg(ircmsgs.IrcMsg(command='NAMES', args=('#foo',)))
+            self.irc.queueMsg(ircmsgs.IrcMsg('LIST'))
+            self.assertEqual(self.irc.takeMsg().command, 'NAMES')
+            self.assertEqual(self.irc.takeMsg(), None)
+            self.irc.penaltyTime -= 10
+            self.assertEqual(self.irc.takeMsg().command, 'LIST')
+            self.failUnless(self.irc.penaltyTime <= time.time() + 10)
+        finally:
+            throttleTime.setValue(originals[0])
+            burst.setValue(originals[1])
+
     def testNoMsgLongerThan512(self):
         self.irc.queueMsg(ircmsgs.privmsg('whocares', 'x'*1000))
         msg = self.irc.takeMsg()
         self.failUnless(len(msg) <= 512, 'len(msg) was %s' % len(msg))
+        self.failUnless(len(bytes(msg)) <= 512,
+                        'len(bytes(msg)) was %s' % len(bytes(msg)))
 
     def testReset(self):
         for msg in msgs:
@@ -745,6 +1187,41 @@ class IrcCallbackTestCase(SupyTestCase):
         commands = list(map(makeCommand, msgs))
         self.assertEqual(doCommandCatcher.L, commands)
 
+    def testDispatchTables(self):
+        L = []
+        class PingCatcher(irclib.IrcCallback):
+            def doPing(self, irc, msg):
+                L.append((self.name(), msg.command))
+        class AllCatcher(irclib.IrcCallback):
+            def __call__(self, irc, msg):
+                L.append((self.name(), msg.command))
+        class InFilter(irclib.IrcCallback):
+            def inFilter(self, irc, msg):
+                L.append((self.name(), 'inFilter'))
+                return msg
+        irc = irclib.Irc('test', callbacks=[])
+        try:
+            for cb in (PingCatcher(), AllCatcher(), InFilter()):
+                irc.addCallback(cb)
+            self.assertEqual([cb.name() for cb in irc._getInFilters()],
+                             ['InFilter'])
+            self.assertEqual(irc._getOutFilters(), [])
+            irc.feedMsg(ircmsgs.ping('foo'))
+            self.assertEqual(sorted(L), [('AllCatcher', 'PING'),
+                                         ('InFilter', 'inFilter'),
+                                         ('PingCatcher', 'PING')])
+            L[:] = []
+            irc.feedMsg(ircmsgs.notice('foo', 'bar'))
+            self.assertEqual(sorted(L), [('AllCatcher', 'NOTICE'),
+                                         ('InFilter', 'inFilter')])
+            L[:] = []
+            irc.removeCallback('AllCatcher')
+            irc.feedMsg(ircmsgs.ping('foo'))
+            self.assertEqual(sorted(L), [('InFilter', 'inFilter'),
+                                         ('PingCatcher', 'PING')])
+        finally:
+            irc._reallyDie()
+
     def testFirstCommands(self):
         try:
             originalNick = conf.supybot.nick()
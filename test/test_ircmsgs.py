@@ -61,6 +61,14 @@ class IrcMsgTestCase(SupyTestCase):
             self.failIf(rawmsg != strmsg and \
                         strmsg.replace(':', '') == strmsg)
 
+    def testBytes(self):
+        msg = ircmsgs.privmsg('#foo', 'bar')
+        self.assertEqual(bytes(msg), b'PRIVMSG #foo :bar\r\n')
+        self.assertTrue(bytes(msg) is bytes(msg)) # Only encoded once
+        if minisix.PY3:
+            msg = ircmsgs.privmsg('#foo', 'caf\xe9')
+            self.assertEqual(bytes(msg), b'PRIVMSG #foo :caf\xc3\xa9\r\n')
+
     def testEq(self):
         for msg in msgs:
             self.assertEqual(msg, msg)
@@ -113,6 +121,16 @@ class IrcMsgTestCase(SupyTestCase):
                 zeroes += 1
         self.failIf(zeroes > (len(msgs)/10), 'Too many zero hashes.')
 
+    def testHashAndEq(self):
+        msg1 = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #foo :bar baz')
+        msg2 = ircmsgs.privmsg('#foo', 'bar baz', prefix='foo!bar@baz')
+        msg3 = ircmsgs.privmsg('#foo', 'bar', prefix='foo!bar@baz')
+        self.assertEqual(msg1, msg2)
+        self.assertEqual(hash(msg1), hash(msg2))
+        self.assertNotEqual(msg1, msg3)
+        self.assertEqual(len(set([msg1, msg2, msg3])), 2)
+        self.failUnless(msg1.command is msg2.command) # Interned
+
     def testMsgKeywordHandledProperly(self):
         msg = ircmsgs.notice('foo', 'bar')
         msg2 = ircmsgs.IrcMsg(msg=msg, command='PRIVMSG')
@@ -157,6 +175,34 @@ class IrcMsgTestCase(SupyTestCase):
                              ':Angel!angel@example.org PRIVMSG Wiz :Hello')
         self.assertEqual(msg.time, 1319042451.62)
 
+        msg = ircmsgs.IrcMsg('@time=2011-10-19T16:40:51.6Z '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        self.assertEqual(msg.time, 1319042451.6)
+
+        # Invalid time tags are ignored
+        before = time.time()
+        msg = ircmsgs.IrcMsg('@time=2011-13-19T16:40:51.620Z '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        after = time.time()
+        self.assertTrue(before <= msg.time <= after)
+
+    def testLazyAttributes(self):
+        msg = ircmsgs.IrcMsg('@time=2011-10-19T16:40:51.620Z;account=angel '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        copy = ircmsgs.IrcMsg(prefix='foo!bar@baz', msg=msg)
+        self.assertEqual((msg.nick, msg.user, msg.host),
+                         ('Angel', 'angel', 'example.org'))
+        self.assertEqual((copy.nick, copy.user, copy.host),
+                         ('foo', 'bar', 'baz'))
+        self.assertEqual(copy.time, 1319042451.62)
+        self.assertEqual(copy.server_tags['account'], 'angel')
+        msg.time = 42
+        self.assertEqual(msg.time, 42)
+        self.assertEqual(msg.server_tags['account'], 'angel')
+        msg = ircmsgs.IrcMsg(':irc.example.org 001 Wiz :Welcome')
+        self.assertEqual((msg.nick, msg.user, msg.host),
+                         ('irc.example.org',)*3)
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
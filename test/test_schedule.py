@@ -73,6 +73,16 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testDeadline(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.getDeadline(), None)
+        t = time.time() + 3
+        sched.addEvent(lambda: None, t + 2)
+        n = sched.addEvent(lambda: None, t)
+        self.assertEqual(sched.getDeadline(), t)
+        sched.removeEvent(n)
+        self.assertEqual(sched.getDeadline(), t + 2)
+
     def testPeriodic(self):
         sched = schedule.Schedule()
         i = [0]
@@ -1147,6 +1147,30 @@ class TestCacheDict(SupyTestCase):
             self.failUnless(i in d)
             self.failUnless(d[i] == i)
 
+class TestLRUCacheDict(SupyTestCase):
+    def testMaxNeverExceeded(self):
+        max = 10
+        d = LRUCacheDict(10)
+        for i in xrange(max**2):
+            d[i] = i
+            self.failUnless(len(d) <= max)
+            self.failUnless(i in d)
+            self.failUnless(d[i] == i)
+
+    def testLeastRecentlyUsedIsForgotten(self):
+        d = LRUCacheDict(3, a=1)
+        d['b'] = 2
+        d['c'] = 3
+        self.assertEqual(d['a'], 1)
+        d['b'] = 4
+        d['d'] = 5
+        self.assertEqual(list(d), ['a', 'b', 'd'])
+        del d['b']
+        d['e'] = 6
+        d['f'] = 7
+        self.assertEqual(list(d), ['d', 'e', 'f'])
+        self.assertEqual(dict(d.items()), {'d': 5, 'e': 6, 'f': 7})
+
 class TestTruncatableSet(SupyTestCase):
     def testBasics(self):
         s = TruncatableSet(['foo', 'bar', 'baz', 'qux'])